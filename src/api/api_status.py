@@ -1,11 +1,16 @@
 from datetime import datetime
+import asyncio
+import logging
+import time
 import psutil
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Set, Tuple
 from pydantic import BaseModel
-import redis
+from redis import asyncio as aioredis
 import os
 import json
 
+logger = logging.getLogger(__name__)
+
 
 class StatusResponse(BaseModel):
     status: str
@@ -17,77 +22,190 @@ class StatusResponse(BaseModel):
 
 
 class APIStatus:
-    def __init__(self):
+    """
+    Счетчики запросов API.
+
+    Запросы считаются в памяти процесса без обращения к Redis, а фоновая
+    задача раз в flush_interval секунд сбрасывает накопленное одним пайплайном
+    INCRBY. Дневной счетчик хранится в отдельном ключе на каждый день (UTC),
+    поэтому смена дня происходит на стороне Redis без SET-ов и проверок.
+    """
+
+    TOTAL_KEY = "api:total_requests"
+    DAY_KEY_PREFIX = "api:requests_day:"
+    # Дневные ключи храним пару дней, чтобы не копить их бесконечно
+    DAY_KEY_TTL = 3 * 86400
+    # HyperLogLog активных API ключей за день и за месяц (~12 КБ на ключ Redis)
+    ACTIVE_DAY_KEY_PREFIX = "api:active_keys:day:"
+    ACTIVE_MONTH_KEY_PREFIX = "api:active_keys:month:"
+    ACTIVE_MONTH_KEY_TTL = 62 * 86400
+
+    def __init__(self, flush_interval: float = 0.25, status_cache_ttl: float = 5.0):
         self.start_time = datetime.utcnow()
         self.version = "1.0.0"
         self.monthly_limit = 1000
+        self.flush_interval = flush_interval
+        self.status_cache_ttl = status_cache_ttl
 
         # Подключение к Redis
         self.redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-        self.redis = redis.from_url(self.redis_url)
-
-        # Инициализация счетчиков, если их нет
-        if not self.redis.exists("api:total_requests"):
-            self.redis.set("api:total_requests", 0)
-        if not self.redis.exists("api:requests_today"):
-            self.redis.set("api:requests_today", 0)
-
-        # Установка времени запуска
-        self.redis.set("api:start_time", self.start_time.isoformat())
+        self.redis = aioredis.from_url(self.redis_url, decode_responses=True)
+
+        # Несброшенные приращения: общий счетчик и по дням
+        self._pending_total = 0
+        self._pending_days: Dict[str, int] = {}
+        # API ключи, сделавшие запросы с момента последнего сброса
+        self._pending_keys: Set[str] = set()
+        # Последнее известное значение общего счетчика в Redis
+        self._known_total = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        # Закэшированный ответ /api/status: (момент истечения, ответ)
+        self._status_cache: Optional[Tuple[float, StatusResponse]] = None
+
+    @classmethod
+    def day_key(cls, moment: datetime) -> str:
+        return f"{cls.DAY_KEY_PREFIX}{moment.strftime('%Y-%m-%d')}"
+
+    @classmethod
+    def active_day_key(cls, moment: datetime) -> str:
+        return f"{cls.ACTIVE_DAY_KEY_PREFIX}{moment.strftime('%Y-%m-%d')}"
+
+    @classmethod
+    def active_month_key(cls, moment: datetime) -> str:
+        return f"{cls.ACTIVE_MONTH_KEY_PREFIX}{moment.strftime('%Y-%m')}"
+
+    def record_active_key(self, api_key: str) -> None:
+        """Отмечает API ключ как активный; в Redis попадет при следующем сбросе."""
+        self._pending_keys.add(api_key)
+
+    def increment_request_count(self) -> int:
+        """
+        Учитывает запрос в памяти и возвращает оценку общего числа запросов.
+
+        Не блокирует цикл событий: обращений к Redis здесь нет.
+        Оценка отстает от кластерного значения не более чем на интервал сброса.
+        """
+        day_key = self.day_key(datetime.utcnow())
+        self._pending_total += 1
+        self._pending_days[day_key] = self._pending_days.get(day_key, 0) + 1
+        return self._known_total + self._pending_total
+
+    async def flush(self) -> None:
+        """Сбрасывает накопленные счетчики в Redis одним пайплайном."""
+        pending_total, self._pending_total = self._pending_total, 0
+        pending_days, self._pending_days = self._pending_days, {}
+        pending_keys, self._pending_keys = self._pending_keys, set()
+        if not pending_total and not pending_keys:
+            return
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.incrby(self.TOTAL_KEY, pending_total)
+                for day_key, count in pending_days.items():
+                    pipe.incrby(day_key, count)
+                    pipe.expire(day_key, self.DAY_KEY_TTL)
+                if pending_keys:
+                    now = datetime.utcnow()
+                    active_day_key = self.active_day_key(now)
+                    active_month_key = self.active_month_key(now)
+                    pipe.pfadd(active_day_key, *pending_keys)
+                    pipe.expire(active_day_key, self.DAY_KEY_TTL)
+                    pipe.pfadd(active_month_key, *pending_keys)
+                    pipe.expire(active_month_key, self.ACTIVE_MONTH_KEY_TTL)
+                results = await pipe.execute()
+            self._known_total = int(results[0])
+        except Exception as e:
+            logger.error(f"Failed to flush request counters to Redis: {e}")
+            # Возвращаем приращения, чтобы не потерять их при следующей попытке
+            self._pending_total += pending_total
+            for day_key, count in pending_days.items():
+                self._pending_days[day_key] = self._pending_days.get(day_key, 0) + count
+            self._pending_keys |= pending_keys
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        """Запускает фоновый сброс счетчиков и фиксирует время запуска."""
+        try:
+            await self.redis.set("api:start_time", self.start_time.isoformat())
+            self._known_total = int(await self.redis.get(self.TOTAL_KEY) or 0)
+        except Exception as e:
+            logger.error(f"Failed to initialize request counters in Redis: {e}")
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сброс и сбрасывает остаток."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+        await self.redis.close()
+
+    async def get_status(self) -> StatusResponse:
+        """
+        Возвращает статус API.
+
+        Стоимость не зависит от числа пользователей: активные ключи оцениваются
+        через PFCOUNT, а готовый ответ кэшируется на status_cache_ttl секунд.
+        """
+        cached = self._status_cache
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
 
-        # Последний сброс
-        today = self.start_time.replace(hour=0, minute=0, second=0, microsecond=0)
-        if not self.redis.exists("api:last_reset"):
-            self.redis.set("api:last_reset", today.isoformat())
-
-    def increment_request_count(self):
-        # Увеличиваем общий счетчик
-        self.redis.incr("api:total_requests")
-
-        # Проверяем, наступил ли новый день
         now = datetime.utcnow()
-        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
-
-        last_reset_str = self.redis.get("api:last_reset").decode("utf-8")
-        last_reset = datetime.fromisoformat(last_reset_str)
-
-        if today > last_reset:
-            self.redis.set("api:requests_today", 0)
-            self.redis.set("api:last_reset", today.isoformat())
+        # Получаем данные из Redis
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get("api:start_time")
+            pipe.get(self.TOTAL_KEY)
+            pipe.get(self.day_key(now))
+            pipe.pfcount(self.active_day_key(now))
+            pipe.pfcount(self.active_month_key(now))
+            (
+                start_time_str,
+                total_requests,
+                requests_today,
+                active_users,
+                active_users_month,
+            ) = await pipe.execute()
+
+        start_time = (
+            datetime.fromisoformat(start_time_str) if start_time_str else self.start_time
+        )
+        uptime = str(now - start_time).split(".")[0]  # без микросекунд
 
-        # Увеличиваем дневной счетчик
-        self.redis.incr("api:requests_today")
+        # Добавляем еще не сброшенные запросы этого воркера
+        total_requests = int(total_requests or 0) + self._pending_total
+        requests_today = int(requests_today or 0) + self._pending_days.get(
+            self.day_key(now), 0
+        )
 
-    def get_status(self):
-        # Получаем данные из Redis
-        start_time_str = self.redis.get("api:start_time").decode("utf-8")
-        start_time = datetime.fromisoformat(start_time_str)
-        uptime = str(datetime.utcnow() - start_time).split(".")[0]  # без микросекунд
-
-        total_requests = int(self.redis.get("api:total_requests"))
-        requests_today = int(self.redis.get("api:requests_today"))
-
-        # Получаем информацию о количестве пользователей
-        active_users = 0
-        api_keys = self.redis.keys("ratelimit:*:count")
-        if api_keys:
-            active_users = len(
-                set([key.decode("utf-8").split(":")[1] for key in api_keys])
-            )
-
-        return StatusResponse(
+        status = StatusResponse(
             status="online",
             request_count={
                 "total": total_requests,
                 "today": requests_today,
-                "active_users": active_users,
+                "active_users": int(active_users or 0),
+                "active_users_month": int(active_users_month or 0),
             },
             uptime=uptime,
             version=self.version,
             limits={"monthly_limit": self.monthly_limit},
             message="API работает нормально. Лимит на каждый API ключ: 1000 запросов в месяц.",
         )
+        self._status_cache = (time.monotonic() + self.status_cache_ttl, status)
+        return status
 
 
 # Создаем глобальный трекер статуса
-api_status = APIStatus()
+api_status = APIStatus(
+    flush_interval=float(os.getenv("REQUEST_COUNTER_FLUSH_INTERVAL", "0.25")),
+    status_cache_ttl=float(os.getenv("STATUS_CACHE_TTL", "5")),
+)
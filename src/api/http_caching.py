@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+from typing import List, Optional, Pattern, Tuple
+from starlette.routing import compile_path
+
+logger = logging.getLogger(__name__)
+
+# Входит в каждый ETag: увеличивается, когда меняется формат ответов,
+# чтобы клиенты не получали 304 на представление от старой версии API
+HTTP_ETAG_VERSION = os.getenv("HTTP_ETAG_VERSION", "1")
+
+# Списывать ли квоту за ответ 304: "count" - как за обычный запрос,
+# "free" - условный запрос с совпавшим ETag квоту не расходует
+NOT_MODIFIED_QUOTA_COUNT = "count"
+NOT_MODIFIED_QUOTA_FREE = "free"
+
+CACHE_CONTROL_HEADER = b"cache-control"
+VARY_HEADER = b"vary"
+ETAG_HEADER = b"etag"
+
+
+class HttpCachePolicy:
+    """
+    HTTP-кэширование ответов одного маршрута каталога.
+
+    Ответ маршрута зависит только от пути, query-строки и содержимого
+    каталога, поэтому сильный ETag строится без выполнения обработчика:
+    из поколения каталога и хэша пути с query. Политика без etag
+    (например, для /random) только запрещает кэширование.
+
+    Если ответ зависит не только от каталога (например, /search отвечает
+    из индекса в памяти или из SQL, пока индекс перестраивается),
+    политика с content_etag берет ETag по хэшу тела: от кэша ответов
+    или посчитанный middleware. Раннего 304 без обработчика у таких
+    маршрутов нет.
+    """
+
+    def __init__(
+        self,
+        max_age: int = 0,
+        stale_while_revalidate: int = 0,
+        etag: bool = True,
+        no_store: bool = False,
+        content_etag: bool = False,
+    ):
+        self.content_etag = content_etag and not no_store
+        self.etag_enabled = etag and not no_store and not content_etag
+        if no_store:
+            cache_control = "no-store"
+        else:
+            cache_control = f"max-age={max_age}"
+            if stale_while_revalidate:
+                cache_control += f", stale-while-revalidate={stale_while_revalidate}"
+        self.cache_control = cache_control.encode("latin-1")
+
+    def etag(self, path: str, query_string: bytes, generation: int) -> Optional[bytes]:
+        if not self.etag_enabled:
+            return None
+        digest = hashlib.blake2b(
+            path.encode("utf-8") + b"?" + query_string, digest_size=12
+        ).hexdigest()
+        return f'"{HTTP_ETAG_VERSION}.{generation}.{digest}"'.encode("latin-1")
+
+    def headers(self, etag: Optional[bytes]) -> List[Tuple[bytes, bytes]]:
+        headers = [
+            (CACHE_CONTROL_HEADER, self.cache_control),
+            # Каталог доступен только с ключом: общий кэш хранит ответы по ключам
+            (VARY_HEADER, b"X-API-Key"),
+        ]
+        if etag is not None:
+            headers.append((ETAG_HEADER, etag))
+        return headers
+
+
+class HttpCachePolicies:
+    """Реестр политик HTTP-кэширования по шаблонам путей (как в маршрутах)."""
+
+    def __init__(self, not_modified_quota: str = NOT_MODIFIED_QUOTA_COUNT):
+        if not_modified_quota not in (NOT_MODIFIED_QUOTA_COUNT, NOT_MODIFIED_QUOTA_FREE):
+            logger.error(
+                f"Unknown 304 quota policy '{not_modified_quota}', using '{NOT_MODIFIED_QUOTA_COUNT}'"
+            )
+            not_modified_quota = NOT_MODIFIED_QUOTA_COUNT
+        self.not_modified_quota = not_modified_quota
+        self._policies: List[Tuple[Pattern, HttpCachePolicy]] = []
+
+    @property
+    def not_modified_is_free(self) -> bool:
+        return self.not_modified_quota == NOT_MODIFIED_QUOTA_FREE
+
+    def register(self, path: str, policy: HttpCachePolicy) -> None:
+        """Регистрирует политику для шаблона пути, например "/movies/{movie_id:int}"."""
+        regex, _, _ = compile_path(path)
+        self._policies.append((regex, policy))
+
+    def lookup(self, path: str) -> Optional[HttpCachePolicy]:
+        for regex, policy in self._policies:
+            if regex.match(path):
+                return policy
+        return None
+
+
+http_cache_policies = HttpCachePolicies(
+    not_modified_quota=os.getenv("HTTP_304_QUOTA_POLICY", NOT_MODIFIED_QUOTA_COUNT)
+)
+
+# Маршруты movies_router. Сроки свежести короткие: повторная проверка
+# по ETag дешевая и не доходит до обработчика и БД
+for _path, _policy in (
+    ("/genres", HttpCachePolicy(max_age=3600, stale_while_revalidate=600)),
+    ("/stats/genres", HttpCachePolicy(max_age=3600, stale_while_revalidate=600)),
+    ("/stats/top", HttpCachePolicy(max_age=600, stale_while_revalidate=300)),
+    ("/genre/{genre}", HttpCachePolicy(max_age=600, stale_while_revalidate=300)),
+    ("/movies", HttpCachePolicy(max_age=300, stale_while_revalidate=60)),
+    ("/movies/{movie_id:int}", HttpCachePolicy(max_age=3600, stale_while_revalidate=600)),
+    ("/{movie_id:int}/full", HttpCachePolicy(max_age=3600, stale_while_revalidate=600)),
+    ("/{movie_id:int}/similar", HttpCachePolicy(max_age=3600, stale_while_revalidate=600)),
+    # Ответ зависит от того, кто ответил (индекс в памяти или SQL): ETag по телу
+    (
+        "/search",
+        HttpCachePolicy(max_age=300, stale_while_revalidate=60, content_etag=True),
+    ),
+    (
+        "/filter",
+        HttpCachePolicy(max_age=300, stale_while_revalidate=60, content_etag=True),
+    ),
+    (
+        "/autocomplete",
+        HttpCachePolicy(max_age=300, stale_while_revalidate=60, content_etag=True),
+    ),
+    # Каждый ответ случайный: не кэшируется и не получает ETag
+    ("/random", HttpCachePolicy(no_store=True)),
+):
+    http_cache_policies.register(_path, _policy)
@@ -1,250 +1,349 @@
-from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import status
+from fastapi.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from datetime import datetime
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
 from ..db.models import User
 from ..db.db import get_db
-from sqlalchemy.future import select
-from ..services.rate_limiter import rate_limiter, RateLimiter
-from importlib import reload
-from redis import asyncio as aioredis
-from fastapi import Response, status, Depends
-from fastapi.responses import JSONResponse
-from fastapi.security import APIKeyHeader
-from starlette.middleware.base import RequestResponseEndpoint
-from ..services.user_service import UserService
-from .api_status import api_status, StatusResponse
+from ..services.rate_limiter import (
+    rate_limiter,
+    RateLimiter,
+    FractionalQuota,
+    fractional_quotas,
+)
+from ..services.user_cache import user_cache, CachedUser
+from .api_status import api_status, APIStatus
+from .http_caching import HttpCachePolicies, http_cache_policies, CACHE_CONTROL_HEADER
+from ..utils.catalog_generation import catalog_generation
+from ..utils.caching import content_hash
 from ..db.schemas import MessageResponse
 import logging
+from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
-api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
-
-
-class APIMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
-        print("============= MIDDLEWARE ВЫЗВАН =============")
-
-        # Пути, для которых нужна точная проверка
-        exact_public_paths = ["/api/register", "/api/openapi.json"]
-
-        # Пути, для которых проверяем только начало
-        prefix_public_paths = ["/docs", "/redoc", "/register", "/static", "/status"]
-
-        # Сначала проверяем точное соответствие
-        if request.url.path in exact_public_paths:
-            print(
-                f"============= ПРОПУСКАЕМ ТОЧНЫЙ ПУБЛИЧНЫЙ ПУТЬ: {request.url.path} ============="
-            )
-            return await call_next(request)
-
-        # Затем проверяем по префиксу
-        if any(
-            request.url.path == "/" or request.url.path.startswith(prefix + "/")
-            for prefix in prefix_public_paths
-        ):
-            print(
-                f"============= ПРОПУСКАЕМ ПУТЬ ПО ПРЕФИКСУ: {request.url.path} ============="
-            )
-            return await call_next(request)
-
-        # Проверяем API ключ только для остальных API запросов
-        if request.url.path.startswith("/api"):
-            print("============= ОБРАБАТЫВАЕМ API ЗАПРОС =============")
-            api_key = await api_key_header(request)
-            print(f"============= API КЛЮЧ: {api_key} =============")
+API_KEY_HEADER = b"x-api-key"
+IF_NONE_MATCH_HEADER = b"if-none-match"
+ETAG_HEADER = b"etag"
+# Заголовки тела, которые не отправляются в ответе 304
+NOT_MODIFIED_DROPPED_HEADERS = frozenset([b"content-length", b"content-type"])
+
+# Пути, для которых нужна точная проверка
+EXACT_PUBLIC_PATHS = frozenset(["/", "/api/register", "/api/openapi.json"])
+
+# Пути, для которых проверяем только начало
+PREFIX_PUBLIC_PATHS = tuple(
+    prefix + "/" for prefix in ("/docs", "/redoc", "/register", "/static", "/status")
+)
+
+
+def is_public_path(path: str) -> bool:
+    return path in EXACT_PUBLIC_PATHS or path.startswith(PREFIX_PUBLIC_PATHS)
+
+
+def extract_api_key(scope: Scope) -> Optional[str]:
+    """Достает API ключ из заголовков ASGI scope без создания Request."""
+    for name, value in scope["headers"]:
+        if name == API_KEY_HEADER:
+            return value.decode("latin-1") or None
+    return None
+
+
+def get_header(scope: Scope, name: bytes) -> Optional[bytes]:
+    for header_name, value in scope["headers"]:
+        if header_name == name:
+            return value
+    return None
+
+
+def etag_matches(if_none_match: bytes, etag: bytes) -> bool:
+    """Слабое сравнение ETag со списком из If-None-Match (RFC 9110)."""
+    if if_none_match.strip() == b"*":
+        return True
+    etag = etag.strip().removeprefix(b"W/")
+    return any(
+        candidate.strip().removeprefix(b"W/") == etag
+        for candidate in if_none_match.split(b",")
+    )
+
+
+def build_rate_limit_headers(
+    remaining: int, total_limit: int, reset_time: int
+) -> List[Tuple[bytes, bytes]]:
+    """Формирует заголовки X-RateLimit-* один раз на запрос."""
+    return [
+        (b"x-ratelimit-limit", str(total_limit).encode("latin-1")),
+        (b"x-ratelimit-remaining", str(remaining).encode("latin-1")),
+        (b"x-ratelimit-reset", str(reset_time).encode("latin-1")),
+        (
+            b"x-ratelimit-reset-human",
+            datetime.fromtimestamp(reset_time)
+            .strftime("%Y-%m-%d %H:%M:%S UTC")
+            .encode("latin-1"),
+        ),
+    ]
+
+
+async def resolve_user(api_key: str) -> Optional[CachedUser]:
+    """
+    Находит пользователя по API ключу.
+
+    Сначала смотрим в локальный кэш воркера и только при промахе
+    открываем сессию БД. Прогретый ключ не обращается к базе вовсе;
+    неизвестный ключ тоже кэшируется, на короткий срок.
+    """
+    found, user = user_cache.lookup(api_key)
+    if found:
+        return user
+
+    db_generator = get_db()
+    db = await db_generator.__anext__()
+    try:
+        result = await db.execute(select(User).where(User.api_key == api_key))
+        db_user = result.scalar_one_or_none()
+    finally:
+        await db.close()
+
+    if db_user is None:
+        user_cache.put_unknown(api_key)
+        return None
+
+    user = CachedUser.from_model(db_user)
+    user_cache.put(api_key, user)
+    return user
+
+
+class APIMiddleware:
+    """
+    Единый ASGI middleware авторизации и учета запросов.
+
+    За один проход выполняет то, что раньше делали три BaseHTTPMiddleware
+    (APIMiddleware, RequestCounterMiddleware и RateLimitMiddleware):
+    - считает запрос и добавляет заголовок X-Request-Count;
+    - достает API ключ и находит пользователя (через кэш пользователей);
+    - списывает ровно одну единицу квоты через RateLimiter (для маршрутов
+      из fractional_quotas - одну единицу на несколько запросов);
+    - добавляет заголовки X-RateLimit-*, вычисленные один раз;
+    - для маршрутов каталога из реестра http_cache_policies выставляет
+      Cache-Control, Vary и ETag (поколение каталога + путь и query) и
+      отвечает 304 на совпавший If-None-Match, не вызывая обработчик;
+    - отвечает 304 без тела, если ETag ответа совпал с If-None-Match.
+
+    Ответ не оборачивается: мы лишь дописываем заголовки в
+    сообщение http.response.start, тело передается как есть.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        limiter: RateLimiter = rate_limiter,
+        counter: APIStatus = api_status,
+        http_cache: HttpCachePolicies = http_cache_policies,
+        quotas: Dict[str, FractionalQuota] = fractional_quotas,
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.counter = counter
+        self.http_cache = http_cache
+        self.quotas = quotas
 
-            if not api_key:
-                print("============= API КЛЮЧ ОТСУТСТВУЕТ =============")
-                return JSONResponse(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    content=MessageResponse(
-                        message="Отсутствует ключ API"
-                    ).model_dump(),
-                )
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-            # Получаем сессию БД для проверки существования пользователя
-            print("============= ПОЛУЧАЕМ СЕССИЮ БД =============")
-            db_generator = get_db()
-            try:
-                db = await db_generator.__anext__()
-            except StopAsyncIteration:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Не удалось получить соединение с базой данных",
-                )
-            except Exception as e_db:
-                logger.error(f"Ошибка при получении сессии БД в middleware: {e_db}")
-                raise HTTPException(status_code=500, detail="Database connection error")
-
-            try:
-                # Проверяем существование пользователя с таким API ключом
-                print(
-                    f"============= ИЩЕМ ПОЛЬЗОВАТЕЛЯ ПО КЛЮЧУ: {api_key} ============="
+        extra_headers: List[Tuple[bytes, bytes]] = []
+        try:
+            current_count = self.counter.increment_request_count()
+            if current_count is not None:
+                extra_headers.append(
+                    (b"x-request-count", str(current_count).encode("latin-1"))
                 )
-                result = await db.execute(select(User).where(User.api_key == api_key))
-                user = result.scalar_one_or_none()
-
-                if not user:
-                    print("============= ПОЛЬЗОВАТЕЛЬ НЕ НАЙДЕН =============")
-                    return JSONResponse(
-                        status_code=status.HTTP_403_FORBIDDEN,
-                        content=MessageResponse(
-                            message="Неверный ключ API"
-                        ).model_dump(),
-                    )
+        except Exception as e:
+            logger.error(f"Error while incrementing request counter: {e}")
+
+        path = scope["path"]
+        is_get = scope["method"] in ("GET", "HEAD")
+        if_none_match = get_header(scope, IF_NONE_MATCH_HEADER) if is_get else None
+        policy = self.http_cache.lookup(path) if is_get else None
+        etag = (
+            policy.etag(path, scope["query_string"], catalog_generation.current)
+            if policy is not None
+            else None
+        )
+        not_modified = (
+            etag is not None
+            and if_none_match is not None
+            and etag_matches(if_none_match, etag)
+        )
 
-                print(
-                    f"============= ПОЛЬЗОВАТЕЛЬ НАЙДЕН: {user.username}, ЛИМИТ: {user.daily_request_limit} ============="
-                )
+        if not is_public_path(path):
+            api_key = extract_api_key(scope)
+            is_api_path = path.startswith("/api")
 
-                # Проверяем лимит запросов через Redis
-                print(f"============= ВЫЗЫВАЕМ RATE_LIMITER =============")
-                can_proceed, remaining, total_limit, reset_time = (
-                    await rate_limiter.check_and_update_limit(
-                        api_key, user.daily_request_limit
-                    )
-                )
-                print(
-                    f"============= РЕЗУЛЬТАТ ПРОВЕРКИ: can_proceed={can_proceed}, remaining={remaining} ============="
+            quota = self.quotas.get(path)
+            if api_key:
+                # Ключ и пользователь проверяются всегда; бесплатный 304
+                # (HTTP_304_QUOTA_POLICY=free) не списывает только квоту
+                charge = not (not_modified and self.http_cache.not_modified_is_free) and (
+                    quota is None or quota.due(api_key)
                 )
-
-                if not can_proceed:
-                    print("============= ЛИМИТ ПРЕВЫШЕН =============")
-                    reset_date = datetime.fromtimestamp(reset_time).strftime(
-                        "%Y-%m-%d %H:%M:%S UTC"
+                try:
+                    rejection = await self._authorize(
+                        scope, api_key, is_api_path, extra_headers, charge, quota
                     )
-                    return JSONResponse(
-                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                except Exception as e:
+                    logger.error(f"Error in APIMiddleware: {e}", exc_info=True)
+                    rejection = JSONResponse(
+                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                         content=MessageResponse(
-                            message=f"Request limit exceeded. Limit will be reset on {reset_date}."
+                            message="Internal server error during API request processing"
                         ).model_dump(),
                     )
-
-                # Сохраняем для использования в заголовках ответа
-                request.state.user = user
-                request.state.rate_limit_remaining = remaining
-                request.state.rate_limit_limit = total_limit
-                request.state.rate_limit_reset = reset_time
-                request.state.api_key = api_key
-
-                print("============= ПЕРЕДАЕМ ЗАПРОС ДАЛЬШЕ =============")
-                response = await call_next(request)
-                print("============= ЗАПРОС ОБРАБОТАН =============")
-
-                # Добавляем заголовки с информацией о лимитах
-                response.headers["X-RateLimit-Remaining"] = str(
-                    request.state.rate_limit_remaining
-                )
-                response.headers["X-RateLimit-Limit"] = str(
-                    request.state.rate_limit_limit
-                )
-                response.headers["X-RateLimit-Reset"] = str(
-                    request.state.rate_limit_reset
+                if rejection is not None:
+                    if quota is not None:
+                        quota.reject(api_key)
+                    rejection.raw_headers.extend(extra_headers)
+                    await rejection(scope, receive, send)
+                    return
+            elif is_api_path:
+                response = JSONResponse(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    content=MessageResponse(message="Отсутствует ключ API").model_dump(),
                 )
-                response.headers["X-RateLimit-Reset-Human"] = datetime.fromtimestamp(
-                    request.state.rate_limit_reset
-                ).strftime("%Y-%m-%d %H:%M:%S UTC")
-
-                return response
-
-            except Exception as e:
-                print(f"============= ОШИБКА В MIDDLEWARE: {str(e)} =============")
-                await db.close()
-                if isinstance(e, HTTPException):
-                    raise e
-                raise HTTPException(
-                    status_code=500,
-                    detail="Internal server error during API request processing",
+                response.raw_headers.extend(extra_headers)
+                await response(scope, receive, send)
+                return
+
+        if not_modified:
+            # Представление не изменилось: ни обработчик, ни БД не нужны
+            response = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+            response.raw_headers.extend(policy.headers(etag) + extra_headers)
+            await response(scope, receive, send)
+            return
+
+        if not extra_headers and if_none_match is None and policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        def finish_start(message: Message) -> Message:
+            nonlocal not_modified
+            headers = message["headers"]
+            if if_none_match is not None and message["status"] == 200:
+                response_etag = next(
+                    (value for name, value in headers if name == ETAG_HEADER), None
                 )
-            finally:
-                print("============= ЗАКРЫВАЕМ СЕССИЮ БД =============")
-                if "db" in locals() and db is not None:
-                    await db.close()
-
-        # Для не-API запросов просто пропускаем
-        print("============= НЕ API ЗАПРОС, ПРОПУСКАЕМ =============")
-        return await call_next(request)
-
-
-class RequestCounterMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, redis_client: aioredis.Redis):
-        super().__init__(app)
-        self.redis = redis_client
-
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
-        try:
-            # Вызываем метод для увеличения счетчика и СОХРАНЯЕМ РЕЗУЛЬТАТ
-            current_count = api_status.increment_request_count()
-            response = await call_next(request)
-            # Используем полученное значение счетчика
-            response.headers["X-Request-Count"] = str(current_count)
-            return response
-        except Exception as e:
-            logger.error(f"Error in RequestCounterMiddleware: {e}", exc_info=True)
-            # Важно: вернуть стандартный ответ об ошибке, а не падать
+                if response_etag is not None and etag_matches(if_none_match, response_etag):
+                    not_modified = True
+                    headers = [
+                        (name, value)
+                        for name, value in headers
+                        if name not in NOT_MODIFIED_DROPPED_HEADERS
+                    ]
+                    message = {**message, "status": 304}
+            return {**message, "headers": headers + extra_headers}
+
+        # Начало ответа, для которого ETag считается по телу
+        pending_start: Optional[Message] = None
+
+        async def send_with_headers(message: Message) -> None:
+            nonlocal pending_start
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if policy is not None and message["status"] == 200:
+                    if policy.content_etag:
+                        # ETag по содержимому (от кэша или по телу ниже) сохраняется
+                        headers = [
+                            (name, value)
+                            for name, value in headers
+                            if name != CACHE_CONTROL_HEADER
+                        ] + policy.headers(None)
+                        if not any(name == ETAG_HEADER for name, _ in headers):
+                            pending_start = {**message, "headers": headers}
+                            return
+                    else:
+                        # ETag по содержимому от кэша заменяется ETag политики
+                        headers = [
+                            (name, value)
+                            for name, value in headers
+                            if name not in (ETAG_HEADER, CACHE_CONTROL_HEADER)
+                        ] + policy.headers(etag)
+                message = finish_start({**message, "headers": headers})
+            elif message["type"] == "http.response.body" and pending_start is not None:
+                start, pending_start = pending_start, None
+                if not message.get("more_body", False):
+                    # Тело целиком в одном сообщении (JSONResponse): хэшируем его
+                    body_etag = b'"' + content_hash(message.get("body", b"")) + b'"'
+                    start["headers"].append((ETAG_HEADER, body_etag))
+                await send(finish_start(start))
+            if not_modified and message["type"] == "http.response.body":
+                # Тело клиенту не нужно: отправляем один пустой фрагмент в конце
+                if message.get("more_body", False):
+                    return
+                message = {"type": "http.response.body", "body": b""}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    async def _authorize(
+        self,
+        scope: Scope,
+        api_key: str,
+        is_api_path: bool,
+        extra_headers: List[Tuple[bytes, bytes]],
+        charge: bool = True,
+        quota: Optional[FractionalQuota] = None,
+    ) -> Optional[JSONResponse]:
+        """
+        Находит пользователя и, если charge, списывает квоту.
+
+        Возвращает готовый ответ-отказ или None, если запрос можно пропускать.
+        Заголовки лимитов добавляются в extra_headers; для запроса без
+        списания по маршруту с дробной квотой - последние известные.
+        """
+        user = await resolve_user(api_key)
+
+        # Для /api ключ обязан принадлежать существующему пользователю.
+        # Для остальных маршрутов (каталог) неизвестный ключ учитывается
+        # по лимиту по умолчанию, как и раньше в RateLimitMiddleware.
+        if user is None and is_api_path:
             return JSONResponse(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                content=MessageResponse(
-                    message="Internal server error in request counter"
-                ).model_dump(),
+                status_code=status.HTTP_403_FORBIDDEN,
+                content=MessageResponse(message="Неверный ключ API").model_dump(),
             )
 
+        # Заблокированный пользователь не проходит ни на один маршрут
+        if user is not None and not user.is_active:
+            return JSONResponse(
+                status_code=status.HTTP_403_FORBIDDEN,
+                content=MessageResponse(message="Пользователь заблокирован").model_dump(),
+            )
 
-# --- Добавляем RateLimitMiddleware ---
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, limiter: RateLimiter):
-        super().__init__(app)
-        self.limiter = limiter
-
-    async def dispatch(
-        self, request: Request, call_next: RequestResponseEndpoint
-    ) -> Response:
-        # Получаем API ключ из APIMiddleware (если он был добавлен в state)
-        # Или из заголовка, если APIMiddleware не используется перед ним
-        api_key = (
-            request.state.api_key
-            if hasattr(request.state, "api_key")
-            else request.headers.get("x-api-key")
-        )
-
-        if not api_key:
-            # Если ключ не найден (например, для публичных эндпоинтов, которые не должны сюда попадать)
-            # Или если RateLimiter должен работать даже без ключа (например, по IP) - нужна другая логика
-            logger.warning(
-                "RateLimitMiddleware: API key not found in request state or headers."
+        # Квота не списывается: лимитер не вызывается, заголовки лимита -
+        # последние известные для ключа (если есть)
+        can_proceed, remaining, total_limit, reset_time = True, None, None, None
+        if charge:
+            user_limit = user.daily_request_limit if user is not None else None
+            can_proceed, remaining, total_limit, reset_time = (
+                await self.limiter.check_and_update_limit(
+                    identifier=api_key, limit_override=user_limit
+                )
             )
-            # Можно пропустить лимитер или вернуть ошибку, в зависимости от логики
-            # return JSONResponse(...)
-            return await call_next(request)  # Пока пропускаем
-
-        # Получаем лимит пользователя (если APIMiddleware добавил пользователя в state)
-        user_limit = None
-        if hasattr(request.state, "user") and request.state.user:
-            # Убедись, что у модели User есть поле daily_request_limit
-            user_limit = getattr(request.state.user, "daily_request_limit", None)
-
-        # Проверяем лимит с помощью экземпляра RateLimiter
-        can_proceed, remaining, total_limit, reset_time = (
-            await self.limiter.check_and_update_limit(
-                identifier=api_key,  # Можно явно указать имя первого аргумента для ясности
-                limit_override=user_limit,  # <--- ИЗМЕНЕНО ЗДЕСЬ
+            if quota is not None:
+                quota.remember(api_key, remaining, total_limit, reset_time)
+        elif quota is not None:
+            limits = quota.last_limits(api_key)
+            if limits is not None:
+                remaining, total_limit, reset_time = limits
+        if remaining is not None:
+            extra_headers.extend(
+                build_rate_limit_headers(remaining, total_limit, reset_time)
             )
-        )
-
-        # Добавляем заголовки с информацией о лимите в ответ
-        response = await call_next(request)
-        response.headers["X-RateLimit-Limit"] = str(total_limit)
-        response.headers["X-RateLimit-Remaining"] = str(remaining)
-        response.headers["X-RateLimit-Reset"] = str(reset_time)  # Timestamp UTC
 
         if not can_proceed:
             reset_date = datetime.fromtimestamp(reset_time).strftime(
                 "%Y-%m-%d %H:%M:%S UTC"
             )
-            # Возвращаем ошибку 429, но уже после того как заголовки добавлены к потенциальному ответу
-            # Правильнее вернуть JSONResponse до вызова call_next
             logger.warning(
                 f"Rate limit exceeded for key {api_key}. Limit: {total_limit}, Remaining: {remaining}"
             )
@@ -253,7 +352,16 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
                 content=MessageResponse(
                     message=f"Request limit exceeded ({total_limit} requests). Limit resets at {reset_date}."
                 ).model_dump(),
-                headers=response.headers,  # Добавляем рассчитанные заголовки к ответу об ошибке
             )
 
-        return response
+        # Учитываем ключ в HyperLogLog активных пользователей (без обращения к Redis)
+        self.counter.record_active_key(api_key)
+
+        # Сохраняем для использования в обработчиках (request.state.*)
+        state = scope.setdefault("state", {})
+        state["user"] = user
+        state["api_key"] = api_key
+        state["rate_limit_remaining"] = remaining
+        state["rate_limit_limit"] = total_limit
+        state["rate_limit_reset"] = reset_time
+        return None
@@ -8,7 +8,7 @@ from fastapi import (
     status,
 )
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from sqlalchemy.future import select
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
@@ -18,12 +18,6 @@ from ..db.models import (
     Movie,
     Genre,
     movie_genres,
-    Actor,
-    movie_actors,
-    Director,
-    movie_directors,
-    Country,
-    movie_countries,
 )
 from ..db.schemas import (
     MovieCreate,
@@ -33,6 +27,9 @@ from ..db.schemas import (
     MessageResponse,
 )
 from ..services.user_service import UserService
+from ..services.movie_service import MovieService
+from ..services.movie_search import MovieSearch
+from ..services.cache_warmup import cache_warmer
 import httpx
 import logging
 import json
@@ -46,13 +43,24 @@ from fastapi.templating import Jinja2Templates
 from .api_status import api_status, StatusResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from typing import Optional
-from sqlalchemy.sql import or_
 from sqlalchemy.sql import func
 from sqlalchemy import desc
-import random
 from datetime import datetime
-from ..services.rate_limiter import rate_limiter
-from ..utils.caching import cache
+from ..services.rate_limiter import rate_limiter, LeasingRateLimiter
+from ..utils.caching import (
+    cache,
+    cache_metrics,
+    clamp_limit,
+    normalize_text,
+    cache_memory_usage,
+    local_cache,
+    negative_cache,
+)
+from ..services.movie_index import movie_id_index
+from ..services.title_index import TITLE_INDEX_ENABLED, title_index
+from ..services.autocomplete import AUTOCOMPLETE_MAX_LIMIT, autocomplete_index
+from ..services.genre_index import genre_dictionary
+from ..services.random_sampler import movie_sampler
 
 logger = logging.getLogger(__name__)
 
@@ -67,6 +75,18 @@ api_key_header = APIKeyHeader(
     auto_error=False,
 )
 
+# API ключи с доступом к служебным метрикам (/api/admin/*), через запятую.
+# Без них служебные эндпоинты недоступны никому
+ADMIN_API_KEYS = frozenset(
+    key.strip() for key in os.getenv("ADMIN_API_KEYS", "").split(",") if key.strip()
+)
+
+
+async def require_admin(request: Request) -> None:
+    """Пропускает только ключи из ADMIN_API_KEYS (сам ключ уже проверил APIMiddleware)."""
+    if request.headers.get("X-API-Key") not in ADMIN_API_KEYS:
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+
 
 class RequestCounterMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
@@ -90,6 +110,13 @@ async def status_page(request: Request):
     description="Возвращает список фильмов определенного жанра. Можно указать количество возвращаемых фильмов (не более 25).",
     dependencies=[Security(api_key_header)],
 )
+@cache(
+    ttl=10800,
+    stale_ttl=1800,
+    refresh_ahead=0.1,
+    # Жанр возвращается в ответе как передан: в ключе он не нормализуется
+    normalize={"limit": clamp_limit(default=5, maximum=25)},
+)
 async def get_movies_by_genre(
     genre: str, limit: int = 5, db: AsyncSession = Depends(get_db)
 ):
@@ -100,19 +127,12 @@ async def get_movies_by_genre(
         elif limit > 25:
             limit = 25  # Максимальное значение
 
-        # Выполняем запрос к базе данных для поиска фильмов по жанру
-        # Поскольку жанры хранятся в отдельной таблице и связаны через movie_genres
-
-        # Ищем фильмы, у которых есть связь с указанным жанром
-        result = await db.execute(
-            select(Movie)
-            .join(movie_genres, Movie.id == movie_genres.c.movie_id)
-            .join(Genre, movie_genres.c.genre_id == Genre.id)
-            .where(Genre.name.ilike(f"%{genre}%"))
-            .limit(limit)
-        )
-
-        movies = result.scalars().all()
+        # Жанр разрешается в id словарем жанров; неизвестный жанр - без запроса к БД
+        genre_condition = MovieService.genre_condition(genre)
+        movies = []
+        if genre_condition is not None:
+            result = await db.execute(select(Movie).where(genre_condition).limit(limit))
+            movies = result.scalars().all()
 
         if not movies:
             return JSONResponse(
@@ -120,37 +140,8 @@ async def get_movies_by_genre(
                 content={"message": f"Фильмы жанра '{genre}' не найдены"},
             )
 
-        formatted_movies = []
-        for movie in movies:
-            # Получаем жанры для каждого фильма
-            genres_result = await db.execute(
-                select(Genre.name)
-                .join(movie_genres, Genre.id == movie_genres.c.genre_id)
-                .where(movie_genres.c.movie_id == movie.id)
-            )
-            genres = [genre[0] for genre in genres_result.fetchall()]
-
-            movie_data = {
-                "id": movie.id,
-                "title": movie.title,
-                "year": movie.year,
-                "genres": genres,
-                "rating": movie.rating,
-                "created_at": (
-                    movie.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                    if movie.created_at
-                    else None
-                ),
-            }
-
-            # Добавляем необязательные поля только если они не пустые
-            if movie.original_title:
-                movie_data["original_title"] = movie.original_title
-
-            if movie.description and movie.description.strip():
-                movie_data["description"] = movie.description
-
-            formatted_movies.append(movie_data)
+        # Жанры для всей страницы загружаются одним запросом
+        formatted_movies = await MovieService.format_movies(db, movies)
 
         return JSONResponse(
             content={
@@ -170,47 +161,133 @@ async def get_movies_by_genre(
 
 @status_router.get("/api/status", response_model=StatusResponse, tags=["Аналитика"])
 async def get_api_status():
-    return api_status.get_status()
+    return await api_status.get_status()
+
+
+@api_router.get(
+    "/admin/limiter",
+    include_in_schema=False,
+    dependencies=[Security(api_key_header), Depends(require_admin)],
+)
+async def get_limiter_metrics():
+    """Метрики аренды квоты лимитером в текущем воркере."""
+    if not isinstance(rate_limiter, LeasingRateLimiter):
+        return {"leasing": False}
+    return {"leasing": True, **rate_limiter.get_lease_metrics()}
+
+
+@status_router.get("/api/ready", include_in_schema=False)
+async def get_readiness():
+    """Готовность воркера: 503, пока не завершен прогрев кэша."""
+    if not cache_warmer.ready:
+        return JSONResponse(
+            status_code=503, content={"ready": False, "warmup": cache_warmer.status}
+        )
+    return {"ready": True, "warmup": cache_warmer.status}
+
+
+@api_router.get(
+    "/admin/cache",
+    include_in_schema=False,
+    dependencies=[Security(api_key_header), Depends(require_admin)],
+)
+async def get_cache_metrics(memory: bool = False):
+    """
+    Метрики кэша текущего воркера: размер L1 и по каждой закэшированной
+    функции попадания L1/L2, промахи, ошибки, байты и гистограммы задержек
+    Redis GET/SETEX и вычисления.
+
+    С memory=true дополнительно считает занятую память Redis по префиксам
+    (SCAN, не чаще раза в CACHE_MEMORY_USAGE_TTL секунд на воркер).
+    """
+    metrics = {
+        "l1": {"entries": len(local_cache), "bytes": local_cache.size_bytes},
+        "functions": cache_metrics.snapshot(),
+    }
+    if memory:
+        metrics["redis_memory"] = await cache_memory_usage.get()
+    return metrics
+
+
+# Размер страницы /movies при курсорной пагинации
+MOVIES_PAGE_DEFAULT = 100
+MOVIES_PAGE_MAX = 500
 
 
 @movies_router.get(
     "/movies",
     tags=["Фильмы"],
     summary="Получить список всех фильмов",
-    description="Возвращает список всех фильмов из базы данных",
+    description=(
+        "Возвращает список всех фильмов из базы данных. "
+        "С параметрами cursor/limit отдает страницу фильмов по возрастанию id "
+        "(keyset-пагинация, следующий курсор в поле next_cursor). "
+        "С stream=true отдает весь каталог потоком по мере чтения из БД: "
+        "format=json — JSON-массив, format=ndjson — по одному фильму на строку."
+    ),
     dependencies=[Security(api_key_header)],
 )
-@cache(ttl=180)
-async def get_movies(db: AsyncSession = Depends(get_db)):
+async def get_movies(
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+    stream: bool = False,
+    format: str = "json",
+    db: AsyncSession = Depends(get_db),
+):
+    if stream:
+        ndjson = format.lower() == "ndjson"
+        return StreamingResponse(
+            MovieService.stream_movies(ndjson=ndjson),
+            media_type="application/x-ndjson" if ndjson else "application/json",
+        )
+
+    if cursor is None and limit is None:
+        return await get_all_movies(db=db)
+
+    # Проверяем и ограничиваем размер страницы
+    if limit is None or limit <= 0:
+        limit = MOVIES_PAGE_DEFAULT
+    elif limit > MOVIES_PAGE_MAX:
+        limit = MOVIES_PAGE_MAX
+    return await get_movies_page(cursor=cursor or 0, limit=limit, db=db)
+
+
+@cache(ttl=3600, cluster_lock=True, stale_ttl=600, refresh_ahead=0.1)
+async def get_all_movies(db: AsyncSession = Depends(get_db)):
     try:
         result = await db.execute(select(Movie))
         movies = result.scalars().all()
-        formatted_movies = []
-        for movie in movies:
-            movie_data = {
-                "id": movie.id,
-                "title": movie.title,
-                "year": movie.year,
-                "rating": movie.rating,
-                "created_at": (
-                    movie.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                    if movie.created_at
-                    else None
-                ),
-            }
+        formatted_movies = [MovieService.format_movie(movie) for movie in movies]
 
-            # Добавляем необязательные поля только если они не пустые
-            if movie.original_title:
-                movie_data["original_title"] = movie.original_title
+        return JSONResponse(content=formatted_movies)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return JSONResponse(
+            status_code=500, content={"error": "Ошибка при получении списка фильмов"}
+        )
 
-            if movie.description and movie.description.strip():
-                movie_data["description"] = movie.description
 
-            formatted_movies.append(movie_data)
+@cache(ttl=3600, stale_ttl=600, refresh_ahead=0.1)
+async def get_movies_page(cursor: int, limit: int, db: AsyncSession = Depends(get_db)):
+    try:
+        # Keyset-пагинация: WHERE id > cursor ORDER BY id LIMIT n идет по индексу PK
+        result = await db.execute(
+            select(Movie).where(Movie.id > cursor).order_by(Movie.id).limit(limit)
+        )
+        movies = result.scalars().all()
+        formatted_movies = [MovieService.format_movie(movie) for movie in movies]
 
-        return JSONResponse(content=formatted_movies)
+        return JSONResponse(
+            content={
+                "count": len(formatted_movies),
+                "limit": limit,
+                "cursor": cursor,
+                "next_cursor": movies[-1].id if len(movies) == limit else None,
+                "movies": formatted_movies,
+            }
+        )
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.error(f"Ошибка при получении страницы фильмов: {str(e)}")
         return JSONResponse(
             status_code=500, content={"error": "Ошибка при получении списка фильмов"}
         )
@@ -224,38 +301,17 @@ async def get_movies(db: AsyncSession = Depends(get_db)):
     dependencies=[Security(api_key_header)],
 )
 async def get_movie(movie_id: int, db: AsyncSession = Depends(get_db)):
+    # Несуществующий id отсекаем по битовой карте без запроса к БД
+    if movie_id_index.contains(movie_id) is False:
+        raise HTTPException(status_code=404, detail="Movie not found")
+
     result = await db.execute(select(Movie).where(Movie.id == movie_id))
     movie = result.scalars().first()
     if movie is None:
         raise HTTPException(status_code=404, detail="Movie not found")
 
-    # Получаем все жанры для фильма
-    genres_result = await db.execute(
-        select(Genre.name)
-        .join(movie_genres, Genre.id == movie_genres.c.genre_id)
-        .where(movie_genres.c.movie_id == movie.id)
-    )
-    genres = [genre[0] for genre in genres_result.fetchall()]
-
     # Формируем ответ с проверкой пустых полей
-    movie_data = {
-        "id": movie.id,
-        "title": movie.title,
-        "year": movie.year,
-        "genres": genres,
-        "rating": movie.rating,
-        "created_at": (
-            movie.created_at.strftime("%Y-%m-%d %H:%M:%S") if movie.created_at else None
-        ),
-    }
-
-    # Добавляем необязательные поля только если они не пустые
-    if movie.original_title:
-        movie_data["original_title"] = movie.original_title
-
-    if movie.description and movie.description.strip():
-        movie_data["description"] = movie.description
-
+    (movie_data,) = await MovieService.format_movies(db, [movie])
     return JSONResponse(content=movie_data)
 
 
@@ -434,7 +490,7 @@ async def verify_api_key(api_key: str, db: AsyncSession = Depends(get_db)):
     description="Возвращает список всех жанров фильмов в базе данных",
     dependencies=[Security(api_key_header)],
 )
-@cache(ttl=3600)
+@cache(ttl=21600, stale_ttl=3600, refresh_ahead=0.1)
 async def get_genres(db: AsyncSession = Depends(get_db)):
     try:
         result = await db.execute(select(Genre))
@@ -452,6 +508,33 @@ async def get_genres(db: AsyncSession = Depends(get_db)):
         )
 
 
+@movies_router.get(
+    "/autocomplete",
+    tags=["Поиск"],
+    summary="Подсказки по началу названия",
+    description="Самые популярные фильмы, название которых начинается с prefix "
+    "(русское или оригинальное, в том числе в транслитерации). Отвечает из "
+    "памяти без обращения к базе данных",
+    dependencies=[Security(api_key_header)],
+)
+async def autocomplete(prefix: str = "", limit: int = 10):
+    if limit <= 0:
+        limit = 10
+    elif limit > AUTOCOMPLETE_MAX_LIMIT:
+        limit = AUTOCOMPLETE_MAX_LIMIT
+
+    suggestions = autocomplete_index.complete(prefix, limit)
+    if suggestions is None:
+        # Таблица строится или перестраивается после импорта
+        return JSONResponse(
+            status_code=503,
+            content={"error": "Подсказки временно недоступны, повторите запрос позже"},
+        )
+    return JSONResponse(
+        content={"prefix": prefix, "count": len(suggestions), "suggestions": suggestions}
+    )
+
+
 @movies_router.get(
     "/search",
     tags=["Поиск"],
@@ -474,69 +557,68 @@ async def search_movies(
         elif limit > 25:
             limit = 25
 
-        # Начинаем строить запрос
-        movie_query = select(Movie)
-
-        # Применяем фильтры, если они указаны
-        if query:
-            movie_query = movie_query.filter(
-                or_(
-                    Movie.title.ilike(f"%{query}%"),
-                    Movie.original_title.ilike(f"%{query}%"),
-                )
-            )
-
-        if year:
-            movie_query = movie_query.filter(Movie.year == year)
-
-        if min_rating:
-            movie_query = movie_query.filter(Movie.rating >= min_rating)
-
-        # Если указан жанр, применяем фильтр по жанру
-        if genre:
-            movie_query = (
-                movie_query.join(movie_genres, Movie.id == movie_genres.c.movie_id)
-                .join(Genre, movie_genres.c.genre_id == Genre.id)
-                .filter(Genre.name.ilike(f"%{genre}%"))
+        search_params = {
+            "query": query,
+            "year": year,
+            "min_rating": min_rating,
+            "genre": genre,
+        }
+        # Поиск по названию без жанра может обслужить индекс триграмм в памяти
+        # (если включен): из БД загружаются только найденные фильмы
+        movies = None
+        if query and not genre and TITLE_INDEX_ENABLED:
+            movie_ids = await title_index.search(
+                query, limit, year=year, min_rating=min_rating
             )
-
-        # Применяем лимит и выполняем запрос
-        movie_query = movie_query.limit(limit)
-        result = await db.execute(movie_query)
-        movies = result.scalars().all()
+            if movie_ids is not None:
+                movies = await MovieService.load_movies(db, movie_ids)
+
+        # Индекс выключен, не готов или не ответил (короткий запрос, неполный
+        # результат), либо нужен фильтр по жанру: поиск в PostgreSQL
+        if movies is None:
+            # Комбинации, недавно не давшие результатов, не отправляем в БД
+            known_empty = await negative_cache.contains("search", search_params)
+
+            # Начинаем строить запрос
+            movie_query = select(Movie)
+
+            # Применяем фильтры, если они указаны
+            if query:
+                movie_query = movie_query.filter(MovieSearch.title_condition(query))
+                # Сначала самые релевантные запросу фильмы
+                rank = MovieSearch.rank(query)
+                if rank is not None:
+                    movie_query = movie_query.order_by(
+                        rank.desc(), Movie.rating.desc().nulls_last(), Movie.id
+                    )
+
+            if year:
+                movie_query = movie_query.filter(Movie.year == year)
+
+            if min_rating:
+                movie_query = movie_query.filter(Movie.rating >= min_rating)
+
+            # Если указан жанр, применяем фильтр по жанру
+            if genre:
+                genre_condition = MovieService.genre_condition(genre)
+                if genre_condition is None:
+                    known_empty = True
+                else:
+                    movie_query = movie_query.filter(genre_condition)
+
+            # Применяем лимит и выполняем запрос
+            if known_empty:
+                movies = []
+            else:
+                movie_query = movie_query.limit(limit)
+                result = await db.execute(movie_query)
+                movies = result.scalars().all()
+                if not movies:
+                    await negative_cache.add("search", search_params)
 
         # Формируем ответ
-        formatted_movies = []
-        for movie in movies:
-            # Получаем жанры для фильма
-            genres_result = await db.execute(
-                select(Genre.name)
-                .join(movie_genres, Genre.id == movie_genres.c.genre_id)
-                .where(movie_genres.c.movie_id == movie.id)
-            )
-            genres = [genre[0] for genre in genres_result.fetchall()]
-
-            movie_data = {
-                "id": movie.id,
-                "title": movie.title,
-                "year": movie.year,
-                "genres": genres,
-                "rating": movie.rating,
-                "created_at": (
-                    movie.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                    if movie.created_at
-                    else None
-                ),
-            }
-
-            # Добавляем необязательные поля только если они не пустые
-            if movie.original_title:
-                movie_data["original_title"] = movie.original_title
-
-            if movie.description and movie.description.strip():
-                movie_data["description"] = movie.description
-
-            formatted_movies.append(movie_data)
+        # Жанры для всей страницы загружаются одним запросом
+        formatted_movies = await MovieService.format_movies(db, movies)
 
         return JSONResponse(
             content={
@@ -562,72 +644,63 @@ async def search_movies(
     "/random",
     tags=["Поиск"],
     summary="Случайный фильм",
-    description="Получить случайный фильм с возможностью фильтрации по жанру",
+    description="Получить случайный фильм с возможностью фильтрации по жанру. "
+    "С count - список из count различных фильмов, с seed - воспроизводимая выборка "
+    "(пока воркер не загрузил id фильмов, выборка случайна и без seed)",
     dependencies=[Security(api_key_header)],
 )
 async def get_random_movie(
-    genre: Optional[str] = None, db: AsyncSession = Depends(get_db)
+    genre: Optional[str] = None,
+    count: Optional[int] = None,
+    seed: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
 ):
     try:
-        # Начинаем строить запрос
-        movie_query = select(Movie)
+        # Без count ответ - один фильм, как раньше
+        size = 1 if count is None else min(max(count, 1), 25)
 
-        # Если указан жанр, фильтруем по нему
+        genre_ids = None
         if genre:
-            movie_query = (
-                movie_query.join(movie_genres, Movie.id == movie_genres.c.movie_id)
-                .join(Genre, movie_genres.c.genre_id == Genre.id)
-                .filter(Genre.name.ilike(f"%{genre}%"))
-            )
+            genre_ids = genre_dictionary.resolve(genre)
+            if genre_ids is not None and not genre_ids:
+                return JSONResponse(
+                    status_code=404, content={"message": "Фильмы не найдены"}
+                )
 
-        # Получаем количество фильмов для этого запроса
-        count_query = select(func.count()).select_from(movie_query.subquery())
-        result = await db.execute(count_query)
-        total_count = result.scalar()
+        # Случайные индексы в массивах id воркера и выборка по первичному ключу
+        movie_ids = None
+        if not genre or genre_ids is not None:
+            movie_ids = movie_sampler.sample(size, genre_ids=genre_ids, seed=seed)
+
+        if movie_ids is not None:
+            movies = await MovieService.load_movies(db, movie_ids)
+        else:
+            # Массивы еще не загружены: выбираем в БД одним запросом.
+            # seed здесь не воспроизводится - выборку задает random() в БД
+            movie_query = select(Movie).order_by(func.random()).limit(size)
+            if genre:
+                genre_condition = MovieService.genre_condition(genre)
+                if genre_condition is None:
+                    return JSONResponse(
+                        status_code=404, content={"message": "Фильмы не найдены"}
+                    )
+                movie_query = movie_query.filter(genre_condition)
+
+            result = await db.execute(movie_query)
+            movies = list(result.scalars().all())
 
-        if total_count == 0:
+        if not movies:
             return JSONResponse(
                 status_code=404, content={"message": "Фильмы не найдены"}
             )
 
-        # Выбираем случайный индекс
-        random_index = random.randint(0, total_count - 1)
-
-        # Получаем случайный фильм
-        movie_query = movie_query.offset(random_index).limit(1)
-        result = await db.execute(movie_query)
-        movie = result.scalars().first()
-
-        # Получаем жанры для фильма
-        genres_result = await db.execute(
-            select(Genre.name)
-            .join(movie_genres, Genre.id == movie_genres.c.genre_id)
-            .where(movie_genres.c.movie_id == movie.id)
-        )
-        genres = [genre[0] for genre in genres_result.fetchall()]
-
         # Формируем ответ
-        movie_data = {
-            "id": movie.id,
-            "title": movie.title,
-            "year": movie.year,
-            "genres": genres,
-            "rating": movie.rating,
-            "created_at": (
-                movie.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                if movie.created_at
-                else None
-            ),
-        }
-
-        # Добавляем необязательные поля только если они не пустые
-        if movie.original_title:
-            movie_data["original_title"] = movie.original_title
-
-        if movie.description and movie.description.strip():
-            movie_data["description"] = movie.description
-
-        return JSONResponse(content=movie_data)
+        formatted_movies = await MovieService.format_movies(db, movies)
+        if count is None:
+            return JSONResponse(content=formatted_movies[0])
+        return JSONResponse(
+            content={"count": len(formatted_movies), "movies": formatted_movies}
+        )
     except Exception as e:
         logger.error(f"Ошибка при получении случайного фильма: {str(e)}")
         return JSONResponse(
@@ -652,6 +725,9 @@ async def get_similar_movies(
         elif limit > 25:
             limit = 25
 
+        if movie_id_index.contains(movie_id) is False:
+            return JSONResponse(status_code=404, content={"message": "Фильм не найден"})
+
         # Проверяем существование фильма
         movie_result = await db.execute(select(Movie).where(Movie.id == movie_id))
         movie = movie_result.scalars().first()
@@ -688,44 +764,15 @@ async def get_similar_movies(
         result = await db.execute(similar_movies_query)
         similar_movies = result.fetchall()
 
-        # Формируем ответ
-        formatted_movies = []
-        for movie_info in similar_movies:
-            movie = movie_info[0]  # Первый элемент - это объект Movie
-            matching_count = movie_info[
-                1
-            ]  # Второй элемент - количество совпадающих жанров
-
-            # Получаем все жанры фильма
-            movie_genres_result = await db.execute(
-                select(Genre.name)
-                .join(movie_genres, Genre.id == movie_genres.c.genre_id)
-                .where(movie_genres.c.movie_id == movie.id)
-            )
-            genres = [genre[0] for genre in movie_genres_result.fetchall()]
-
-            movie_data = {
-                "id": movie.id,
-                "title": movie.title,
-                "year": movie.year,
-                "genres": genres,
-                "rating": movie.rating,
-                "matching_genres": matching_count,
-                "created_at": (
-                    movie.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                    if movie.created_at
-                    else None
-                ),
-            }
-
-            # Добавляем необязательные поля только если они не пустые
-            if movie.original_title:
-                movie_data["original_title"] = movie.original_title
-
-            if movie.description and movie.description.strip():
-                movie_data["description"] = movie.description
-
-            formatted_movies.append(movie_data)
+        # Формируем ответ: первый элемент строки - объект Movie,
+        # второй - количество совпадающих жанров
+        formatted_movies = await MovieService.format_movies(
+            db,
+            [movie_info[0] for movie_info in similar_movies],
+            extras=[
+                {"matching_genres": movie_info[1]} for movie_info in similar_movies
+            ],
+        )
 
         return JSONResponse(
             content={
@@ -748,7 +795,13 @@ async def get_similar_movies(
     description="Получить топ фильмов по рейтингу с возможностью фильтрации по году и жанру",
     dependencies=[Security(api_key_header)],
 )
-@cache(ttl=900)
+@cache(
+    ttl=10800,
+    stale_ttl=1800,
+    refresh_ahead=0.1,
+    # Жанр возвращается в ответе как передан: в ключе он не нормализуется
+    normalize={"limit": clamp_limit(default=10, maximum=50)},
+)
 async def get_top_movies(
     year: Optional[int] = None,
     genre: Optional[str] = None,
@@ -770,49 +823,20 @@ async def get_top_movies(
             query = query.filter(Movie.year == year)
 
         if genre:
-            query = (
-                query.join(movie_genres, Movie.id == movie_genres.c.movie_id)
-                .join(Genre, movie_genres.c.genre_id == Genre.id)
-                .filter(Genre.name.ilike(f"%{genre}%"))
-            )
+            genre_condition = MovieService.genre_condition(genre)
+            # Неизвестный жанр: результат пуст без запроса к БД
+            query = query.filter(genre_condition) if genre_condition is not None else None
 
         # Применяем лимит и выполняем запрос
-        query = query.limit(limit)
-        result = await db.execute(query)
-        movies = result.scalars().all()
+        movies = []
+        if query is not None:
+            query = query.limit(limit)
+            result = await db.execute(query)
+            movies = result.scalars().all()
 
         # Формируем ответ
-        formatted_movies = []
-        for movie in movies:
-            # Получаем жанры для фильма
-            genres_result = await db.execute(
-                select(Genre.name)
-                .join(movie_genres, Genre.id == movie_genres.c.genre_id)
-                .where(movie_genres.c.movie_id == movie.id)
-            )
-            genres = [genre[0] for genre in genres_result.fetchall()]
-
-            movie_data = {
-                "id": movie.id,
-                "title": movie.title,
-                "year": movie.year,
-                "genres": genres,
-                "rating": movie.rating,
-                "created_at": (
-                    movie.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                    if movie.created_at
-                    else None
-                ),
-            }
-
-            # Добавляем необязательные поля только если они не пустые
-            if movie.original_title:
-                movie_data["original_title"] = movie.original_title
-
-            if movie.description and movie.description.strip():
-                movie_data["description"] = movie.description
-
-            formatted_movies.append(movie_data)
+        # Жанры для всей страницы загружаются одним запросом
+        formatted_movies = await MovieService.format_movies(db, movies)
 
         return JSONResponse(
             content={
@@ -835,6 +859,7 @@ async def get_top_movies(
     description="Получить статистику по жанрам: количество фильмов в каждом жанре",
     dependencies=[Security(api_key_header)],
 )
+@cache(ttl=21600, stale_ttl=3600, refresh_ahead=0.1)
 async def get_genre_stats(db: AsyncSession = Depends(get_db)):
     try:
         # Выполняем запрос для подсчета фильмов по жанрам
@@ -868,6 +893,63 @@ async def get_genre_stats(db: AsyncSession = Depends(get_db)):
         )
 
 
+FILTER_SORT_COLUMNS = {"rating": Movie.rating, "year": Movie.year, "title": Movie.title}
+
+
+def build_filter_query(
+    title: Optional[str],
+    year_from: Optional[int],
+    year_to: Optional[int],
+    rating_from: Optional[int],
+    genre: Optional[str],
+):
+    """
+    Строит запрос /filter без сортировки и пагинации.
+
+    Возвращает None, если жанр не найден в словаре жанров: результат пуст.
+    """
+    query = select(Movie)
+
+    # Применяем фильтры
+    if title:
+        query = query.filter(MovieSearch.title_condition(title))
+
+    if year_from:
+        query = query.filter(Movie.year >= year_from)
+
+    if year_to:
+        query = query.filter(Movie.year <= year_to)
+
+    if rating_from:
+        query = query.filter(Movie.rating >= rating_from)
+
+    # Если указан жанр, фильтруем по нему
+    if genre:
+        genre_condition = MovieService.genre_condition(genre)
+        if genre_condition is None:
+            return None
+        query = query.filter(genre_condition)
+
+    return query
+
+
+@cache(ttl=3600, normalize={"title": normalize_text, "genre": normalize_text})
+async def count_filtered_movies(
+    title: Optional[str],
+    year_from: Optional[int],
+    year_to: Optional[int],
+    rating_from: Optional[int],
+    genre: Optional[str],
+    db: AsyncSession = Depends(get_db),
+) -> int:
+    """Точное число фильмов для набора фильтров; кэшируется, а не считается на каждой странице."""
+    query = build_filter_query(title, year_from, year_to, rating_from, genre)
+    if query is None:
+        return 0
+    result = await db.execute(select(func.count()).select_from(query.subquery()))
+    return result.scalar()
+
+
 @movies_router.get(
     "/filter",
     tags=["Поиск"],
@@ -885,6 +967,8 @@ async def filter_movies(
     sort_order: str = "desc",  # asc, desc
     page: int = 1,
     page_size: int = 10,
+    cursor: Optional[str] = None,
+    total: str = "exact",  # exact, estimate, none
     db: AsyncSession = Depends(get_db),
 ):
     try:
@@ -895,107 +979,97 @@ async def filter_movies(
             page_size = 10
         if page_size > 50:
             page_size = 50
+        if sort_by not in FILTER_SORT_COLUMNS:
+            sort_by = "rating"  # По умолчанию сортируем по рейтингу
+        sort_order = "asc" if sort_order.lower() == "asc" else "desc"
+
+        filter_params = {
+            "title": title,
+            "year_from": year_from,
+            "year_to": year_to,
+            "rating_from": rating_from,
+            "genre": genre,
+        }
+        # Комбинации фильтров, недавно не давшие результатов, не отправляем в БД
+        known_empty = await negative_cache.contains("filter", filter_params)
 
         # Строим базовый запрос
-        query = select(Movie)
-        count_query = select(func.count()).select_from(Movie)
-
-        # Применяем фильтры
-        filters = []
-        if title:
-            title_filter = or_(
-                Movie.title.ilike(f"%{title}%"),
-                Movie.original_title.ilike(f"%{title}%"),
-            )
-            filters.append(title_filter)
-
-        if year_from:
-            filters.append(Movie.year >= year_from)
-
-        if year_to:
-            filters.append(Movie.year <= year_to)
-
-        if rating_from:
-            filters.append(Movie.rating >= rating_from)
-
-        # Применяем все добавленные фильтры
-        for f in filters:
-            query = query.filter(f)
-            count_query = count_query.filter(f)
+        query = build_filter_query(title, year_from, year_to, rating_from, genre)
+        if query is None:
+            # Жанр не найден: результат пуст без запроса к БД
+            known_empty = True
+            query = select(Movie)
+
+        # Применяем сортировку; id — уникальный тай-брейкер для курсора
+        sort_column = FILTER_SORT_COLUMNS[sort_by]
+        if sort_order == "asc":
+            query = query.order_by(sort_column.asc().nulls_last(), Movie.id)
+        else:
+            query = query.order_by(sort_column.desc().nulls_last(), Movie.id)
 
-        # Если указан жанр, фильтруем по нему
-        if genre:
-            query = (
-                query.join(movie_genres, Movie.id == movie_genres.c.movie_id)
-                .join(Genre, movie_genres.c.genre_id == Genre.id)
-                .filter(Genre.name.ilike(f"%{genre}%"))
-            )
-            count_query = (
-                count_query.join(movie_genres, Movie.id == movie_genres.c.movie_id)
-                .join(Genre, movie_genres.c.genre_id == Genre.id)
-                .filter(Genre.name.ilike(f"%{genre}%"))
+        # Применяем пагинацию: по курсору (keyset) или по номеру страницы
+        if cursor:
+            try:
+                last_value, last_id = MovieService.decode_cursor(
+                    cursor, sort_by, sort_order
+                )
+            except ValueError as ve:
+                return JSONResponse(status_code=400, content={"error": str(ve)})
+            query = query.where(
+                MovieService.keyset_condition(
+                    sort_column, sort_order, last_value, last_id
+                )
             )
-
-        # Применяем сортировку
-        if sort_by == "year":
-            sort_column = Movie.year
-        elif sort_by == "title":
-            sort_column = Movie.title
-        else:  # По умолчанию сортируем по рейтингу
-            sort_column = Movie.rating
-
-        if sort_order.lower() == "asc":
-            query = query.order_by(sort_column)
+            page = None
         else:
-            query = query.order_by(desc(sort_column))
-
-        # Получаем общее количество результатов
-        count_result = await db.execute(count_query)
-        total_count = count_result.scalar()
-
-        # Применяем пагинацию
-        offset = (page - 1) * page_size
-        query = query.offset(offset).limit(page_size)
+            query = query.offset((page - 1) * page_size)
+        query = query.limit(page_size)
 
         # Выполняем запрос
-        result = await db.execute(query)
-        movies = result.scalars().all()
+        movies = []
+        if not known_empty:
+            result = await db.execute(query)
+            movies = result.scalars().all()
+            # Пустая первая страница - пуст весь набор фильтров
+            if not movies and page == 1:
+                known_empty = True
+                await negative_cache.add("filter", filter_params)
 
         # Формируем ответ
-        formatted_movies = []
-        for movie in movies:
-            # Получаем жанры для фильма
-            genres_result = await db.execute(
-                select(Genre.name)
-                .join(movie_genres, Genre.id == movie_genres.c.genre_id)
-                .where(movie_genres.c.movie_id == movie.id)
+        # Жанры для всей страницы загружаются одним запросом
+        formatted_movies = await MovieService.format_movies(db, movies)
+
+        next_cursor = None
+        if len(movies) == page_size:
+            last_movie = movies[-1]
+            next_cursor = MovieService.encode_cursor(
+                sort_by, sort_order, getattr(last_movie, sort_by), last_movie.id
             )
-            genres = [genre[0] for genre in genres_result.fetchall()]
-
-            movie_data = {
-                "id": movie.id,
-                "title": movie.title,
-                "year": movie.year,
-                "genres": genres,
-                "rating": movie.rating,
-                "created_at": (
-                    movie.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                    if movie.created_at
-                    else None
-                ),
-            }
 
-            # Добавляем необязательные поля только если они не пустые
-            if movie.original_title:
-                movie_data["original_title"] = movie.original_title
-
-            if movie.description and movie.description.strip():
-                movie_data["description"] = movie.description
-
-            formatted_movies.append(movie_data)
+        # Общее количество: из кэша по набору фильтров, оценка планировщика или без него
+        total_count = None
+        if known_empty and total != "none":
+            total_count = 0
+        elif total == "exact":
+            total_count = await count_filtered_movies(
+                title=title,
+                year_from=year_from,
+                year_to=year_to,
+                rating_from=rating_from,
+                genre=genre,
+                db=db,
+            )
+        elif total == "estimate":
+            total_count = await MovieService.estimate_count(
+                db, build_filter_query(title, year_from, year_to, rating_from, genre)
+            )
 
         # Рассчитываем информацию о пагинации
-        total_pages = (total_count + page_size - 1) // page_size  # Округление вверх
+        total_pages = (
+            (total_count + page_size - 1) // page_size  # Округление вверх
+            if total_count is not None
+            else None
+        )
 
         return JSONResponse(
             content={
@@ -1005,6 +1079,7 @@ async def filter_movies(
                     "page": page,
                     "page_size": page_size,
                     "total_pages": total_pages,
+                    "next_cursor": next_cursor,
                 },
                 "filters": {
                     "title": title,
@@ -1032,70 +1107,16 @@ async def filter_movies(
     dependencies=[Security(api_key_header)],
 )
 async def get_movie_full_info(movie_id: int, db: AsyncSession = Depends(get_db)):
+    if movie_id_index.contains(movie_id) is False:
+        return JSONResponse(status_code=404, content={"message": "Фильм не найден"})
+
     try:
-        # Проверяем существование фильма
-        movie_result = await db.execute(select(Movie).where(Movie.id == movie_id))
-        movie = movie_result.scalars().first()
+        # Один запрос к БД при промахе кэша, ни одного при попадании
+        movie_data = await MovieService.load_full_movie(movie_id=movie_id, db=db)
 
-        if not movie:
+        if movie_data is None:
             return JSONResponse(status_code=404, content={"message": "Фильм не найден"})
 
-        # Получаем жанры фильма
-        genres_result = await db.execute(
-            select(Genre.name)
-            .join(movie_genres, Genre.id == movie_genres.c.genre_id)
-            .where(movie_genres.c.movie_id == movie_id)
-        )
-        genres = [genre[0] for genre in genres_result.fetchall()]
-
-        # Получаем актёров фильма
-        actors_result = await db.execute(
-            select(Actor.name)
-            .join(movie_actors, Actor.id == movie_actors.c.actor_id)
-            .where(movie_actors.c.movie_id == movie_id)
-        )
-        actors = [actor[0] for actor in actors_result.fetchall()]
-
-        # Получаем режиссёров фильма
-        directors_result = await db.execute(
-            select(Director.name)
-            .join(movie_directors, Director.id == movie_directors.c.director_id)
-            .where(movie_directors.c.movie_id == movie_id)
-        )
-        directors = [director[0] for director in directors_result.fetchall()]
-
-        # Получаем страны фильма
-        countries_result = await db.execute(
-            select(Country.name)
-            .join(movie_countries, Country.id == movie_countries.c.country_id)
-            .where(movie_countries.c.movie_id == movie_id)
-        )
-        countries = [country[0] for country in countries_result.fetchall()]
-
-        # Формируем ответ
-        movie_data = {
-            "id": movie.id,
-            "title": movie.title,
-            "year": movie.year,
-            "rating": movie.rating,
-            "genres": genres,
-            "actors": actors,
-            "directors": directors,
-            "countries": countries,
-            "created_at": (
-                movie.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                if movie.created_at
-                else None
-            ),
-        }
-
-        # Добавляем необязательные поля только если они не пустые
-        if movie.original_title:
-            movie_data["original_title"] = movie.original_title
-
-        if movie.description and movie.description.strip():
-            movie_data["description"] = movie.description
-
         return JSONResponse(content=movie_data)
     except Exception as e:
         logger.error(f"Ошибка при получении полной информации о фильме: {str(e)}")
@@ -8,8 +8,11 @@ from sqlalchemy import (
     Table,
     Float,
     Text,
+    Index,
+    Computed,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 from .db import Base
 import secrets
@@ -35,6 +38,8 @@ movie_genres = Table(
     Base.metadata,
     Column("movie_id", Integer, ForeignKey("movies.id")),
     Column("genre_id", Integer, ForeignKey("genres.id")),
+    # Фильтр по жанру - semi-join по genre_id (см. MovieService.genre_condition)
+    Index("ix_movie_genres_genre_id_movie_id", "genre_id", "movie_id"),
 )
 
 movie_countries = Table(
@@ -83,13 +88,46 @@ class APIRequest(Base):
     user = relationship("User", back_populates="requests")
 
 
+# Полнотекстовый вектор фильма: названия с весом A, описание с весом C.
+# Конфигурация russian стеммит и латинские слова (english_stem), english
+# добавлена для оригинальных названий. То же выражение создает миграция
+# (src/utils/migrations.py)
+MOVIE_SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('russian'::regconfig, coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('russian'::regconfig, coalesce(original_title, '')), 'A') || "
+    "setweight(to_tsvector('english'::regconfig, coalesce(original_title, '')), 'A') || "
+    "setweight(to_tsvector('russian'::regconfig, coalesce(description, '')), 'C')"
+)
+
+
 class Movie(Base):
     __tablename__ = "movies"
+    __table_args__ = (
+        # Поиск по названию (src/services/movie_search.py); trigram-индексам
+        # нужно расширение pg_trgm
+        Index("ix_movies_search_vector", "search_vector", postgresql_using="gin"),
+        Index(
+            "ix_movies_title_trgm",
+            "title",
+            postgresql_using="gin",
+            postgresql_ops={"title": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_movies_original_title_trgm",
+            "original_title",
+            postgresql_using="gin",
+            postgresql_ops={"original_title": "gin_trgm_ops"},
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     original_title = Column(String)
     description = Column(String)
+    # Вычисляется PostgreSQL; не загружается вместе с фильмом
+    search_vector = deferred(
+        Column(TSVECTOR, Computed(MOVIE_SEARCH_VECTOR_SQL, persisted=True))
+    )
     year = Column(Integer)
     rating = Column(Integer)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -5,7 +5,7 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from .api.routes import status_router, api_router, web_router, movies_router
-from .api.middleware import APIMiddleware, RequestCounterMiddleware, RateLimitMiddleware
+from .api.middleware import APIMiddleware
 from .db.schemas import UserResponse
 from fastapi import APIRouter
 from fastapi.middleware.cors import CORSMiddleware
@@ -15,7 +15,17 @@ from .db.db import database, SQLALCHEMY_DATABASE_URL, connect_db, disconnect_db
 from .services.rate_limiter import RateLimiter, rate_limiter
 import logging
 from contextlib import asynccontextmanager
-from .utils.caching import close_cache_connection
+from .utils.caching import close_cache_connection, hot_keys
+from .utils.catalog_generation import catalog_generation
+from .services.movie_index import movie_id_index
+from .services.genre_index import genre_dictionary
+from .services.title_index import TITLE_INDEX_ENABLED, title_index
+from .services.autocomplete import AUTOCOMPLETE_ENABLED, autocomplete_index
+from .services.random_sampler import movie_sampler
+from .services.movie_search import MovieSearch
+from .services.cache_warmup import cache_warmer
+from .api.api_status import api_status
+from .services.user_cache import user_cache, redis_pool_user_cache
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +52,33 @@ async def lifespan(
     # Подключаемся к базам данных
     await connect_db()  # Подключаем 'databases'
     logger.info("Database connection established.")
+    # Полнотекстовый поиск включается, только если выполнена миграция поиска
+    await MovieSearch.detect_backend()
+    # Подписываемся на инвалидацию кэша пользователей
+    await user_cache.start()
+    logger.info("User cache listener started.")
+    # Запускаем фоновые задачи лимитера (возврат истекших аренд квоты)
+    await rate_limiter.start()
+    # Запускаем фоновый сброс счетчиков запросов в Redis
+    await api_status.start()
+    # Читаем поколение каталога (входит в ключи кэша) и следим за его сменой
+    await catalog_generation.start()
+    # Битовая карта id фильмов для быстрых 404 (загружается в фоне)
+    await movie_id_index.start()
+    # Словарь жанров для разрешения фильтра по жанру в genre_id
+    await genre_dictionary.start()
+    # Массивы id фильмов (всех и по жанрам) для /random
+    await movie_sampler.start()
+    # Индекс триграмм названий для /search (строится в фоне)
+    if TITLE_INDEX_ENABLED:
+        await title_index.start()
+    # Таблица подсказок для /autocomplete (строится в фоне)
+    if AUTOCOMPLETE_ENABLED:
+        await autocomplete_index.start()
+    # Учет самых частых ключей кэша и прогрев кэша в фоне
+    # (до завершения прогрева /status/api/ready отвечает 503)
+    await hot_keys.start()
+    await cache_warmer.start()
     # Здесь можно инициализировать другие ресурсы, если нужно
     # Например, создать Redis клиенты из пулов и положить в app.state, если они нужны в эндпоинтах
     # app_instance.state.redis_counter_client = aioredis.Redis.from_pool(redis_pool_counter)
@@ -54,8 +91,24 @@ async def lifespan(
     #    await app_instance.state.redis_counter_client.close()
     # if hasattr(app_instance.state, 'redis_limiter_client'):
     #    await app_instance.state.redis_limiter_client.close()
+    # Останавливаем подписку кэша пользователей
+    await user_cache.stop()
+    await cache_warmer.stop()
+    # Сбрасываем накопленную статистику частых ключей
+    await hot_keys.stop()
+    await catalog_generation.stop()
+    await movie_id_index.stop()
+    await genre_dictionary.stop()
+    await movie_sampler.stop()
+    await title_index.stop()
+    await autocomplete_index.stop()
+    # Сбрасываем остаток счетчиков запросов
+    await api_status.stop()
+    # Возвращаем в Redis неиспользованные арендованные единицы квоты
+    await rate_limiter.stop()
     # Отключаем пулы
     await redis_pool_counter.disconnect()
+    await redis_pool_user_cache.disconnect()
     await redis_pool_limiter.disconnect()
     await close_cache_connection()
     logger.info("Redis connections closed.")
@@ -138,23 +191,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# APIMiddleware (должен идти первым, если он проверяет ключ и лимиты)
-# Убедись, что он не зависит от ресурсов, создаваемых в lifespan, если это так
-app.add_middleware(APIMiddleware)
+# APIMiddleware: единый ASGI middleware, который за один проход проверяет ключ,
+# списывает квоту, считает запрос и выставляет заголовки X-RateLimit-*.
+# Использует глобальный экземпляр rate_limiter и трекер api_status.
+app.add_middleware(APIMiddleware, limiter=rate_limiter)
 logger.info("APIMiddleware added.")
 
-# Request Counter Middleware
-# Используем глобальный пул для создания клиента
-app.add_middleware(
-    RequestCounterMiddleware, redis_client=aioredis.Redis.from_pool(redis_pool_counter)
-)
-logger.info("RequestCounterMiddleware added.")
-
-# Rate Limiter Middleware
-# Используем глобальный экземпляр rate_limiter, который сам использует глобальный пул
-app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
-logger.info("RateLimitMiddleware added.")
-
 
 # --- Роутеры ---
 # Создаем схему API ключа
@@ -0,0 +1,330 @@
+import asyncio
+import heapq
+import logging
+import os
+import re
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+from sqlalchemy.future import select
+from ..db.models import Movie
+from ..db.db import AsyncSessionFactory
+from ..utils.catalog_generation import GenerationBoundIndex
+from .title_index import TITLE_LOAD_BATCH_SIZE, normalize_title
+
+logger = logging.getLogger(__name__)
+
+# Сколько подсказок можно запросить за раз
+AUTOCOMPLETE_MAX_LIMIT = 20
+
+# Ключи хранятся не длиннее этого числа символов: префикс длиннее
+# сравнивается только по первым AUTOCOMPLETE_KEY_LENGTH символам
+AUTOCOMPLETE_KEY_LENGTH = 48
+
+# Размер блока для поиска минимума на отрезке
+RMQ_BLOCK = 64
+
+CYRILLIC_TO_LATIN = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "zh", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch",
+    "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+
+# Сочетания проверяются раньше одиночных букв (см. _LATIN_SEQUENCES)
+LATIN_TO_CYRILLIC = {
+    "shch": "щ", "sch": "щ", "zh": "ж", "kh": "х", "ts": "ц", "ch": "ч",
+    "sh": "ш", "yu": "ю", "ya": "я", "yo": "е", "ph": "ф", "th": "т",
+    "a": "а", "b": "б", "c": "к", "d": "д", "e": "е", "f": "ф", "g": "г",
+    "h": "х", "i": "и", "j": "дж", "k": "к", "l": "л", "m": "м", "n": "н",
+    "o": "о", "p": "п", "q": "к", "r": "р", "s": "с", "t": "т", "u": "у",
+    "v": "в", "w": "в", "x": "кс", "y": "и", "z": "з",
+}
+
+_LATIN_SEQUENCES = re.compile(
+    "|".join(sorted(LATIN_TO_CYRILLIC, key=len, reverse=True))
+)
+
+
+def to_latin(value: str) -> str:
+    """Транслитерация кириллицы латиницей (прочие символы не меняются)."""
+    return "".join(CYRILLIC_TO_LATIN.get(char, char) for char in value)
+
+
+def to_cyrillic(value: str) -> str:
+    """Обратная транслитерация латиницы кириллицей ("matrix" -> "матрикс")."""
+    return _LATIN_SEQUENCES.sub(lambda match: LATIN_TO_CYRILLIC[match.group()], value)
+
+
+def title_keys(*titles: Optional[str]) -> Set[str]:
+    """Нормализованные названия фильма и их транслитерации."""
+    keys: Set[str] = set()
+    for title in titles:
+        normalized = normalize_title(title) if title else ""
+        if not normalized:
+            continue
+        for key in (normalized, to_latin(normalized), to_cyrillic(normalized)):
+            keys.add(key[:AUTOCOMPLETE_KEY_LENGTH])
+    return keys
+
+
+class PackedStrings:
+    """
+    Неизменяемая таблица строк: все строки в UTF-8 в одном bytes и
+    массив смещений. Занимает в несколько раз меньше списка str.
+    """
+
+    def __init__(self, values: Iterable[bytes]):
+        offsets = array("I", [0])
+        parts = []
+        position = 0
+        for value in values:
+            parts.append(value)
+            position += len(value)
+            offsets.append(position)
+        self._blob = b"".join(parts)
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return self.raw(index).decode("utf-8")
+
+    def raw(self, index: int) -> bytes:
+        return self._blob[self._offsets[index] : self._offsets[index + 1]]
+
+    def bisect_left(self, value: bytes) -> int:
+        """Позиция value в отсортированной таблице (как bisect.bisect_left)."""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw(mid) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def memory_bytes(self) -> int:
+        return len(self._blob) + self._offsets.itemsize * len(self._offsets)
+
+
+class RangeMinimum:
+    """
+    Минимум массива на отрезке (RMQ): минимумы блоков по RMQ_BLOCK
+    элементов и разреженная таблица (sparse table) номеров блоков с
+    минимумом на отрезках из 2^j блоков. Запрос - два сравнения по
+    таблице и min по неполным блокам на краях (срезы, на C).
+    """
+
+    def __init__(self, values: array, block: int = RMQ_BLOCK):
+        self.values = values
+        self.block = block
+        block_min = array(
+            values.typecode,
+            (min(values[i : i + block]) for i in range(0, len(values), block)),
+        )
+        levels = [array("I", range(len(block_min)))]
+        width = 1
+        while 2 * width <= len(block_min):
+            previous = levels[-1]
+            levels.append(
+                array(
+                    "I",
+                    (
+                        a if block_min[a] <= block_min[b] else b
+                        for a, b in zip(previous, previous[width:])
+                    ),
+                )
+            )
+            width *= 2
+        self.block_min = block_min
+        self.levels = levels
+
+    def argmin(self, lo: int, hi: int) -> int:
+        """Позиция минимума на отрезке [lo, hi), lo < hi."""
+        values, block = self.values, self.block
+        first, last = -(-lo // block), hi // block
+        if first >= last:
+            segment = values[lo:hi]
+            return lo + segment.index(min(segment))
+
+        # Полные блоки [first, last): два перекрывающихся отрезка из 2^j блоков
+        level = (last - first).bit_length() - 1
+        a = self.levels[level][first]
+        b = self.levels[level][last - (1 << level)]
+        best = a if self.block_min[a] <= self.block_min[b] else b
+        start = best * block
+        segment = values[start : start + block]
+        value = self.block_min[best]
+        position = start + segment.index(value)
+
+        for start, end in ((lo, first * block), (last * block, hi)):
+            if start < end:
+                segment = values[start:end]
+                edge = min(segment)
+                if edge < value:
+                    value, position = edge, start + segment.index(edge)
+        return position
+
+    def smallest(self, lo: int, hi: int, limit: int) -> List[int]:
+        """Не больше limit наименьших различных значений на [lo, hi) по возрастанию."""
+        values = self.values
+        result: List[int] = []
+        if lo >= hi or limit <= 0:
+            return result
+        seen = set()
+        position = self.argmin(lo, hi)
+        heap = [(values[position], position, lo, hi)]
+        while heap and len(result) < limit:
+            value, position, lo, hi = heapq.heappop(heap)
+            if value not in seen:
+                seen.add(value)
+                result.append(value)
+            for start, end in ((lo, position), (position + 1, hi)):
+                if start < end:
+                    found = self.argmin(start, end)
+                    heapq.heappush(heap, (values[found], found, start, end))
+        return result
+
+    def memory_bytes(self) -> int:
+        size = self.block_min.itemsize * len(self.block_min)
+        for level in self.levels:
+            size += level.itemsize * len(level)
+        return size
+
+
+class TitleAutocomplete:
+    """
+    Таблица подсказок по префиксу названия.
+
+    Фильмы пронумерованы по популярности (рейтинг, затем год - других
+    сигналов популярности в каталоге нет), поэтому меньший номер
+    лучше. Ключи - нормализованные title и original_title и их
+    транслитерации - отсортированы как байты UTF-8; для каждого ключа
+    хранится номер фильма. Префикс задает отрезок ключей (два
+    бинарных поиска), лучшие фильмы на отрезке - наименьшие номера,
+    их дает RangeMinimum без просмотра всего отрезка.
+    """
+
+    def __init__(self):
+        self._rows: List[Sequence] = []
+        self.movie_ids = array("I")
+        self.years = array("h")
+        self.ratings = array("h")
+        self.titles = PackedStrings(())
+        self.original_titles = PackedStrings(())
+        self.keys = PackedStrings(())
+        self.refs = array("I")
+        self.rmq = RangeMinimum(self.refs)
+
+    def __len__(self) -> int:
+        return len(self.movie_ids)
+
+    def add_rows(self, rows: Iterable[Sequence]) -> None:
+        """Строки (id, title, original_title, year, rating); таблица строится в finish."""
+        self._rows.extend(rows)
+
+    def finish(self) -> None:
+        rows = self._rows
+        rows.sort(key=lambda row: (-(row[4] or 0), -(row[3] or 0), row[0]))
+        self.movie_ids = array("I", (row[0] for row in rows))
+        self.years = array("h", (row[3] or 0 for row in rows))
+        self.ratings = array("h", (-1 if row[4] is None else row[4] for row in rows))
+        self.titles = PackedStrings((row[1] or "").encode("utf-8") for row in rows)
+        self.original_titles = PackedStrings(
+            (row[2] or "").encode("utf-8") for row in rows
+        )
+
+        pairs = [
+            (key.encode("utf-8"), number)
+            for number, row in enumerate(rows)
+            for key in title_keys(row[1], row[2])
+        ]
+        self._rows = []
+        pairs.sort()
+        self.keys = PackedStrings(key for key, _ in pairs)
+        self.refs = array("I", (number for _, number in pairs))
+        self.rmq = RangeMinimum(self.refs)
+
+    def complete(self, prefix: str, limit: int) -> List[Dict[str, Any]]:
+        """Самые популярные фильмы, название которых начинается с prefix."""
+        key = normalize_title(prefix)[:AUTOCOMPLETE_KEY_LENGTH]
+        if not key:
+            return []
+        raw = key.encode("utf-8")
+        lo = self.keys.bisect_left(raw)
+        # 0xFF не встречается в UTF-8: это верхняя граница всех ключей с префиксом
+        hi = self.keys.bisect_left(raw + b"\xff")
+        return [self.suggestion(number) for number in self.rmq.smallest(lo, hi, limit)]
+
+    def suggestion(self, number: int) -> Dict[str, Any]:
+        suggestion: Dict[str, Any] = {
+            "id": self.movie_ids[number],
+            "title": self.titles[number],
+            "year": self.years[number] or None,
+            "rating": None if self.ratings[number] < 0 else self.ratings[number],
+        }
+        original_title = self.original_titles[number]
+        if original_title:
+            suggestion["original_title"] = original_title
+        return suggestion
+
+    def memory_bytes(self) -> int:
+        """Приблизительный объем памяти таблицы в байтах."""
+        size = self.keys.memory_bytes() + self.rmq.memory_bytes()
+        size += self.titles.memory_bytes() + self.original_titles.memory_bytes()
+        for column in (self.movie_ids, self.years, self.ratings, self.refs):
+            size += column.itemsize * len(column)
+        return size
+
+
+class AutocompleteIndex(GenerationBoundIndex):
+    """
+    Таблица подсказок /autocomplete в памяти воркера.
+
+    Строится при старте и перестраивается в фоне при смене поколения
+    каталога. БД при ответе не используется: пока таблица не готова
+    или не догнала текущее поколение, complete возвращает None.
+    """
+
+    name = "autocomplete"
+
+    def __init__(self, batch_size: int = TITLE_LOAD_BATCH_SIZE):
+        super().__init__()
+        self.batch_size = batch_size
+        self._data: Optional[TitleAutocomplete] = None
+
+    def complete(self, prefix: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Подсказки по префиксу или None, если таблица не готова."""
+        if not self.loaded:
+            return None
+        return self._data.complete(prefix, limit)
+
+    async def _load(self) -> None:
+        """Строит таблицу по всем фильмам и атомарно подменяет текущую."""
+        data = TitleAutocomplete()
+        async with AsyncSessionFactory() as session:
+            result = await session.stream(
+                select(
+                    Movie.id, Movie.title, Movie.original_title, Movie.year, Movie.rating
+                ).execution_options(yield_per=self.batch_size)
+            )
+            async for rows in result.partitions():
+                data.add_rows(rows)
+        # Сортировка ключей нагружает процессор: в отдельном потоке
+        await asyncio.to_thread(data.finish)
+
+        self._data = data
+        logger.info(
+            f"Autocomplete loaded: {len(data)} movies, {len(data.keys)} keys, "
+            f"~{data.memory_bytes() // (1024 * 1024)} MiB"
+        )
+
+
+# Таблица включена по умолчанию; AUTOCOMPLETE_ENABLED=0 - /autocomplete отвечает 503
+AUTOCOMPLETE_ENABLED = os.getenv("AUTOCOMPLETE_ENABLED", "1") == "1"
+
+autocomplete_index = AutocompleteIndex(
+    batch_size=int(os.getenv("AUTOCOMPLETE_BATCH_SIZE", str(TITLE_LOAD_BATCH_SIZE)))
+)
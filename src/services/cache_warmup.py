@@ -0,0 +1,188 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy.future import select
+from ..db.models import Genre
+from ..db.db import AsyncSessionFactory
+from ..utils.caching import cached_functions, hot_keys, warming_up
+
+logger = logging.getLogger(__name__)
+
+# Что прогревать по умолчанию: функция (имя закэшированной функции),
+# фиксированные параметры и, при for_each_genre, имя параметра,
+# в который подставляется каждый жанр из таблицы genres
+DEFAULT_WARMUP_TARGETS: List[Dict[str, Any]] = [
+    {"function": "get_genres"},
+    {"function": "get_genre_stats"},
+    {"function": "get_top_movies"},
+    {"function": "get_top_movies", "for_each_genre": "genre"},
+    {"function": "get_movies_by_genre", "for_each_genre": "genre"},
+]
+
+
+def load_warmup_targets() -> List[Dict[str, Any]]:
+    """Цели прогрева из CACHE_WARMUP (JSON-список) или значения по умолчанию."""
+    raw = os.getenv("CACHE_WARMUP")
+    if not raw:
+        return DEFAULT_WARMUP_TARGETS
+    try:
+        targets = json.loads(raw)
+        if not isinstance(targets, list):
+            raise ValueError("CACHE_WARMUP must be a JSON list")
+        return targets
+    except ValueError as e:
+        logger.error(f"Invalid CACHE_WARMUP, using defaults: {e}")
+        return DEFAULT_WARMUP_TARGETS
+
+
+class CacheWarmer:
+    """
+    Прогрев кэша при старте воркера.
+
+    Заполняет кэш для заданных целей (см. DEFAULT_WARMUP_TARGETS) и для
+    самых частых аргументов каждой закэшированной функции, накопленных
+    HotKeyTracker в Redis за прошлые запуски. Вызовы идут через сами
+    декораторы cache, поэтому уже лежащие в Redis значения только
+    подтягиваются в L1, а отсутствующие вычисляются. Пока прогрев не
+    завершен (или не истек timeout), ready = False.
+    """
+
+    def __init__(
+        self,
+        targets: Optional[List[Dict[str, Any]]] = None,
+        hot_keys_per_function: int = 50,
+        concurrency: int = 4,
+        timeout: float = 60.0,
+    ):
+        self.targets = DEFAULT_WARMUP_TARGETS if targets is None else targets
+        self.hot_keys_per_function = hot_keys_per_function
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.ready = False
+        self.status: Dict[str, Any] = {"state": "pending"}
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _resolve(name: str) -> Optional[Tuple[str, Callable]]:
+        """Находит закэшированную функцию по имени или префиксу ключей."""
+        for prefix, function in cached_functions.items():
+            if name == prefix or name == function.__name__:
+                return prefix, function
+        return None
+
+    async def _load_genres(self) -> List[str]:
+        async with AsyncSessionFactory() as session:
+            result = await session.execute(select(Genre.name).order_by(Genre.name))
+            return [name for name in result.scalars().all() if name]
+
+    async def _collect(self) -> List[Tuple[Callable, Dict[str, Any]]]:
+        """Собирает уникальные пары (функция, параметры) для прогрева."""
+        calls: Dict[Tuple[str, str], Tuple[Callable, Dict[str, Any]]] = {}
+
+        def add(prefix: str, function: Callable, params: Dict[str, Any]) -> None:
+            calls.setdefault(
+                (prefix, json.dumps(params, sort_keys=True, default=str)),
+                (function, params),
+            )
+
+        genres: Optional[List[str]] = None
+        for target in self.targets:
+            resolved = self._resolve(target.get("function", ""))
+            if resolved is None:
+                logger.warning(f"Unknown cache warm-up target: {target}")
+                continue
+            prefix, function = resolved
+            params = dict(target.get("params", {}))
+            genre_param = target.get("for_each_genre")
+            if genre_param:
+                if genres is None:
+                    genres = await self._load_genres()
+                for genre in genres:
+                    add(prefix, function, {**params, genre_param: genre})
+            else:
+                add(prefix, function, params)
+
+        # Самые частые ключи прошлых запусков
+        for prefix, function in cached_functions.items():
+            try:
+                for params in await hot_keys.top(prefix, self.hot_keys_per_function):
+                    if isinstance(params, dict):
+                        add(prefix, function, params)
+            except Exception as e:
+                logger.error(f"Failed to read hot cache keys for {prefix}: {e}")
+
+        return list(calls.values())
+
+    async def _warm_one(
+        self, semaphore: asyncio.Semaphore, function: Callable, params: Dict[str, Any]
+    ) -> bool:
+        async with semaphore:
+            token = warming_up.set(True)
+            try:
+                if "db" in inspect.signature(function).parameters:
+                    async with AsyncSessionFactory() as session:
+                        await function(**params, db=session)
+                else:
+                    await function(**params)
+                return True
+            except Exception as e:
+                logger.error(f"Cache warm-up failed for {function.__name__}({params}): {e}")
+                return False
+            finally:
+                warming_up.reset(token)
+
+    async def warm(self) -> None:
+        """Выполняет прогрев и отмечает воркер готовым."""
+        started = time.monotonic()
+        self.status = {"state": "warming"}
+        try:
+            calls = await self._collect()
+            self.status["total"] = len(calls)
+            semaphore = asyncio.Semaphore(self.concurrency)
+            results = await asyncio.wait_for(
+                asyncio.gather(
+                    *(self._warm_one(semaphore, function, params) for function, params in calls)
+                ),
+                timeout=self.timeout,
+            )
+            self.status.update(
+                state="done", warmed=sum(results), failed=len(results) - sum(results)
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Cache warm-up did not finish in {self.timeout}s")
+            self.status["state"] = "timeout"
+        except Exception as e:
+            logger.error(f"Cache warm-up failed: {e}")
+            self.status["state"] = "failed"
+        finally:
+            self.status["duration_s"] = round(time.monotonic() - started, 3)
+            # Даже неудачный прогрев не должен навсегда выводить воркер из работы
+            self.ready = True
+        logger.info(f"Cache warm-up finished: {self.status}")
+
+    async def start(self) -> None:
+        """Запускает прогрев в фоне; готовность сообщает ready."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.warm())
+
+    async def stop(self) -> None:
+        self.ready = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+cache_warmer = CacheWarmer(
+    targets=load_warmup_targets(),
+    hot_keys_per_function=int(os.getenv("CACHE_WARMUP_HOT_KEYS", "50")),
+    concurrency=int(os.getenv("CACHE_WARMUP_CONCURRENCY", "4")),
+    timeout=float(os.getenv("CACHE_WARMUP_TIMEOUT", "60")),
+)
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import re
+from typing import Dict, FrozenSet, List, Optional, Tuple
+from sqlalchemy.future import select
+from ..db.models import Genre
+from ..db.db import AsyncSessionFactory
+from ..utils.catalog_generation import GenerationBoundIndex
+
+logger = logging.getLogger(__name__)
+
+# Синонимы жанров: нормализованный запрос -> подстроки названий жанров в каталоге
+GENRE_ALIASES: Dict[str, List[str]] = {
+    "sci fi": ["фантастика"],
+    "scifi": ["фантастика"],
+    "science fiction": ["фантастика"],
+    "sf": ["фантастика"],
+    "fantasy": ["фэнтези"],
+    "comedy": ["комедия"],
+    "drama": ["драма"],
+    "action": ["боевик"],
+    "horror": ["ужасы"],
+    "thriller": ["триллер"],
+    "romance": ["мелодрама"],
+    "crime": ["криминал"],
+    "detective": ["детектив"],
+    "mystery": ["детектив"],
+    "adventure": ["приключения"],
+    "animation": ["мультфильм"],
+    "cartoon": ["мультфильм"],
+    "anime": ["аниме"],
+    "documentary": ["документальный"],
+    "family": ["семейный"],
+    "history": ["история"],
+    "biography": ["биография"],
+    "war": ["военный"],
+    "western": ["вестерн"],
+    "musical": ["мюзикл"],
+    "music": ["музыка"],
+    "sport": ["спорт"],
+    "kids": ["детский"],
+}
+
+# Сколько разных запросов помнит кэш разрешения (сбрасывается при перезагрузке)
+RESOLVE_CACHE_SIZE = 10000
+
+_SEPARATORS = re.compile(r"[\s\-_]+")
+
+
+def normalize_genre(value: str) -> str:
+    """Нормализация названия жанра: регистр (casefold), ё -> е, разделители -> пробел."""
+    return _SEPARATORS.sub(" ", value.casefold().replace("ё", "е")).strip()
+
+
+def load_genre_aliases() -> Dict[str, List[str]]:
+    """Синонимы по умолчанию, дополненные из GENRE_ALIASES (JSON-объект)."""
+    aliases = {key: list(targets) for key, targets in GENRE_ALIASES.items()}
+    raw = os.getenv("GENRE_ALIASES")
+    if raw:
+        try:
+            for key, targets in json.loads(raw).items():
+                if isinstance(targets, str):
+                    targets = [targets]
+                aliases[normalize_genre(key)] = [normalize_genre(t) for t in targets]
+        except (ValueError, AttributeError) as e:
+            logger.error(f"Invalid GENRE_ALIASES, using defaults: {e}")
+    return aliases
+
+
+class GenreDictionary(GenerationBoundIndex):
+    """
+    Словарь жанров в памяти воркера.
+
+    Таблица genres маленькая и меняется только при импорте, поэтому
+    строка жанра из запроса разрешается в набор genre_id без обращения
+    к БД: по вхождению подстроки в нормализованное название (как прежний
+    ILIKE '%...%') и по синонимам ("sci-fi" -> "фантастика"). Пустой набор
+    означает, что жанр точно не найден. Пока словарь не загружен или не
+    догнал текущее поколение каталога, resolve возвращает None, и
+    вызывающий код фильтрует по названию в SQL.
+    """
+
+    name = "genre dictionary"
+
+    def __init__(self, aliases: Optional[Dict[str, List[str]]] = None):
+        super().__init__()
+        self.aliases = GENRE_ALIASES if aliases is None else aliases
+        self._names: List[Tuple[str, int]] = []
+        self._resolved: Dict[str, FrozenSet[int]] = {}
+
+    def resolve(self, genre: str) -> Optional[FrozenSet[int]]:
+        """Набор id жанров, подходящих под строку запроса, или None - словарь не готов."""
+        if not self.loaded:
+            return None
+        key = normalize_genre(genre)
+        genre_ids = self._resolved.get(key)
+        if genre_ids is None:
+            terms = [key] + self.aliases.get(key, [])
+            genre_ids = frozenset(
+                genre_id
+                for name, genre_id in self._names
+                if any(term in name for term in terms)
+            )
+            if len(self._resolved) >= RESOLVE_CACHE_SIZE:
+                self._resolved.clear()
+            self._resolved[key] = genre_ids
+        return genre_ids
+
+    async def _load(self) -> None:
+        """Загружает таблицу genres и атомарно подменяет словарь."""
+        async with AsyncSessionFactory() as session:
+            result = await session.execute(select(Genre.id, Genre.name))
+            names = [(normalize_genre(name), genre_id) for genre_id, name in result if name]
+
+        self._names, self._resolved = names, {}
+        logger.info(f"Genre dictionary loaded: {len(names)} genres")
+
+
+genre_dictionary = GenreDictionary(aliases=load_genre_aliases())
@@ -0,0 +1,112 @@
+import logging
+import os
+import re
+from sqlalchemy import func, literal_column, or_, text
+from ..db.models import Movie
+from ..db.db import AsyncSessionFactory
+
+logger = logging.getLogger(__name__)
+
+# fts - полнотекстовый поиск и pg_trgm (нужна миграция run_search_migration);
+# ilike - прежнее сравнение по подстроке без ранжирования;
+# auto - fts, если миграция уже выполнена (проверяется при старте)
+SEARCH_BACKEND_FTS = "fts"
+SEARCH_BACKEND_ILIKE = "ilike"
+SEARCH_BACKEND_AUTO = "auto"
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", SEARCH_BACKEND_AUTO)
+
+# Есть ли колонка search_vector и расширение pg_trgm
+SEARCH_MIGRATION_CHECK_SQL = """
+SELECT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'movies' AND column_name = 'search_vector'
+) AND EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')
+"""
+
+# Конфигурации, которыми разбирается запрос (как и вектор Movie.search_vector)
+SEARCH_CONFIGS = ("russian", "english")
+
+# Слова запроса: буквы и цифры без подчеркивания, прочее - разделители
+_WORDS = re.compile(r"[^\W_]+")
+
+
+class MovieSearch:
+    """
+    Поиск фильмов по названию для /search и /filter.
+
+    Фильм подходит, если запрос найден полнотекстово (search_vector:
+    названия и описание, russian + english, последнее слово как префикс)
+    или подстрокой в title / original_title. Все условия обслуживаются
+    GIN-индексами (tsvector и pg_trgm), поэтому время поиска не растет
+    линейно с каталогом. Релевантность - ts_rank плюс триграммная
+    похожесть названия на запрос.
+
+    До проверки базы (detect_backend) и на базе без миграции поиск идет
+    прежним ILIKE: запрос к несуществующей колонке search_vector упал бы.
+    """
+
+    backend = SEARCH_BACKEND_ILIKE if SEARCH_BACKEND == SEARCH_BACKEND_AUTO else SEARCH_BACKEND
+
+    @staticmethod
+    async def detect_backend() -> str:
+        """Для SEARCH_BACKEND=auto включает fts, если миграция поиска выполнена."""
+        if SEARCH_BACKEND != SEARCH_BACKEND_AUTO:
+            return MovieSearch.backend
+        try:
+            async with AsyncSessionFactory() as session:
+                migrated = (await session.execute(text(SEARCH_MIGRATION_CHECK_SQL))).scalar()
+        except Exception as e:
+            logger.error(f"Failed to check search migration, using ILIKE search: {e}")
+            migrated = False
+        MovieSearch.backend = SEARCH_BACKEND_FTS if migrated else SEARCH_BACKEND_ILIKE
+        if not migrated:
+            logger.warning(
+                "search_vector column or pg_trgm is missing, using ILIKE search; "
+                "run python -m src.utils.migrations"
+            )
+        return MovieSearch.backend
+
+    @staticmethod
+    def tsquery(text: str):
+        """
+        tsquery из слов запроса: все слова обязательны, последнее - префикс
+        (запрос набирается по буквам). None, если слов нет.
+        """
+        words = _WORDS.findall(text)
+        if not words:
+            return None
+        expression = " & ".join(words[:-1] + [f"{words[-1]}:*"])
+        queries = [
+            func.to_tsquery(literal_column(f"'{config}'::regconfig"), expression)
+            for config in SEARCH_CONFIGS
+        ]
+        tsquery = queries[0]
+        for query in queries[1:]:
+            tsquery = tsquery.op("||")(query)
+        return tsquery
+
+    @staticmethod
+    def title_condition(text: str):
+        """Условие совпадения фильма с поисковой строкой."""
+        pattern = f"%{text}%"
+        condition = or_(Movie.title.ilike(pattern), Movie.original_title.ilike(pattern))
+        if MovieSearch.backend != SEARCH_BACKEND_FTS:
+            return condition
+        tsquery = MovieSearch.tsquery(text)
+        if tsquery is None:
+            return condition
+        return or_(Movie.search_vector.op("@@")(tsquery), condition)
+
+    @staticmethod
+    def rank(text: str):
+        """Выражение релевантности (больше - лучше) или None без полнотекстового поиска."""
+        if MovieSearch.backend != SEARCH_BACKEND_FTS:
+            return None
+        similarity = func.greatest(
+            func.similarity(func.coalesce(Movie.title, ""), text),
+            func.similarity(func.coalesce(Movie.original_title, ""), text),
+        )
+        tsquery = MovieSearch.tsquery(text)
+        if tsquery is None:
+            return similarity
+        return func.ts_rank(Movie.search_vector, tsquery) + similarity
@@ -0,0 +1,314 @@
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import and_, or_, func
+from ..db.models import (
+    Movie,
+    Genre,
+    Actor,
+    Director,
+    Country,
+    movie_genres,
+    movie_actors,
+    movie_directors,
+    movie_countries,
+)
+from ..db.db import AsyncSessionFactory
+from ..utils.caching import cache
+from .genre_index import genre_dictionary
+import base64
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк за раз читается из серверного курсора при потоковой отдаче
+STREAM_BATCH_SIZE = 500
+
+# Время жизни закэшированной карточки фильма (/{movie_id}/full)
+MOVIE_FULL_CACHE_TTL = int(os.getenv("MOVIE_FULL_CACHE_TTL", "21600"))
+
+
+def _names_subquery(association, foreign_key: str, entity):
+    """Коррелированный подзапрос: имена связанных сущностей фильма одним массивом."""
+    return (
+        select(func.array_agg(entity.name))
+        .select_from(association.join(entity, entity.id == association.c[foreign_key]))
+        .where(association.c.movie_id == Movie.id)
+        .scalar_subquery()
+    )
+
+
+class MovieService:
+    """
+    Общий слой загрузки и форматирования фильмов для списковых эндпоинтов.
+
+    Жанры для всей страницы фильмов подгружаются одним запросом
+    (movie_id IN (...)), а не отдельным запросом на каждый фильм.
+    """
+
+    @staticmethod
+    async def load_genres(
+        db: AsyncSession, movie_ids: Iterable[int]
+    ) -> Dict[int, List[str]]:
+        """Возвращает названия жанров для набора фильмов за один запрос."""
+        ids = list(dict.fromkeys(movie_ids))
+        genres_by_movie: Dict[int, List[str]] = defaultdict(list)
+        if not ids:
+            return genres_by_movie
+
+        result = await db.execute(
+            select(movie_genres.c.movie_id, Genre.name)
+            .join(Genre, Genre.id == movie_genres.c.genre_id)
+            .where(movie_genres.c.movie_id.in_(ids))
+        )
+        for movie_id, genre_name in result.all():
+            genres_by_movie[movie_id].append(genre_name)
+        return genres_by_movie
+
+    @staticmethod
+    async def load_movies(db: AsyncSession, movie_ids: Sequence[int]) -> List[Movie]:
+        """Фильмы по списку id за один запрос, в порядке списка (удаленные пропускаются)."""
+        if not movie_ids:
+            return []
+        result = await db.execute(select(Movie).where(Movie.id.in_(movie_ids)))
+        movies = {movie.id: movie for movie in result.scalars().all()}
+        return [movies[movie_id] for movie_id in movie_ids if movie_id in movies]
+
+    @staticmethod
+    def format_movie(
+        movie: Movie,
+        genres: Optional[List[str]] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Формирует словарь фильма для ответа API.
+
+        Если genres=None, поле genres в ответ не попадает (как в /movies).
+        Поля из extra добавляются перед created_at.
+        """
+        movie_data: Dict[str, Any] = {
+            "id": movie.id,
+            "title": movie.title,
+            "year": movie.year,
+        }
+        if genres is not None:
+            movie_data["genres"] = genres
+        movie_data["rating"] = movie.rating
+        if extra:
+            movie_data.update(extra)
+        movie_data["created_at"] = (
+            movie.created_at.strftime("%Y-%m-%d %H:%M:%S") if movie.created_at else None
+        )
+
+        # Добавляем необязательные поля только если они не пустые
+        if movie.original_title:
+            movie_data["original_title"] = movie.original_title
+
+        if movie.description and movie.description.strip():
+            movie_data["description"] = movie.description
+
+        return movie_data
+
+    @staticmethod
+    async def format_movies(
+        db: AsyncSession,
+        movies: Sequence[Movie],
+        extras: Optional[Sequence[Dict[str, Any]]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Форматирует страницу фильмов вместе с жанрами за один дополнительный запрос."""
+        genres_by_movie = await MovieService.load_genres(
+            db, (movie.id for movie in movies)
+        )
+        return [
+            MovieService.format_movie(
+                movie,
+                genres=list(genres_by_movie.get(movie.id, [])),
+                extra=extras[index] if extras else None,
+            )
+            for index, movie in enumerate(movies)
+        ]
+
+    @staticmethod
+    @cache(ttl=MOVIE_FULL_CACHE_TTL)
+    async def load_full_movie(
+        movie_id: int, db: Optional[AsyncSession] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Собирает полную карточку фильма одним запросом к БД.
+
+        Жанры, актёры, режиссёры и страны агрегируются в массивы
+        коррелированными подзапросами (array_agg) в том же SELECT.
+        Готовый документ кэшируется по movie_id; None (фильм не найден)
+        в кэш не попадает. Отдельной инвалидации нет: в ключ кэша входит
+        поколение каталога, которое увеличивает каждый импорт фильмов.
+        """
+        result = await db.execute(
+            select(
+                Movie,
+                _names_subquery(movie_genres, "genre_id", Genre).label("genres"),
+                _names_subquery(movie_actors, "actor_id", Actor).label("actors"),
+                _names_subquery(movie_directors, "director_id", Director).label(
+                    "directors"
+                ),
+                _names_subquery(movie_countries, "country_id", Country).label(
+                    "countries"
+                ),
+            ).where(Movie.id == movie_id)
+        )
+        row = result.first()
+        if row is None:
+            return None
+
+        movie = row.Movie
+        # Жанры идут в extra, чтобы сохранить порядок полей: ..., rating, genres, actors
+        return MovieService.format_movie(
+            movie,
+            extra={
+                "genres": list(row.genres or []),
+                "actors": list(row.actors or []),
+                "directors": list(row.directors or []),
+                "countries": list(row.countries or []),
+            },
+        )
+
+    @staticmethod
+    def _encode(movie_data: Dict[str, Any]) -> str:
+        # Те же параметры, что использует JSONResponse
+        return json.dumps(movie_data, ensure_ascii=False, separators=(",", ":"))
+
+    @staticmethod
+    async def stream_movies(
+        ndjson: bool = False, batch_size: int = STREAM_BATCH_SIZE
+    ) -> AsyncIterator[bytes]:
+        """
+        Отдает весь каталог потоком, читая фильмы через серверный курсор.
+
+        Пиковая память не зависит от размера каталога: в памяти одновременно
+        находится не больше batch_size строк. Сессия открывается здесь же,
+        так как генератор работает уже после выхода из обработчика.
+        """
+        async with AsyncSessionFactory() as session:
+            result = await session.stream_scalars(
+                select(Movie)
+                .order_by(Movie.id)
+                .execution_options(yield_per=batch_size)
+            )
+            first = True
+            if not ndjson:
+                yield b"["
+            async for movies in result.partitions():
+                if ndjson:
+                    chunk = "".join(
+                        MovieService._encode(MovieService.format_movie(movie)) + "\n"
+                        for movie in movies
+                    )
+                else:
+                    chunk = ",".join(
+                        MovieService._encode(MovieService.format_movie(movie))
+                        for movie in movies
+                    )
+                    if not first:
+                        chunk = "," + chunk
+                first = False
+                # Объекты уже сериализованы, отпускаем их из identity map сессии
+                session.expunge_all()
+                yield chunk.encode("utf-8")
+            if not ndjson:
+                yield b"]"
+
+    @staticmethod
+    def encode_cursor(sort_by: str, sort_order: str, value: Any, movie_id: int) -> str:
+        """Кодирует непрозрачный курсор: ключ сортировки + id последнего фильма."""
+        payload = json.dumps(
+            [sort_by, sort_order, value, movie_id],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str, sort_by: str, sort_order: str):
+        """
+        Декодирует курсор и проверяет, что он выдан для той же сортировки.
+
+        Returns:
+            tuple: (значение ключа сортировки, id последнего фильма)
+        Raises:
+            ValueError: если курсор поврежден или выдан для другой сортировки.
+        """
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            cursor_sort_by, cursor_order, value, movie_id = json.loads(
+                base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+            )
+        except Exception:
+            raise ValueError("Некорректный курсор")
+        if cursor_sort_by != sort_by or cursor_order != sort_order:
+            raise ValueError("Курсор выдан для другой сортировки")
+        if not isinstance(movie_id, int):
+            raise ValueError("Некорректный курсор")
+        return value, movie_id
+
+    @staticmethod
+    def keyset_condition(sort_column, sort_order: str, last_value: Any, last_id: int):
+        """
+        Условие «строки после курсора» для порядка
+        (sort_column {asc|desc} NULLS LAST, id ASC).
+        """
+        if last_value is None:
+            # Уже в хвосте с NULL-значениями: дальше только по id
+            return and_(sort_column.is_(None), Movie.id > last_id)
+
+        after_value = (
+            sort_column > last_value if sort_order == "asc" else sort_column < last_value
+        )
+        return or_(
+            after_value,
+            and_(sort_column == last_value, Movie.id > last_id),
+            sort_column.is_(None),
+        )
+
+    @staticmethod
+    def genre_condition(genre: str):
+        """
+        Условие «фильм относится к жанру»: semi-join по movie_genres.genre_id.
+
+        Жанр разрешается в id словарем жанров воркера. None означает, что
+        ни один жанр не подходит и запрос к БД не нужен. Пока словарь не
+        загружен, id жанров подбираются в SQL по названию (ILIKE).
+        """
+        genre_ids = genre_dictionary.resolve(genre)
+        if genre_ids is None:
+            genre_ids = select(Genre.id).where(Genre.name.ilike(f"%{genre}%"))
+        elif not genre_ids:
+            return None
+        else:
+            genre_ids = sorted(genre_ids)
+        return Movie.id.in_(
+            select(movie_genres.c.movie_id).where(movie_genres.c.genre_id.in_(genre_ids))
+        )
+
+    @staticmethod
+    async def estimate_count(db: AsyncSession, query) -> Optional[int]:
+        """
+        Оценка числа строк по плану запроса PostgreSQL (EXPLAIN без выполнения).
+
+        Возвращает None, если оценку получить не удалось.
+        """
+        try:
+            compiled = query.compile(
+                dialect=db.get_bind().dialect,
+                compile_kwargs={"literal_binds": True},
+            )
+            connection = await db.connection()
+            result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}")
+            plan = result.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"])
+        except Exception as e:
+            logger.warning(f"Failed to estimate row count: {e}")
+            return None
@@ -0,0 +1,113 @@
+import logging
+import os
+import random
+from array import array
+from typing import Dict, FrozenSet, List, Optional
+from sqlalchemy.future import select
+from ..db.models import Movie, movie_genres
+from ..db.db import AsyncSessionFactory
+from ..utils.catalog_generation import GenerationBoundIndex
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк читается из серверного курсора за раз при загрузке
+SAMPLER_LOAD_BATCH_SIZE = 10000
+
+# Сколько объединений нескольких жанров помнит выборщик (сбрасывается при перезагрузке)
+UNION_CACHE_SIZE = 1000
+
+
+class MovieSampler(GenerationBoundIndex):
+    """
+    Массивы id фильмов в памяти воркера для /random.
+
+    Хранит отсортированный array('I') id всего каталога и по массиву на
+    каждый жанр, поэтому случайный фильм - это случайный индекс в массиве
+    и выборка по первичному ключу, без count() и OFFSET. Запрос жанра
+    может совпасть с несколькими жанрами: их объединение строится один
+    раз и запоминается. Массивы отсортированы, так что с одним и тем же
+    seed в одном поколении каталога выборка одинакова во всех воркерах.
+    Пока выборщик не загружен или не догнал текущее поколение, sample
+    возвращает None, и /random выбирает фильм в БД.
+    """
+
+    name = "movie sampler"
+
+    def __init__(self, batch_size: int = SAMPLER_LOAD_BATCH_SIZE):
+        super().__init__()
+        self.batch_size = batch_size
+        self._all = array("I")
+        self._by_genre: Dict[int, array] = {}
+        self._unions: Dict[FrozenSet[int], array] = {}
+
+    def _ids(self, genre_ids: Optional[FrozenSet[int]]) -> array:
+        if genre_ids is None:
+            return self._all
+        if len(genre_ids) == 1:
+            (genre_id,) = genre_ids
+            return self._by_genre.get(genre_id, array("I"))
+        ids = self._unions.get(genre_ids)
+        if ids is None:
+            merged = set()
+            for genre_id in genre_ids:
+                merged.update(self._by_genre.get(genre_id, ()))
+            ids = array("I", sorted(merged))
+            if len(self._unions) >= UNION_CACHE_SIZE:
+                self._unions.clear()
+            self._unions[genre_ids] = ids
+        return ids
+
+    def sample(
+        self,
+        count: int,
+        genre_ids: Optional[FrozenSet[int]] = None,
+        seed: Optional[int] = None,
+    ) -> Optional[List[int]]:
+        """
+        До count различных случайных id фильмов (всех или указанных жанров).
+
+        None - выборщик не готов. С seed результат воспроизводим в пределах
+        поколения каталога.
+        """
+        if not self.loaded:
+            return None
+        ids = self._ids(genre_ids)
+        rng = random.Random(seed) if seed is not None else random
+        return [ids[i] for i in rng.sample(range(len(ids)), min(count, len(ids)))]
+
+    async def _load(self) -> None:
+        """Загружает id фильмов и связи с жанрами и атомарно подменяет массивы."""
+        all_ids = array("I")
+        by_genre: Dict[int, array] = {}
+        async with AsyncSessionFactory() as session:
+            result = await session.stream_scalars(
+                select(Movie.id).execution_options(yield_per=self.batch_size)
+            )
+            async for ids in result.partitions():
+                all_ids.extend(ids)
+
+            result = await session.stream(
+                select(movie_genres.c.genre_id, movie_genres.c.movie_id).execution_options(
+                    yield_per=self.batch_size
+                )
+            )
+            async for rows in result.partitions():
+                for genre_id, movie_id in rows:
+                    if genre_id is None or movie_id is None:
+                        continue
+                    ids = by_genre.get(genre_id)
+                    if ids is None:
+                        by_genre[genre_id] = ids = array("I")
+                    ids.append(movie_id)
+
+        all_ids = array("I", sorted(all_ids))
+        for genre_id, ids in by_genre.items():
+            by_genre[genre_id] = array("I", sorted(set(ids)))
+
+        self._all, self._by_genre, self._unions = all_ids, by_genre, {}
+        logger.info(f"Movie sampler loaded: {len(all_ids)} movies, {len(by_genre)} genres")
+
+
+movie_sampler = MovieSampler(
+    batch_size=int(os.getenv("SAMPLER_BATCH_SIZE", str(SAMPLER_LOAD_BATCH_SIZE)))
+)
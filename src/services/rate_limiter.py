@@ -1,129 +1,493 @@
-import redis
-import os
-from datetime import datetime
-import logging
-import traceback
-import time
-from redis import asyncio as aioredis
-from fastapi import Depends
-from typing import Tuple, Optional
-
-logger = logging.getLogger(__name__)
-
-
-class RateLimiter:
-    def __init__(self, redis_client: aioredis.Redis):
-        self.redis = redis_client
-        self.default_limit = 1000
-        self.default_period = 86400
-
-    async def check_and_update_limit(
-        self, identifier: str, limit_override: Optional[int] = None
-    ) -> Tuple[bool, int, int, int]:
-        """
-        Проверяет и обновляет лимит запросов для идентификатора (например, API ключа).
-
-        Args:
-            identifier: Уникальный идентификатор (API ключ).
-            limit_override: Максимальное количество запросов за период. Если None, используется лимит по умолчанию.
-
-        Returns:
-            tuple: (
-                can_proceed: bool - можно ли выполнить запрос,
-                remaining: int - сколько запросов осталось,
-                total_limit: int - общий лимит на период,
-                reset_time: int - timestamp UTC, когда лимит сбросится
-            )
-        """
-        current_limit, current_period = await self.get_user_limit_and_period(identifier)
-        limit_to_check = limit_override if limit_override is not None else current_limit
-
-        key = f"rate_limit:{identifier}"
-        now = int(time.time())
-
-        if limit_to_check <= 0:
-            reset_ts = (now // current_period + 1) * current_period
-            return False, 0, 0, reset_ts
-
-        async with self.redis.pipeline(transaction=True) as pipe:
-            pipe.zremrangebyscore(key, 0, now - current_period)
-            pipe.zadd(key, {str(now): now})
-            pipe.zcard(key)
-            pipe.expire(key, current_period)
-            pipe.ttl(key)
-            results = await pipe.execute()
-
-        current_count = results[2]
-        ttl = results[4]
-
-        remaining = limit_to_check - current_count
-        can_proceed = remaining >= 0
-
-        reset_time = (
-            now + ttl if ttl > 0 else (now // current_period + 1) * current_period
-        )
-
-        if not can_proceed:
-            remaining = 0
-
-        reset_dt = datetime.fromtimestamp(reset_time).strftime("%Y-%m-%d %H:%M:%S UTC")
-        print(
-            f"Rate limit check for {identifier}: Count={current_count}, Limit={limit_to_check}, Remaining={remaining}, CanProceed={can_proceed}, ResetAt={reset_dt}"
-        )
-
-        return can_proceed, remaining, limit_to_check, reset_time
-
-    async def get_usage_info(self, identifier: str) -> Tuple[int, int, int]:
-        """Получаем информацию о текущем использовании без увеличения счетчика"""
-        key = f"rate_limit:{identifier}"
-        now = int(time.time())
-        limit, period = await self.get_user_limit_and_period(identifier)
-
-        async with self.redis.pipeline(transaction=False) as pipe:
-            pipe.zcard(key)
-            pipe.ttl(key)
-            results = await pipe.execute()
-
-        current_count = results[0] if results[0] is not None else 0
-        ttl = results[1]
-
-        reset_time = now + ttl if ttl > 0 else (now // period + 1) * period
-
-        return current_count, limit, reset_time
-
-    async def set_user_limit(self, identifier: str, limit: int, period: int = 86400):
-        """Устанавливает или обновляет лимит для пользователя."""
-        limit_key = f"rate_limit_config:{identifier}:limit"
-        period_key = f"rate_limit_config:{identifier}:period"
-        config_ttl = 365 * 86400
-
-        async with self.redis.pipeline(transaction=True) as pipe:
-            pipe.setex(limit_key, config_ttl, limit)
-            pipe.setex(period_key, config_ttl, period)
-            await pipe.execute()
-        print(f"Установлен лимит для {identifier}: {limit} запросов / {period} сек")
-
-    async def get_user_limit_and_period(self, identifier: str) -> Tuple[int, int]:
-        """Получает настроенный лимит и период для пользователя."""
-        limit_key = f"rate_limit_config:{identifier}:limit"
-        period_key = f"rate_limit_config:{identifier}:period"
-
-        async with self.redis.pipeline(transaction=False) as pipe:
-            pipe.get(limit_key)
-            pipe.get(period_key)
-            results = await pipe.execute()
-
-        limit_str = results[0]
-        period_str = results[1]
-
-        limit = int(limit_str) if limit_str else self.default_limit
-        period = int(period_str) if period_str else self.default_period
-
-        return limit, period
-
-
-# Создаем экземпляр для использования в других модулях
-redis_pool_limiter = aioredis.ConnectionPool.from_url(
-    os.getenv("REDIS_URL", "redis://redis:6379/0"), decode_responses=True
-)
-rate_limiter = RateLimiter(aioredis.Redis.from_pool(redis_pool_limiter))
+import os
+import logging
+import time
+from redis import asyncio as aioredis
+from typing import Dict, Tuple, Optional
+from dataclasses import dataclass
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+
+# Скользящее окно по двум счетчикам (sliding window counter).
+# Состояние ключа — хеш из трех полей постоянного размера:
+#   w — начало текущего окна, c — запросов в текущем окне, p — в предыдущем.
+# Оценка числа запросов за последний период: p * (доля предыдущего окна) + c.
+# Весь расчет, включая чтение конфигурации лимита, выполняется атомарно
+# на стороне Redis за один round trip.
+#
+# KEYS[1] — состояние, KEYS[2] — настроенный лимит, KEYS[3] — настроенный период
+# ARGV[1] — лимит по умолчанию, ARGV[2] — период по умолчанию,
+# ARGV[3] — переопределение лимита ("" если нет), ARGV[4] — стоимость запроса
+# (0 — только посмотреть, ничего не списывая),
+# ARGV[5] — доля оставшейся квоты, которую можно выдать частично ("" — все или ничего)
+# Возвращает {allowed, remaining, limit, reset_time, count, granted, window}
+SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[3])
+if not limit then
+    limit = tonumber(redis.call('GET', KEYS[2])) or tonumber(ARGV[1])
+end
+local period = tonumber(redis.call('GET', KEYS[3])) or tonumber(ARGV[2])
+local cost = tonumber(ARGV[4])
+local fraction = tonumber(ARGV[5])
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local window = math.floor(now / period) * period
+
+local state = redis.call('HMGET', KEYS[1], 'w', 'c', 'p')
+local w = tonumber(state[1])
+local c = tonumber(state[2]) or 0
+local p = tonumber(state[3]) or 0
+if w ~= window then
+    if w == window - period then
+        p = c
+    else
+        p = 0
+    end
+    c = 0
+end
+
+local weight = (period - (now - window)) / period
+local count = math.ceil(p * weight + c)
+local available = limit - count
+if available < 0 then
+    available = 0
+end
+
+local granted = 0
+if limit > 0 and cost > 0 then
+    if fraction then
+        granted = math.min(cost, available, math.max(1, math.floor(available * fraction)))
+    elseif cost <= available then
+        granted = cost
+    end
+end
+local allowed = 0
+if granted > 0 then
+    allowed = 1
+    c = c + granted
+    count = count + granted
+end
+
+if granted > 0 or (state[1] and w ~= window) then
+    redis.call('HSET', KEYS[1], 'w', window, 'c', c, 'p', p)
+    redis.call('EXPIRE', KEYS[1], period * 2)
+end
+
+local remaining = limit - count
+if remaining < 0 then
+    remaining = 0
+end
+return {allowed, remaining, limit, window + period, count, granted, window}
+"""
+
+# Возврат неиспользованных единиц квоты (см. LeasingRateLimiter).
+# Единицы возвращаются в то окно, из которого были взяты: в текущее,
+# если оно не сменилось, или в предыдущее, если окно успело смениться один раз.
+#
+# KEYS[1] — состояние, KEYS[2] — настроенный период
+# ARGV[1] — начало окна, в котором взята аренда, ARGV[2] — число единиц,
+# ARGV[3] — период по умолчанию
+# Возвращает число фактически возвращенных единиц
+REFUND_SCRIPT = """
+local period = tonumber(redis.call('GET', KEYS[2])) or tonumber(ARGV[3])
+local lease_window = tonumber(ARGV[1])
+local units = tonumber(ARGV[2])
+
+local w = tonumber(redis.call('HGET', KEYS[1], 'w'))
+local field
+if w == lease_window then
+    field = 'c'
+elseif w == lease_window + period then
+    field = 'p'
+else
+    return 0
+end
+
+local value = tonumber(redis.call('HGET', KEYS[1], field)) or 0
+local refunded = math.min(units, value)
+redis.call('HSET', KEYS[1], field, value - refunded)
+return refunded
+"""
+
+
+class RateLimiter:
+    def __init__(self, redis_client: aioredis.Redis):
+        self.redis = redis_client
+        self.default_limit = 1000
+        self.default_period = 86400
+        self._script = self.redis.register_script(SLIDING_WINDOW_SCRIPT)
+
+    async def start(self) -> None:
+        """Запускает фоновые задачи лимитера (базовому лимитеру они не нужны)."""
+
+    async def stop(self) -> None:
+        """Останавливает фоновые задачи лимитера."""
+
+    async def _run_script(
+        self,
+        identifier: str,
+        limit_override: Optional[int],
+        cost: int,
+        fraction: Optional[float] = None,
+    ) -> Tuple[int, int, int, int, int, int, int]:
+        result = await self._script(
+            keys=[
+                f"rate_limit:{identifier}:sw",
+                f"rate_limit_config:{identifier}:limit",
+                f"rate_limit_config:{identifier}:period",
+            ],
+            args=[
+                self.default_limit,
+                self.default_period,
+                "" if limit_override is None else limit_override,
+                cost,
+                "" if fraction is None else fraction,
+            ],
+        )
+        return tuple(int(value) for value in result)
+
+    async def check_and_update_limit(
+        self, identifier: str, limit_override: Optional[int] = None
+    ) -> Tuple[bool, int, int, int]:
+        """
+        Проверяет и обновляет лимит запросов для идентификатора (например, API ключа).
+
+        Выполняется одним Lua-скриптом: чтение конфигурации, проверка и
+        списание происходят атомарно за один round trip, а на ключ хранится
+        состояние постоянного размера. Отклоненные запросы квоту не расходуют.
+
+        Args:
+            identifier: Уникальный идентификатор (API ключ).
+            limit_override: Максимальное количество запросов за период. Если None, используется лимит по умолчанию.
+
+        Returns:
+            tuple: (
+                can_proceed: bool - можно ли выполнить запрос,
+                remaining: int - сколько запросов осталось,
+                total_limit: int - общий лимит на период,
+                reset_time: int - timestamp UTC, когда лимит сбросится
+            )
+        """
+        allowed, remaining, limit, reset_time, count, _, _ = await self._run_script(
+            identifier, limit_override, 1
+        )
+        can_proceed = bool(allowed)
+
+        logger.debug(
+            f"Rate limit check for {identifier}: Count={count}, Limit={limit}, Remaining={remaining}, CanProceed={can_proceed}, ResetAt={reset_time}"
+        )
+
+        return can_proceed, remaining, limit, reset_time
+
+    async def get_usage_info(self, identifier: str) -> Tuple[int, int, int]:
+        """Получаем информацию о текущем использовании без увеличения счетчика"""
+        _, _, limit, reset_time, count, _, _ = await self._run_script(
+            identifier, None, 0
+        )
+        return count, limit, reset_time
+
+    async def set_user_limit(self, identifier: str, limit: int, period: int = 86400):
+        """Устанавливает или обновляет лимит для пользователя."""
+        limit_key = f"rate_limit_config:{identifier}:limit"
+        period_key = f"rate_limit_config:{identifier}:period"
+        config_ttl = 365 * 86400
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.setex(limit_key, config_ttl, limit)
+            pipe.setex(period_key, config_ttl, period)
+            await pipe.execute()
+        logger.info(f"Установлен лимит для {identifier}: {limit} запросов / {period} сек")
+
+
+@dataclass
+class QuotaLease:
+    """Блок единиц квоты, заранее списанный в Redis и расходуемый локально."""
+
+    limit: int
+    window: int
+    reset_time: int
+    available: int
+    # Остаток квоты в Redis сразу после выдачи аренды (без учета самой аренды)
+    server_remaining: int
+    expires_at: float
+
+
+class LeasingRateLimiter(RateLimiter):
+    """
+    Лимитер с арендой квоты для самых нагруженных ключей.
+
+    Когда ключ делает в воркере не меньше lease_min_requests запросов за
+    lease_ttl секунд, воркер атомарно списывает в Redis блок из lease_size
+    единиц и дальше расходует его в памяти без обращений к Redis. Неизрасходованные
+    единицы возвращаются при истечении аренды и при остановке процесса.
+
+    Точность ограничивается параметрами:
+    - lease_size — максимум единиц, которые один воркер держит у себя;
+    - lease_ttl — как долго единицы могут простаивать в чужом воркере;
+    - max_lease_fraction — какую долю оставшейся квоты может забрать одна аренда,
+      так что ближе к исчерпанию лимита аренды становятся мельче вплоть до 1.
+    Перерасхода лимита аренда не допускает: все выданные единицы учтены в Redis.
+    """
+
+    def __init__(
+        self,
+        redis_client: aioredis.Redis,
+        lease_size: int = 50,
+        lease_ttl: float = 5.0,
+        max_lease_fraction: float = 0.1,
+        lease_min_requests: Optional[int] = None,
+    ):
+        super().__init__(redis_client)
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self.max_lease_fraction = max_lease_fraction
+        self.lease_min_requests = (
+            lease_min_requests if lease_min_requests is not None else lease_size
+        )
+        self._refund_script = self.redis.register_script(REFUND_SCRIPT)
+        self._leases: Dict[str, QuotaLease] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Счетчики запросов по ключам для определения «горячих» ключей
+        self._recent: Dict[str, Tuple[float, int]] = {}
+        self._sweeper_task: Optional[asyncio.Task] = None
+        self.metrics = {
+            "lease_hits": 0,
+            "lease_misses": 0,
+            "direct_checks": 0,
+            "leases_acquired": 0,
+            "units_leased": 0,
+            "units_returned": 0,
+        }
+
+    def _is_hot(self, identifier: str, now: float) -> bool:
+        started, count = self._recent.get(identifier, (now, 0))
+        if now - started > self.lease_ttl:
+            started, count = now, 0
+        count += 1
+        self._recent[identifier] = (started, count)
+        return count >= self.lease_min_requests
+
+    async def check_and_update_limit(
+        self, identifier: str, limit_override: Optional[int] = None
+    ) -> Tuple[bool, int, int, int]:
+        now = time.monotonic()
+        lease = self._leases.get(identifier)
+        if lease is not None:
+            if self._take_from_lease(lease, limit_override, now):
+                self.metrics["lease_hits"] += 1
+                return self._lease_result(lease)
+            self.metrics["lease_misses"] += 1
+
+        if lease is None and not self._is_hot(identifier, now):
+            self.metrics["direct_checks"] += 1
+            return await super().check_and_update_limit(identifier, limit_override)
+
+        lock = self._locks.setdefault(identifier, asyncio.Lock())
+        async with lock:
+            # Пока ждали блокировку, аренду мог получить соседний запрос
+            lease = self._leases.get(identifier)
+            if lease is not None and self._take_from_lease(
+                lease, limit_override, time.monotonic()
+            ):
+                self.metrics["lease_hits"] += 1
+                return self._lease_result(lease)
+
+            if lease is not None:
+                await self._release(identifier, lease)
+
+            allowed, remaining, limit, reset_time, _, granted, window = (
+                await self._run_script(
+                    identifier,
+                    limit_override,
+                    self.lease_size,
+                    self.max_lease_fraction,
+                )
+            )
+            if not allowed:
+                return False, 0, limit, reset_time
+
+            self.metrics["leases_acquired"] += 1
+            self.metrics["units_leased"] += granted
+            lease = QuotaLease(
+                limit=limit,
+                window=window,
+                reset_time=reset_time,
+                available=granted - 1,  # одну единицу тратит текущий запрос
+                server_remaining=remaining,
+                expires_at=time.monotonic() + self.lease_ttl,
+            )
+            if lease.available > 0:
+                self._leases[identifier] = lease
+            else:
+                self._leases.pop(identifier, None)
+            return self._lease_result(lease)
+
+    def _take_from_lease(
+        self, lease: QuotaLease, limit_override: Optional[int], now: float
+    ) -> bool:
+        if (
+            lease.available <= 0
+            or lease.expires_at <= now
+            or time.time() >= lease.reset_time
+            or (limit_override is not None and limit_override != lease.limit)
+        ):
+            return False
+        lease.available -= 1
+        return True
+
+    @staticmethod
+    def _lease_result(lease: QuotaLease) -> Tuple[bool, int, int, int]:
+        return (
+            True,
+            lease.server_remaining + lease.available,
+            lease.limit,
+            lease.reset_time,
+        )
+
+    async def _release(self, identifier: str, lease: QuotaLease) -> None:
+        """Возвращает неиспользованные единицы аренды в Redis."""
+        if self._leases.get(identifier) is lease:
+            del self._leases[identifier]
+        units, lease.available = lease.available, 0
+        if units <= 0:
+            return
+        try:
+            refunded = await self._refund_script(
+                keys=[
+                    f"rate_limit:{identifier}:sw",
+                    f"rate_limit_config:{identifier}:period",
+                ],
+                args=[lease.window, units, self.default_period],
+            )
+            self.metrics["units_returned"] += int(refunded)
+        except aioredis.RedisError as e:
+            logger.error(f"Failed to return leased quota for {identifier}: {e}")
+
+    async def get_usage_info(self, identifier: str) -> Tuple[int, int, int]:
+        count, limit, reset_time = await super().get_usage_info(identifier)
+        # Единицы, которые лежат в аренде у этого воркера, еще не израсходованы
+        lease = self._leases.get(identifier)
+        if lease is not None and lease.reset_time == reset_time:
+            count = max(0, count - lease.available)
+        return count, limit, reset_time
+
+    def get_lease_metrics(self) -> Dict[str, float]:
+        """Метрики аренды квоты в текущем воркере."""
+        metrics = dict(self.metrics)
+        served = metrics["lease_hits"] + metrics["lease_misses"] + metrics["direct_checks"]
+        metrics["lease_hit_rate"] = (
+            round(metrics["lease_hits"] / served, 4) if served else 0.0
+        )
+        metrics["active_leases"] = len(self._leases)
+        metrics["units_held"] = sum(lease.available for lease in self._leases.values())
+        return metrics
+
+    async def _sweep(self) -> None:
+        """Периодически возвращает единицы из истекших аренд."""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 2)
+            now = time.monotonic()
+            for identifier, lease in list(self._leases.items()):
+                if lease.expires_at <= now:
+                    await self._release(identifier, lease)
+            for identifier, (started, _) in list(self._recent.items()):
+                if now - started > self.lease_ttl:
+                    del self._recent[identifier]
+            for identifier in list(self._locks):
+                if identifier not in self._leases and not self._locks[identifier].locked():
+                    del self._locks[identifier]
+
+    async def start(self) -> None:
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.create_task(self._sweep())
+
+    async def stop(self) -> None:
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            try:
+                await self._sweeper_task
+            except asyncio.CancelledError:
+                pass
+            self._sweeper_task = None
+        for identifier, lease in list(self._leases.items()):
+            await self._release(identifier, lease)
+
+
+class FractionalQuota:
+    """
+    Дробная стоимость запроса для дешевых маршрутов (например, /autocomplete).
+
+    Квота в Redis считается целыми единицами, поэтому воркер копит по
+    ключу долю единицы и отправляет запрос в лимитер, только когда
+    накопилась целая единица: при стоимости 0.1 списывается каждый
+    десятый запрос. Первый запрос ключа в воркере и запросы после
+    отказа проверяются всегда, так что исчерпанный ключ не проходит
+    бесплатно. Стоимость 0 - маршрут квоту не расходует. Для заголовков
+    X-RateLimit-* запросов без списания запоминается последний ответ
+    лимитера по ключу.
+    """
+
+    def __init__(self, cost: float, max_keys: int = 100000):
+        self.cost = min(max(cost, 0.0), 1.0)
+        self.max_keys = max_keys
+        self._owed: Dict[str, float] = {}
+        self._limits: Dict[str, Tuple[int, int, int]] = {}
+
+    def due(self, identifier: str) -> bool:
+        """Нужно ли списать за этот запрос целую единицу квоты."""
+        if self.cost <= 0:
+            return False
+        owed = self._owed.get(identifier)
+        if owed is None:
+            if len(self._owed) >= self.max_keys:
+                self._owed.clear()
+                self._limits.clear()
+            owed = 1.0
+        else:
+            owed += self.cost
+        # Допуск на погрешность сложения (10 * 0.1 < 1.0)
+        if owed >= 1.0 - 1e-9:
+            self._owed[identifier] = 0.0
+            return True
+        self._owed[identifier] = owed
+        return False
+
+    def reject(self, identifier: str) -> None:
+        """Лимитер отказал: следующий запрос ключа снова идет в лимитер."""
+        self._owed.pop(identifier, None)
+
+    def remember(self, identifier: str, remaining: int, limit: int, reset_time: int) -> None:
+        """Запоминает ответ лимитера для запросов ключа без списания."""
+        self._limits[identifier] = (remaining, limit, reset_time)
+
+    def last_limits(self, identifier: str) -> Optional[Tuple[int, int, int]]:
+        """Последние (remaining, limit, reset_time) ключа или None."""
+        return self._limits.get(identifier)
+
+
+# Создаем экземпляр для использования в других модулях
+redis_pool_limiter = aioredis.ConnectionPool.from_url(
+    os.getenv("REDIS_URL", "redis://redis:6379/0"), decode_responses=True
+)
+# Аренда квоты включается, если задан размер аренды (RATE_LIMIT_LEASE_SIZE > 0)
+RATE_LIMIT_LEASE_SIZE = int(os.getenv("RATE_LIMIT_LEASE_SIZE", "0"))
+if RATE_LIMIT_LEASE_SIZE > 0:
+    rate_limiter = LeasingRateLimiter(
+        aioredis.Redis.from_pool(redis_pool_limiter),
+        lease_size=RATE_LIMIT_LEASE_SIZE,
+        lease_ttl=float(os.getenv("RATE_LIMIT_LEASE_TTL", "5")),
+        max_lease_fraction=float(os.getenv("RATE_LIMIT_LEASE_MAX_FRACTION", "0.1")),
+        lease_min_requests=int(
+            os.getenv("RATE_LIMIT_LEASE_MIN_REQUESTS", str(RATE_LIMIT_LEASE_SIZE))
+        ),
+    )
+else:
+    rate_limiter = RateLimiter(aioredis.Redis.from_pool(redis_pool_limiter))
+
+# Маршруты, запрос к которым стоит меньше целой единицы квоты
+fractional_quotas: Dict[str, FractionalQuota] = {}
+AUTOCOMPLETE_QUOTA_COST = float(os.getenv("AUTOCOMPLETE_QUOTA_COST", "1"))
+if AUTOCOMPLETE_QUOTA_COST < 1:
+    fractional_quotas["/autocomplete"] = FractionalQuota(AUTOCOMPLETE_QUOTA_COST)
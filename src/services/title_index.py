@@ -0,0 +1,390 @@
+"""
+Индекс триграмм названий фильмов в памяти воркера для /search.
+
+Результаты приблизительные: частые триграммы не порождают кандидатов, а
+только досчитывают совпадения лучшим из них, поэтому время поиска
+ограничено, но часть лучших совпадений может не попасть в ответ. В
+бенчмарке (src/utils/benchmark_title_index.py, запросы с опечатками и
+недописанные, limit 10) нужное название попадает в первые 10 примерно в
+70% запросов (74% на 100 тыс. названий, 68% на 1 млн), а точное полное
+название - примерно в 96%. Поэтому индекс выключен по умолчанию
+(TITLE_INDEX_ENABLED=1 включает его), и даже включенный он отвечает
+только на запросы не короче TITLE_INDEX_MIN_QUERY_LENGTH символов и
+только если нашел полные limit фильмов. Иначе, а также пока индекс не
+готов и при фильтре по жанру, /search идет в PostgreSQL.
+
+Поиск занимает до десятков миллисекунд на больших каталогах (p99 21 мс
+на 100 тыс. названий, 49 мс на 1 млн), поэтому TitleIndex.search
+выполняется в пуле потоков, а не в цикле событий.
+"""
+
+import asyncio
+import heapq
+import logging
+import math
+import os
+import re
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from sqlalchemy.future import select
+from ..db.models import Movie
+from ..db.db import AsyncSessionFactory
+from ..utils.catalog_generation import GenerationBoundIndex
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк читается из серверного курсора за раз при загрузке
+TITLE_LOAD_BATCH_SIZE = 10000
+
+# Минимальная доля триграмм запроса, которые должны найтись в названии
+TITLE_INDEX_MIN_SCORE = 0.4
+
+# Триграмма частая, если встречается в большей доле названий (но не менее
+# чем в COMMON_MIN_DOCS): по ее списку кандидаты не ищутся, он только
+# досчитывает совпадения лучшим кандидатам
+COMMON_FRACTION = 0.02
+COMMON_MIN_DOCS = 1000
+
+# Сколько лучших кандидатов на одну позицию ответа досчитывается по частым триграммам
+CANDIDATES_PER_RESULT = 8
+
+# Сколько оставшихся кандидатов не больше досчитывается, если они еще
+# могут войти в ответ
+REFINE_BUDGET = 1024
+
+# Подсчет по частым триграммам идет по отрезкам номеров документов:
+# длина первого отрезка и сколько номеров из списков просматривается всего
+WALK_START = 1024
+WALK_BUDGET = 30000
+
+# Во сколько раз список должен быть длиннее числа кандидатов, чтобы
+# проверять кандидатов бинарным поиском, а не проходом по всему списку
+BISECT_RATIO = 32
+
+# Более короткие запросы не дают триграмм для поиска подстроки: их ищет БД
+TITLE_INDEX_MIN_QUERY_LENGTH = 3
+
+_NON_WORD = re.compile(r"[\W_]+")
+_EMPTY = array("I")
+
+
+def normalize_title(value: str) -> str:
+    """Нормализация названия: регистр (casefold), ё -> е, не буквы и цифры -> пробел."""
+    return _NON_WORD.sub(" ", value.casefold().replace("ё", "е")).strip()
+
+
+def title_trigrams(value: Optional[str]) -> Set[str]:
+    """Триграммы слов названия; слово дополняется пробелами, как в pg_trgm."""
+    trigrams: Set[str] = set()
+    if not value:
+        return trigrams
+    for word in normalize_title(value).split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            trigrams.add(padded[i : i + 3])
+    return trigrams
+
+
+class TitleTrigrams:
+    """
+    Инвертированный индекс триграмм названий (title и original_title).
+
+    Для каждой триграммы хранится отсортированный массив номеров
+    документов (array('I')), для документа - id фильма, год и рейтинг.
+    После построения (finish) документы перенумерованы так, что меньший
+    номер лучше при равном числе совпавших триграмм: короче название
+    (выше похожесть по Жаккару), выше рейтинг, новее год. Поэтому при
+    равенстве выбираются просто наименьшие номера.
+
+    Поиск считает совпавшие триграммы запроса (ScanCount) только по
+    редким спискам; лучшим кандидатам совпадения в частых списках
+    досчитываются бинарным поиском. Документы, которых нет в редких
+    списках (опечатка в запросе), ищутся подсчетом по частым спискам
+    от меньших номеров к большим с ограниченным бюджетом: результат
+    приближенный, зато время запроса ограничено.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, array] = {}
+        self.movie_ids = array("I")
+        self.lengths = array("H")
+        self.years = array("h")
+        self.ratings = array("f")
+        self.common_limit = COMMON_MIN_DOCS
+        self.finished = False
+
+    def __len__(self) -> int:
+        return len(self.movie_ids)
+
+    def add(
+        self,
+        movie_id: int,
+        title: Optional[str],
+        original_title: Optional[str],
+        year: Optional[int],
+        rating: Optional[float],
+    ) -> None:
+        trigrams = title_trigrams(title) | title_trigrams(original_title)
+        if not trigrams:
+            return
+        docno = len(self.movie_ids)
+        self.movie_ids.append(movie_id)
+        self.lengths.append(min(len(trigrams), 0xFFFF))
+        self.years.append(year or 0)
+        self.ratings.append(rating if rating is not None else -1.0)
+        postings = self.postings
+        for trigram in trigrams:
+            docs = postings.get(trigram)
+            if docs is None:
+                postings[trigram] = docs = array("I")
+            docs.append(docno)
+
+    def add_rows(self, rows: Iterable[Sequence]) -> None:
+        for row in rows:
+            self.add(*row)
+
+    def finish(self) -> None:
+        """Перенумеровывает документы в порядке предпочтения при равенстве."""
+        lengths, ratings, years = self.lengths, self.ratings, self.years
+        order = sorted(
+            range(len(self.movie_ids)),
+            key=lambda docno: (lengths[docno], -ratings[docno], -years[docno]),
+        )
+        renumbered = array("I", bytes(4 * len(order)))
+        for new_docno, docno in enumerate(order):
+            renumbered[docno] = new_docno
+        for trigram, docs in self.postings.items():
+            self.postings[trigram] = array("I", sorted(map(renumbered.__getitem__, docs)))
+        self.movie_ids = array("I", map(self.movie_ids.__getitem__, order))
+        self.lengths = array("H", map(lengths.__getitem__, order))
+        self.years = array("h", map(years.__getitem__, order))
+        self.ratings = array("f", map(ratings.__getitem__, order))
+        self.common_limit = max(COMMON_MIN_DOCS, int(COMMON_FRACTION * len(order)))
+        self.finished = True
+
+    def search(
+        self,
+        text: str,
+        limit: int,
+        min_score: float = TITLE_INDEX_MIN_SCORE,
+        year: Optional[int] = None,
+        min_rating: Optional[int] = None,
+    ) -> List[int]:
+        """
+        id фильмов, лучше всего совпадающих с запросом (не больше limit).
+
+        Порядок: число найденных триграмм запроса, затем похожесть всего
+        названия, рейтинг и год.
+        """
+        query = title_trigrams(text)
+        if not query or limit <= 0 or not self.finished:
+            return []
+        lists = sorted((self.postings.get(t, _EMPTY) for t in query), key=len)
+        total = len(lists)
+        required = max(1, math.ceil(min_score * total))
+
+        eligible = None
+        if year or min_rating:
+            years, ratings = self.years, self.ratings
+
+            def eligible(docno: int) -> bool:
+                return (not year or years[docno] == year) and (
+                    not min_rating or ratings[docno] >= min_rating
+                )
+
+        rare = [docs for docs in lists if len(docs) <= self.common_limit]
+        if not rare:
+            candidates = self._walk(lists, limit, required, eligible)
+            return [self.movie_ids[docno] for docno, _ in self._top(candidates, limit, required)]
+
+        common = lists[len(rare) :]
+        counts: Dict[int, int] = Counter()
+        for docs in rare:
+            counts.update(docs)
+        if eligible is not None:
+            counts = {d: c for d, c in counts.items() if eligible(d)}
+        candidates = Counter(
+            dict(self._top(counts, limit * CANDIDATES_PER_RESULT, required - len(common)))
+        )
+        self._count_hits(candidates, common)
+        best = self._top(candidates, limit, required)
+        if common and len(best) == limit:
+            # Документ вне первой выборки наберет не больше len(common)
+            # совпадений сверх счета по редким спискам: досчитываются те,
+            # кто еще может догнать худший из лучших
+            floor = best[-1][1] - len(common)
+            rest = {d: c for d, c in counts.items() if c >= floor and d not in candidates}
+            if rest:
+                rest = Counter(dict(self._top(rest, REFINE_BUDGET, floor)))
+                self._count_hits(rest, common)
+                candidates.update(rest)
+                best = self._top(candidates, limit, required)
+        if len(common) >= required and (len(best) < limit or best[-1][1] < len(common)):
+            # Опечатка дает триграммы, которых нет в нужном названии: документы
+            # только с частыми триграммами могут оказаться лучше найденных
+            for docno, count in self._walk(common, limit, required, eligible).items():
+                if docno not in candidates:
+                    candidates[docno] = count + counts.get(docno, 0)
+            best = self._top(candidates, limit, required)
+        return [self.movie_ids[docno] for docno, _ in best]
+
+    @staticmethod
+    def _top(
+        counts: Dict[int, int], limit: int, minimum: int
+    ) -> List[Tuple[int, int]]:
+        """
+        Не больше limit пар (номер, совпадения) с наибольшим числом
+        совпадений (не меньше minimum), при равенстве - с меньшим номером.
+        """
+        # Число совпадений у limit-го лучшего документа по гистограмме (на C)
+        threshold = minimum
+        seen = 0
+        for count, docs in sorted(Counter(counts.values()).items(), reverse=True):
+            seen += docs
+            if seen >= limit:
+                threshold = max(minimum, count)
+                break
+        best = [(docno, count) for docno, count in counts.items() if count > threshold]
+        best.sort(key=lambda item: (-item[1], item[0]))
+        boundary = [docno for docno, count in counts.items() if count == threshold]
+        best += [(docno, threshold) for docno in heapq.nsmallest(limit - len(best), boundary)]
+        return best
+
+    @staticmethod
+    def _walk(
+        lists: List[array],
+        limit: int,
+        required: int,
+        eligible: Optional[Callable[[int], bool]],
+    ) -> Dict[int, int]:
+        """
+        Подсчет по частым спискам в порядке номеров, то есть от лучших
+        документов: списки считаются по отрезкам номеров, отрезок растет
+        вдвое. Подсчет заканчивается, когда найдено limit полных
+        совпадений (их уже никто не превзойдет) или просмотрено
+        WALK_BUDGET номеров.
+        """
+        total = len(lists)
+        last = max(docs[-1] for docs in lists if docs)
+        counts: Dict[int, int] = Counter()
+        low, high, seen = 0, WALK_START, 0
+        while True:
+            for docs in lists:
+                segment = docs[bisect_left(docs, low) : bisect_left(docs, high)]
+                seen += len(segment)
+                counts.update(segment)
+            found = {
+                docno: count
+                for docno, count in counts.items()
+                if count >= required and (eligible is None or eligible(docno))
+            }
+            complete = sum(1 for count in found.values() if count == total)
+            if complete >= limit or seen >= WALK_BUDGET or high > last:
+                return found
+            low, high = high, high * 2
+
+    @staticmethod
+    def _count_hits(counts: Counter, lists: List[array]) -> None:
+        """Добавляет к счетчикам кандидатов совпадения в остальных списках."""
+        for docs in lists:
+            if not counts:
+                return
+            if len(docs) > BISECT_RATIO * len(counts):
+                size = len(docs)
+                hits = []
+                for docno in counts:
+                    i = bisect_left(docs, docno)
+                    if i < size and docs[i] == docno:
+                        hits.append(docno)
+            else:
+                hits = counts.keys() & docs
+            counts.update(hits)
+
+    def memory_bytes(self) -> int:
+        """Приблизительный объем памяти индекса в байтах."""
+        size = sys.getsizeof(self.postings)
+        for trigram, docs in self.postings.items():
+            size += sys.getsizeof(trigram) + sys.getsizeof(docs)
+        for column in (self.movie_ids, self.lengths, self.years, self.ratings):
+            size += sys.getsizeof(column)
+        return size
+
+
+class TitleIndex(GenerationBoundIndex):
+    """
+    Индекс триграмм названий в памяти воркера для /search.
+
+    Строится при старте и перестраивается в фоне при смене поколения
+    каталога; до готовности и пока индекс не догнал текущее поколение
+    search возвращает None, и поиск идет в PostgreSQL.
+    """
+
+    name = "title index"
+
+    def __init__(
+        self,
+        min_score: float = TITLE_INDEX_MIN_SCORE,
+        batch_size: int = TITLE_LOAD_BATCH_SIZE,
+    ):
+        super().__init__()
+        self.min_score = min_score
+        self.batch_size = batch_size
+        self._data: Optional[TitleTrigrams] = None
+
+    async def search(
+        self,
+        text: str,
+        limit: int,
+        year: Optional[int] = None,
+        min_rating: Optional[int] = None,
+    ) -> Optional[List[int]]:
+        """
+        id лучших совпадений по названию или None - индекс не готов или не
+        может ответить (короткий запрос, найдено меньше limit фильмов).
+
+        Поиск идет в пуле потоков: данные индекса после построения не
+        меняются, а перестроение подменяет их целиком.
+        """
+        if not self.loaded or len(normalize_title(text)) < TITLE_INDEX_MIN_QUERY_LENGTH:
+            return None
+        movie_ids = await asyncio.to_thread(
+            self._data.search, text, limit, self.min_score, year=year, min_rating=min_rating
+        )
+        # Неполный ответ индекса не значит, что подходящих фильмов нет
+        if len(movie_ids) < limit:
+            return None
+        return movie_ids
+
+    async def _load(self) -> None:
+        """Строит индекс по всем фильмам и атомарно подменяет текущий."""
+        data = TitleTrigrams()
+        async with AsyncSessionFactory() as session:
+            result = await session.stream(
+                select(
+                    Movie.id, Movie.title, Movie.original_title, Movie.year, Movie.rating
+                ).execution_options(yield_per=self.batch_size)
+            )
+            # Разбор названий нагружает процессор: он идет в отдельном потоке,
+            # чтобы построение большого индекса не задерживало запросы
+            async for rows in result.partitions():
+                await asyncio.to_thread(data.add_rows, rows)
+        await asyncio.to_thread(data.finish)
+
+        self._data = data
+        logger.info(
+            f"Title index loaded: {len(data)} movies, {len(data.postings)} trigrams, "
+            f"~{data.memory_bytes() // (1024 * 1024)} MiB"
+        )
+
+
+# Индекс выключен по умолчанию (результаты приблизительные, см. выше);
+# TITLE_INDEX_ENABLED=1 включает его для /search
+TITLE_INDEX_ENABLED = os.getenv("TITLE_INDEX_ENABLED", "0") == "1"
+
+title_index = TitleIndex(
+    min_score=float(os.getenv("TITLE_INDEX_MIN_SCORE", str(TITLE_INDEX_MIN_SCORE))),
+    batch_size=int(os.getenv("TITLE_INDEX_BATCH_SIZE", str(TITLE_LOAD_BATCH_SIZE))),
+)
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from redis import asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+# Канал Redis, через который воркеры сообщают друг другу об изменении пользователей
+USER_CACHE_CHANNEL = "user_cache:invalidate"
+# Специальное сообщение для полной очистки кэша во всех воркерах
+INVALIDATE_ALL = "*"
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Минимальный снимок пользователя, достаточный для авторизации запроса."""
+
+    id: int
+    username: str
+    daily_request_limit: Optional[int]
+    is_active: bool
+
+    @classmethod
+    def from_model(cls, user) -> "CachedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            daily_request_limit=user.daily_request_limit,
+            is_active=bool(user.is_active) if user.is_active is not None else True,
+        )
+
+
+class UserCache:
+    """
+    Ограниченный по размеру LRU-кэш пользователей по API ключу с TTL.
+
+    Кэш живет внутри каждого воркера. Согласованность между воркерами
+    обеспечивается через Redis pub/sub: при изменении пользователя
+    публикуется его API ключ, и все воркеры удаляют запись у себя.
+    """
+
+    def __init__(
+        self,
+        redis_client: aioredis.Redis,
+        max_size: int = 10000,
+        ttl: int = 300,
+        negative_ttl: int = 30,
+        channel: str = USER_CACHE_CHANNEL,
+    ):
+        self.redis = redis_client
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.channel = channel
+        # None вместо пользователя - ключа нет в БД (отрицательная запись)
+        self._entries: "OrderedDict[str, Tuple[float, Optional[CachedUser]]]" = OrderedDict()
+        self._listener_task: Optional[asyncio.Task] = None
+
+    def lookup(self, api_key: str) -> Tuple[bool, Optional[CachedUser]]:
+        """
+        Ищет ключ в кэше: (найден, пользователь).
+
+        (True, None) - ключ недавно не нашелся в БД, (False, None) - записи
+        нет или она устарела.
+        """
+        entry = self._entries.get(api_key)
+        if entry is None:
+            return False, None
+
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(api_key, None)
+            return False, None
+
+        self._entries.move_to_end(api_key)
+        return True, user
+
+    def get(self, api_key: str) -> Optional[CachedUser]:
+        """Возвращает пользователя из кэша или None, если записи нет или она устарела."""
+        return self.lookup(api_key)[1]
+
+    def put(self, api_key: str, user: CachedUser) -> None:
+        """Сохраняет пользователя в кэш, вытесняя самые старые записи."""
+        self._store(api_key, user, self.ttl)
+
+    def put_unknown(self, api_key: str) -> None:
+        """
+        Запоминает, что ключа нет в БД, на короткий negative_ttl.
+
+        Повторные запросы с неверным ключом не открывают сессию БД. Новый
+        ключ при создании пользователя инвалидируется, так что TTL лишь
+        ограничивает устаревание при потере сообщения pub/sub.
+        """
+        self._store(api_key, None, self.negative_ttl)
+
+    def _store(self, api_key: str, user: Optional[CachedUser], ttl: int) -> None:
+        self._entries[api_key] = (time.monotonic() + ttl, user)
+        self._entries.move_to_end(api_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate_local(self, api_key: str) -> None:
+        """Удаляет запись только в текущем воркере."""
+        if api_key == INVALIDATE_ALL:
+            self._entries.clear()
+        else:
+            self._entries.pop(api_key, None)
+
+    async def invalidate(self, api_key: str) -> None:
+        """Удаляет запись во всех воркерах (локально и через Redis pub/sub)."""
+        self.invalidate_local(api_key)
+        try:
+            await self.redis.publish(self.channel, api_key)
+        except aioredis.RedisError as e:
+            logger.error(f"Failed to publish user cache invalidation: {e}")
+
+    async def _listen(self) -> None:
+        """Слушает канал инвалидации и переподключается при ошибках Redis."""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # После (пере)подключения часть сообщений могла быть потеряна
+                self._entries.clear()
+                logger.info(f"Subscribed to user cache channel '{self.channel}'")
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=1.0
+                    )
+                    if message is None:
+                        continue
+                    data = message.get("data")
+                    if isinstance(data, bytes):
+                        data = data.decode("utf-8")
+                    if data:
+                        self.invalidate_local(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"User cache listener error: {e}. Reconnecting...")
+                # Без подписки мы не узнаем об изменениях — сбрасываем кэш
+                self._entries.clear()
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+
+    async def start(self) -> None:
+        """Запускает фоновую подписку на канал инвалидации."""
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        """Останавливает подписку и очищает кэш."""
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        self._entries.clear()
+
+
+# Создаем экземпляр для использования в других модулях
+redis_pool_user_cache = aioredis.ConnectionPool.from_url(
+    os.getenv("REDIS_URL", "redis://redis:6379/0"), decode_responses=True
+)
+user_cache = UserCache(
+    aioredis.Redis.from_pool(redis_pool_user_cache),
+    max_size=int(os.getenv("USER_CACHE_MAX_SIZE", "10000")),
+    ttl=int(os.getenv("USER_CACHE_TTL", "300")),
+    negative_ttl=int(os.getenv("USER_CACHE_NEGATIVE_TTL", "30")),
+)
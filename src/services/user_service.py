@@ -12,6 +12,7 @@ from typing import Union
 from ..db.models import User
 from ..db.schemas import UserCreate
 from ..db.db import get_db
+from .user_cache import user_cache
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -208,6 +209,9 @@ class UserService:
             await db.refresh(db_user)
             logger.info("Refresh завершен.")
 
+            # Сообщаем всем воркерам, что данные по этому ключу изменились
+            await UserService.invalidate_cached_user(db_user.api_key)
+
             # --- Отправка email после успешного создания пользователя ---
             try:
                 logger.info(f"Attempting to send API key email to {db_user.email}...")
@@ -244,6 +248,16 @@ class UserService:
             logger.info("Rollback complete.")
             raise  # Передаем исключение дальше, чтобы routes.py вернул 500
 
+    @staticmethod
+    async def invalidate_cached_user(api_key: str) -> None:
+        """
+        Сбрасывает закэшированного пользователя во всех воркерах.
+
+        Вызывается после любого изменения пользователя (создание, смена лимита,
+        блокировка, перевыпуск ключа), чтобы APIMiddleware перечитал его из БД.
+        """
+        await user_cache.invalidate(api_key)
+
     @staticmethod
     def verify_password(stored_password: str, provided_password: str) -> bool:
         return pwd_context.verify(provided_password, stored_password)
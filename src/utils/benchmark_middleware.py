@@ -0,0 +1,177 @@
+"""
+Бенчмарк накладных расходов middleware на один запрос.
+
+Сравнивает прежнюю связку из трех BaseHTTPMiddleware (APIMiddleware,
+RequestCounterMiddleware, RateLimitMiddleware) с единым ASGI APIMiddleware.
+Redis и БД заменены заглушками с настраиваемой задержкой, чтобы измерялись
+только накладные расходы самих middleware и число обращений к лимитеру.
+
+Запуск из корня проекта (внутри контейнера api):
+    python -m src.utils.benchmark_middleware --requests 5000 --redis-latency-ms 0.2
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from ..api.middleware import APIMiddleware
+from ..services.user_cache import user_cache, CachedUser
+
+API_KEY = "benchmark-key"
+
+
+class StubLimiter:
+    """Заглушка RateLimiter: имитирует один round trip в Redis на вызов."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def check_and_update_limit(self, identifier, limit_override=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return True, 999, 1000, int(time.time()) + 86400
+
+
+class StubCounter:
+    def __init__(self):
+        self.count = 0
+
+    def increment_request_count(self):
+        self.count += 1
+        return self.count
+
+    def record_active_key(self, api_key):
+        pass
+
+
+# --- Прежняя связка middleware (воспроизводит логику до объединения) ---
+class LegacyAPIMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, limiter):
+        super().__init__(app)
+        self.limiter = limiter
+
+    async def dispatch(self, request, call_next):
+        api_key = request.headers.get("x-api-key")
+        user = user_cache.get(api_key)
+        can_proceed, remaining, total_limit, reset_time = (
+            await self.limiter.check_and_update_limit(
+                api_key, user.daily_request_limit
+            )
+        )
+        request.state.user = user
+        request.state.api_key = api_key
+        response = await call_next(request)
+        response.headers["X-RateLimit-Remaining"] = str(remaining)
+        response.headers["X-RateLimit-Limit"] = str(total_limit)
+        response.headers["X-RateLimit-Reset"] = str(reset_time)
+        response.headers["X-RateLimit-Reset-Human"] = datetime.fromtimestamp(
+            reset_time
+        ).strftime("%Y-%m-%d %H:%M:%S UTC")
+        return response
+
+
+class LegacyRequestCounterMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, counter):
+        super().__init__(app)
+        self.counter = counter
+
+    async def dispatch(self, request, call_next):
+        current_count = self.counter.increment_request_count()
+        response = await call_next(request)
+        response.headers["X-Request-Count"] = str(current_count)
+        return response
+
+
+class LegacyRateLimitMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, limiter):
+        super().__init__(app)
+        self.limiter = limiter
+
+    async def dispatch(self, request, call_next):
+        api_key = request.headers.get("x-api-key")
+        can_proceed, remaining, total_limit, reset_time = (
+            await self.limiter.check_and_update_limit(
+                identifier=api_key, limit_override=1000
+            )
+        )
+        response = await call_next(request)
+        response.headers["X-RateLimit-Limit"] = str(total_limit)
+        response.headers["X-RateLimit-Remaining"] = str(remaining)
+        response.headers["X-RateLimit-Reset"] = str(reset_time)
+        return response
+
+
+def build_app(mode: str, limiter: StubLimiter, counter: StubCounter) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/ping")
+    async def ping():
+        return JSONResponse(content={"ok": True})
+
+    if mode == "legacy":
+        app.add_middleware(LegacyAPIMiddleware, limiter=limiter)
+        app.add_middleware(LegacyRequestCounterMiddleware, counter=counter)
+        app.add_middleware(LegacyRateLimitMiddleware, limiter=limiter)
+    else:
+        app.add_middleware(APIMiddleware, limiter=limiter, counter=counter)
+    return app
+
+
+async def run(mode: str, requests: int, latency: float) -> None:
+    limiter = StubLimiter(latency)
+    counter = StubCounter()
+    app = build_app(mode, limiter, counter)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        headers = {"X-API-Key": API_KEY}
+        # Прогрев
+        for _ in range(100):
+            await client.get("/api/ping", headers=headers)
+        limiter.calls = 0
+
+        timings = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = await client.get("/api/ping", headers=headers)
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 200
+
+    timings.sort()
+    p50 = statistics.median(timings) * 1e6
+    p99 = timings[int(len(timings) * 0.99) - 1] * 1e6
+    print(
+        f"{mode:>7}: mean={statistics.mean(timings) * 1e6:8.1f}us "
+        f"p50={p50:8.1f}us p99={p99:8.1f}us "
+        f"limiter_calls/request={limiter.calls / requests:.2f}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--redis-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    user_cache.put(
+        API_KEY,
+        CachedUser(id=1, username="bench", daily_request_limit=1000, is_active=True),
+    )
+    latency = args.redis_latency_ms / 1000
+    for mode in ("legacy", "asgi"):
+        await run(mode, args.requests, latency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
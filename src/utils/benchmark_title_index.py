@@ -0,0 +1,129 @@
+"""
+Бенчмарк индекса триграмм названий (src/services/title_index.py).
+
+На синтетическом каталоге (названия из русских и латинских псевдослов)
+измеряет время построения, объем памяти индекса и задержку поиска
+(p50/p99) для запросов с опечатками и недописанных запросов. БД и Redis
+не нужны.
+
+Запуск из корня проекта (внутри контейнера api):
+    python -m src.utils.benchmark_title_index --titles 100000 1000000 --queries 2000
+"""
+
+import argparse
+import gc
+import itertools
+import random
+import statistics
+import time
+
+import psutil
+
+from ..services.title_index import TitleTrigrams, TITLE_INDEX_MIN_SCORE
+
+CYRILLIC_CONSONANTS = "бвгджзклмнпрстфхцчшщ"
+CYRILLIC_VOWELS = "аеиоуыэюя"
+LATIN_CONSONANTS = "bcdfghjklmnpqrstvwxz"
+LATIN_VOWELS = "aeiouy"
+
+
+def make_words(rng: random.Random, consonants: str, vowels: str, count: int):
+    """Псевдослова из слогов согласная + гласная (+ согласная)."""
+    words = []
+    for _ in range(count):
+        syllables = []
+        for _ in range(rng.randint(1, 4)):
+            syllable = rng.choice(consonants) + rng.choice(vowels)
+            if rng.random() < 0.3:
+                syllable += rng.choice(consonants)
+            syllables.append(syllable)
+        words.append("".join(syllables))
+    return words
+
+
+def make_catalog(rng: random.Random, size: int, vocabulary: int):
+    """
+    Строки (id, title, original_title, year, rating) синтетического каталога.
+
+    Частоты слов распределены по закону Ципфа, как в настоящих названиях.
+    """
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, vocabulary + 1)))
+    russian = make_words(rng, CYRILLIC_CONSONANTS, CYRILLIC_VOWELS, vocabulary)
+    latin = make_words(rng, LATIN_CONSONANTS, LATIN_VOWELS, vocabulary)
+    for movie_id in range(1, size + 1):
+        words = rng.randint(1, 4)
+        title = " ".join(rng.choices(russian, cum_weights=cum_weights, k=words)).capitalize()
+        original = " ".join(rng.choices(latin, cum_weights=cum_weights, k=words)).title()
+        yield movie_id, title, original, rng.randint(1950, 2025), rng.randint(1, 10)
+
+
+def make_query(rng: random.Random, title: str) -> str:
+    """Запрос из названия: опечатка, пропуск буквы или недописанное слово."""
+    kind = rng.random()
+    if kind < 0.4 and len(title) > 3:
+        i = rng.randrange(1, len(title) - 2)
+        return title[:i] + title[i + 1] + title[i] + title[i + 2 :]
+    if kind < 0.7 and len(title) > 3:
+        i = rng.randrange(1, len(title) - 1)
+        return title[:i] + title[i + 1 :]
+    return title[: max(3, len(title) * 2 // 3)]
+
+
+def run(size: int, queries: int, limit: int, seed: int) -> None:
+    rng = random.Random(seed)
+    catalog = list(make_catalog(rng, size, vocabulary=max(10000, size // 10)))
+
+    gc.collect()
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    started = time.perf_counter()
+    data = TitleTrigrams()
+    data.add_rows(catalog)
+    data.finish()
+    build_time = time.perf_counter() - started
+    gc.collect()
+    rss_delta = process.memory_info().rss - rss_before
+
+    # Запрос строится из названия известного фильма: доля запросов, для
+    # которых этот фильм попал в ответ, показывает качество поиска
+    samples = []
+    for _ in range(queries):
+        row = rng.choice(catalog)
+        samples.append((row[0], make_query(rng, row[rng.randint(1, 2)])))
+    for _, text in samples[:50]:
+        data.search(text, limit, TITLE_INDEX_MIN_SCORE)
+
+    timings = []
+    found = 0
+    for movie_id, text in samples:
+        started = time.perf_counter()
+        result = data.search(text, limit, TITLE_INDEX_MIN_SCORE)
+        timings.append(time.perf_counter() - started)
+        found += movie_id in result
+
+    timings.sort()
+    print(
+        f"{size:>9} titles: build={build_time:6.1f}s "
+        f"index~{data.memory_bytes() / 2**20:7.1f}MiB rss+{rss_delta / 2**20:7.1f}MiB "
+        f"trigrams={len(data.postings)} | "
+        f"query mean={statistics.mean(timings) * 1e3:6.2f}ms "
+        f"p50={statistics.median(timings) * 1e3:6.2f}ms "
+        f"p99={timings[int(len(timings) * 0.99) - 1] * 1e3:6.2f}ms "
+        f"hit@{limit}={found / queries:.0%}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--titles", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for size in args.titles:
+        run(size, args.queries, args.limit, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,176 +1,1033 @@
-import json
-import functools
-import inspect
-from typing import Callable, Any
-from redis import asyncio as aioredis
-import os
-import logging
-
-logger = logging.getLogger(__name__)
-
-# Используем тот же URL Redis, что и в main.py (для rate limiter, DB 0)
-# Лучше всего вынести URL в переменные окружения
-REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
-# Используем try-except на случай, если Redis недоступен при импорте (например, при сборке)
-try:
-    redis_pool_cache = aioredis.ConnectionPool.from_url(
-        REDIS_URL, decode_responses=False
-    )  # False, т.к. будем хранить JSON (байты)
-    redis_client_cache = aioredis.Redis.from_pool(redis_pool_cache)
-    # Пробный пинг для проверки доступности при старте
-    # asyncio.run(redis_client_cache.ping()) # Нельзя использовать asyncio.run на верхнем уровне модуля
-    logger.info(f"Successfully connected to Redis cache at {REDIS_URL}")
-except Exception as e:
-    logger.error(f"Failed to connect to Redis cache at {REDIS_URL}: {e}")
-    # Устанавливаем в None, чтобы декоратор мог проверить и пропустить кэширование
-    redis_pool_cache = None
-    redis_client_cache = None
-
-
-# Время жизни кэша по умолчанию (в секундах)
-DEFAULT_CACHE_TTL = 300  # 5 минут
-
-
-def generate_cache_key(func: Callable, *args: Any, **kwargs: Any) -> str:
-    """Генерирует ключ кэша на основе имени функции и её аргументов."""
-    # Получаем информацию об аргументах функции
-    sig = inspect.signature(func)
-    bound_args = sig.bind(*args, **kwargs)
-    bound_args.apply_defaults()
-
-    # Убираем зависимости FastAPI (вроде db: AsyncSession) из ключа
-    args_dict = {
-        name: value
-        for name, value in bound_args.arguments.items()
-        # Проверяем, есть ли у аргумента аннотация и не является ли она зависимостью (грубая проверка)
-        # Исключаем стандартные зависимости и Redis клиент
-        if name not in ("db", "request", "background_tasks", "db_session", "api_key")
-        and not isinstance(value, (aioredis.Redis))
-    }
-
-    # Создаем стабильное представление аргументов
-    try:
-        key_part = json.dumps(
-            args_dict, sort_keys=True, default=str
-        )  # default=str для несериализуемых объектов
-    except TypeError as e:
-        logger.warning(
-            f"Could not serialize arguments for cache key generation in {func.__name__}: {e}. Args: {args_dict}"
-        )
-        # Используем пустой словарь, если сериализация не удалась
-        key_part = json.dumps({}, sort_keys=True)
-
-    # Префикс ключа - имя модуля и функции
-    key_prefix = f"cache:{func.__module__}:{func.__name__}"
-
-    return f"{key_prefix}:{key_part}"
-
-
-def cache(ttl: int = DEFAULT_CACHE_TTL) -> Callable:
-    """
-    Декоратор для кэширования результатов асинхронных функций в Redis.
-
-    Args:
-        ttl: Время жизни кэша в секундах.
-    """
-
-    def decorator(func: Callable) -> Callable:
-        @functools.wraps(func)
-        async def wrapper(*args: Any, **kwargs: Any) -> Any:
-            # Проверяем, инициализирован ли клиент Redis
-            if redis_client_cache is None:
-                logger.warning(
-                    f"Redis client not available, skipping cache for {func.__name__}"
-                )
-                return await func(*args, **kwargs)
-
-            key = generate_cache_key(func, *args, **kwargs)
-            logger.debug(f"Generated cache key: {key}")
-
-            try:
-                # Проверяем наличие в кэше
-                cached_data = await redis_client_cache.get(key)
-                if cached_data:
-                    logger.info(f"Cache HIT for key: {key}")
-                    # Десериализуем из JSON (храним как байты)
-                    try:
-                        return json.loads(cached_data.decode("utf-8"))
-                    except json.JSONDecodeError as decode_err:
-                        logger.error(
-                            f"Failed to decode cached JSON for key {key}: {decode_err}. Data: {cached_data[:100]}..."
-                        )
-                        # Если данные в кэше повреждены, удаляем их и выполняем функцию
-                        await redis_client_cache.delete(key)
-                        logger.warning(f"Deleted corrupted cache entry for key: {key}")
-
-                else:
-                    logger.info(f"Cache MISS for key: {key}")
-
-            except aioredis.RedisError as e:
-                logger.error(f"Redis GET error for key {key}: {e}")
-                # При ошибке чтения из кэша выполняем функцию, чтобы не сломать приложение
-                return await func(*args, **kwargs)
-            except Exception as e:  # Ловим другие возможные ошибки
-                logger.error(f"Unexpected error during cache GET for key {key}: {e}")
-                return await func(*args, **kwargs)
-
-            # Если в кэше нет или он был поврежден, выполняем функцию
-            result = await func(*args, **kwargs)
-
-            try:
-                # Сериализуем в JSON и сохраняем в кэш
-                data_to_cache = result
-                # Проверяем, является ли результат FastAPI Response
-                if (
-                    hasattr(result, "body")
-                    and hasattr(result, "media_type")
-                    and isinstance(getattr(result, "media_type", None), str)
-                    and "json" in result.media_type
-                ):
-                    # Попытка декодировать тело JSONResponse
-                    try:
-                        data_to_cache = json.loads(result.body.decode("utf-8"))
-                    except Exception as decode_err:
-                        logger.error(
-                            f"Failed to decode JSONResponse body for caching key {key}: {decode_err}"
-                        )
-                        # Не кэшируем, если не смогли декодировать, просто возвращаем результат
-                        return result
-                elif hasattr(
-                    result, "body"
-                ):  # Если это другой тип Response, не кэшируем его тело
-                    logger.warning(
-                        f"Result for key {key} is a non-JSON Response, not caching."
-                    )
-                    return result
-
-                # Сериализуем результат (или извлеченные данные) в JSON строку (байты)
-                try:
-                    serialized_result = json.dumps(data_to_cache).encode("utf-8")
-                except TypeError as e:
-                    logger.error(
-                        f"Failed to serialize result to JSON for key {key}: {e}. Data: {data_to_cache}"
-                    )
-                    return result  # Возвращаем результат, если не можем сериализовать
-
-                await redis_client_cache.setex(key, ttl, serialized_result)
-                logger.info(f"Cached result for key: {key} with TTL: {ttl}s")
-
-            except aioredis.RedisError as e:
-                logger.error(f"Redis SETEX error for key {key}: {e}")
-                # Возвращаем результат даже если не удалось сохранить в кэш
-            except Exception as e:  # Ловим другие возможные ошибки
-                logger.error(f"Unexpected error during cache SETEX for key {key}: {e}")
-
-            return result  # Возвращаем оригинальный результат
-
-        return wrapper
-
-    return decorator
-
-
-async def close_cache_connection():
-    """Закрывает пул соединений Redis для кэша."""
-    if redis_pool_cache:
-        await redis_pool_cache.disconnect()
-        logger.info("Redis cache connection pool closed.")
+import asyncio
+import bisect
+import json
+import functools
+import hashlib
+import inspect
+import secrets
+import struct
+import time
+import typing
+import zlib
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+from typing import Callable, Any, Dict, List, Optional, Set, Tuple
+from redis import asyncio as aioredis
+from fastapi import BackgroundTasks, Request, params
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import Response
+from ..db.db import AsyncSessionFactory
+from .catalog_generation import catalog_generation
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен, без него сжимаем zlib
+    zstandard = None
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Используем тот же URL Redis, что и в main.py (для rate limiter, DB 0)
+# Лучше всего вынести URL в переменные окружения
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+# Используем try-except на случай, если Redis недоступен при импорте (например, при сборке)
+try:
+    redis_pool_cache = aioredis.ConnectionPool.from_url(
+        REDIS_URL, decode_responses=False
+    )  # False, т.к. будем хранить JSON (байты)
+    redis_client_cache = aioredis.Redis.from_pool(redis_pool_cache)
+    # Пробный пинг для проверки доступности при старте
+    # asyncio.run(redis_client_cache.ping()) # Нельзя использовать asyncio.run на верхнем уровне модуля
+    logger.info(f"Successfully connected to Redis cache at {REDIS_URL}")
+except Exception as e:
+    logger.error(f"Failed to connect to Redis cache at {REDIS_URL}: {e}")
+    # Устанавливаем в None, чтобы декоратор мог проверить и пропустить кэширование
+    redis_pool_cache = None
+    redis_client_cache = None
+
+
+# Время жизни кэша по умолчанию (в секундах)
+DEFAULT_CACHE_TTL = 300  # 5 минут
+
+# Лимиты L1 кэша в памяти процесса
+CACHE_L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "1024"))
+CACHE_L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", str(64 * 1024 * 1024)))
+# L1 не получает инвалидаций от других воркеров, поэтому живет недолго
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", "30"))
+
+# Межпроцессная блокировка пересчета (по умолчанию выключена)
+CACHE_CLUSTER_LOCK = os.getenv("CACHE_CLUSTER_LOCK", "0") == "1"
+CACHE_LOCK_TIMEOUT = float(os.getenv("CACHE_LOCK_TIMEOUT", "10"))
+# Как часто ожидающий воркер проверяет, не появилось ли значение в Redis
+CACHE_LOCK_POLL_INTERVAL = 0.05
+
+# Формат значения в кэше: 1 байт вида + момент устаревания (unix time, double)
+# + хэш содержимого (hex) + тело
+KIND_RESPONSE = b"R"  # закодированное тело JSON ответа, отдается как есть
+KIND_DATA = b"D"  # JSON данных, возвращенных функцией
+FRESH_UNTIL_FORMAT = struct.Struct(">d")
+ETAG_LENGTH = 32
+HEADER_LENGTH = 1 + FRESH_UNTIL_FORMAT.size + ETAG_LENGTH
+
+# Значения в Redis не меньше этого размера сжимаются
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL", "3"))
+# Маркер сжатого значения в Redis; несжатые начинаются с байта вида (R/D),
+# поэтому записи, сохраненные без сжатия, читаются как раньше
+COMPRESSION_ZLIB = b"Z"
+COMPRESSION_ZSTD = b"S"
+
+if zstandard is not None:
+    _zstd_compressor = zstandard.ZstdCompressor(level=CACHE_COMPRESS_LEVEL)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+
+# Снимает блокировку, только если она все еще принадлежит нам
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LocalCache:
+    """
+    L1 кэш: LRU в памяти процесса перед Redis.
+
+    Хранит уже сериализованные значения (байты), поэтому объем легко учесть.
+    Ограничен и по числу записей, и по суммарному размеру; при превышении
+    вытесняются самые давно использованные записи. Срок жизни записи
+    не превышает max_ttl, чтобы изменения, сделанные другими воркерами,
+    становились видны быстро.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_L1_MAX_ENTRIES,
+        max_bytes: int = CACHE_L1_MAX_BYTES,
+        max_ttl: float = CACHE_L1_TTL,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        # key -> (момент истечения по time.monotonic(), значение)
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self.size_bytes = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes, ttl: float) -> None:
+        ttl = min(ttl, self.max_ttl)
+        if ttl <= 0 or self.max_entries <= 0 or len(value) > self.max_bytes:
+            return
+        self.delete(key)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self.size_bytes += len(value)
+        while self._entries and (
+            len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes
+        ):
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size_bytes -= len(evicted)
+
+    def delete(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= len(entry[1])
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+local_cache = LocalCache()
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными границами (мс), как в Prometheus."""
+
+    BUCKETS_MS = (0.25, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+
+    def observe(self, seconds: float) -> None:
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        # Накопительные значения по верхним границам (le)
+        buckets, cumulative = {}, 0
+        for bound, count in zip(self.BUCKETS_MS + (float("inf"),), self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum_ms, 3),
+            "avg_ms": round(self.sum_ms / self.count, 3) if self.count else None,
+            "buckets_le_ms": buckets,
+        }
+
+
+class FunctionCacheMetrics:
+    """Счетчики кэша одной функции (префикса ключей) в текущем воркере."""
+
+    COUNTERS = (
+        "l1_hits",  # отдано из памяти процесса
+        "l2_hits",  # отдано из Redis
+        "stale_hits",  # отдано устаревшее значение (stale-while-revalidate)
+        "misses",  # функция выполнена
+        "coalesced",  # дождались пересчета другой корутины (single-flight)
+        "refreshes",  # запущено фоновых обновлений
+        "errors",  # ошибки Redis, поврежденные записи, сбои фоновых обновлений
+        "bytes_read",  # прочитано из Redis (после сжатия)
+        "writes",
+        "compressed_writes",
+        "raw_bytes",  # записано в Redis до сжатия
+        "stored_bytes",  # фактически записано в Redis
+    )
+
+    def __init__(self):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.get_latency = LatencyHistogram()
+        self.set_latency = LatencyHistogram()
+        self.compute_latency = LatencyHistogram()
+
+    def incr(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        counters = dict(self.counters)
+        hits = counters["l1_hits"] + counters["l2_hits"]
+        lookups = hits + counters["misses"]
+        counters["hit_rate"] = round(hits / lookups, 4) if lookups else None
+        return {
+            **counters,
+            "redis_get_latency": self.get_latency.snapshot(),
+            "redis_set_latency": self.set_latency.snapshot(),
+            "compute_latency": self.compute_latency.snapshot(),
+        }
+
+
+class CacheMetrics:
+    """Метрики кэша по префиксам ключей cache:{модуль}:{функция}."""
+
+    def __init__(self):
+        self._by_prefix: Dict[str, FunctionCacheMetrics] = defaultdict(
+            FunctionCacheMetrics
+        )
+
+    def of(self, prefix: str) -> FunctionCacheMetrics:
+        return self._by_prefix[prefix]
+
+    def for_key(self, key: str) -> FunctionCacheMetrics:
+        return self._by_prefix[key_prefix_of(key)]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {prefix: metrics.snapshot() for prefix, metrics in self._by_prefix.items()}
+
+
+cache_metrics = CacheMetrics()
+
+# Пересчеты, выполняющиеся сейчас в этом процессе: key -> Future с байтами результата
+_inflight: Dict[str, "asyncio.Future[Optional[bytes]]"] = {}
+# Фоновые обновления (держим ссылки, чтобы задачи не собрал GC)
+_background_refreshes: Set["asyncio.Task[None]"] = set()
+
+# Закэшированные функции по префиксу ключей: для прогрева кэша
+cached_functions: Dict[str, Callable] = {}
+
+# Вызовы в рамках прогрева не учитываются в статистике горячих ключей
+warming_up: ContextVar[bool] = ContextVar("cache_warming_up", default=False)
+
+
+class HotKeyTracker:
+    """
+    Статистика обращений к ключам кэша для прогрева после рестарта.
+
+    Обращения считаются в памяти процесса, а раз в flush_interval секунд
+    сбрасываются в Redis одним пайплайном ZINCRBY: на каждую закэшированную
+    функцию свой sorted set с аргументами вызова (JSON) в качестве членов.
+    В наборе хранится не больше max_keys самых частых аргументов.
+    """
+
+    KEY_PREFIX = "cache_hot:"
+    # Длинные наборы аргументов в статистику не попадают
+    MAX_MEMBER_LENGTH = 1024
+
+    def __init__(
+        self,
+        flush_interval: float = 10.0,
+        max_keys: int = 1000,
+        ttl: int = 7 * 86400,
+    ):
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._pending: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def record(self, prefix: str, args_json: str) -> None:
+        if warming_up.get() or len(args_json) > self.MAX_MEMBER_LENGTH:
+            return
+        self._pending[(prefix, args_json)] += 1
+
+    async def flush(self) -> None:
+        pending, self._pending = self._pending, defaultdict(int)
+        if not pending or redis_client_cache is None:
+            return
+        try:
+            prefixes = set()
+            async with redis_client_cache.pipeline(transaction=False) as pipe:
+                for (prefix, args_json), count in pending.items():
+                    pipe.zincrby(self.KEY_PREFIX + prefix, count, args_json)
+                    prefixes.add(prefix)
+                for prefix in prefixes:
+                    key = self.KEY_PREFIX + prefix
+                    # Оставляем только самые частые аргументы
+                    pipe.zremrangebyrank(key, 0, -self.max_keys - 1)
+                    pipe.expire(key, self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to flush hot cache keys: {e}")
+
+    async def top(self, prefix: str, count: int) -> List[Dict[str, Any]]:
+        """Самые частые наборы аргументов функции (по убыванию частоты)."""
+        if redis_client_cache is None or count <= 0:
+            return []
+        members = await redis_client_cache.zrevrange(
+            self.KEY_PREFIX + prefix, 0, count - 1
+        )
+        result = []
+        for member in members:
+            try:
+                result.append(json.loads(member))
+            except ValueError:
+                continue
+        return result
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+
+hot_keys = HotKeyTracker(
+    flush_interval=float(os.getenv("CACHE_HOT_KEYS_FLUSH_INTERVAL", "10"))
+)
+
+
+# Типы аргументов, которые внедряет FastAPI или передает вызывающий код;
+# в ключ кэша они не входят
+INJECTED_TYPES = (AsyncSession, Request, BackgroundTasks, Response, aioredis.Redis)
+
+# Аргументы длиннее этого размера заменяются в ключе хэшем
+CACHE_MAX_KEY_ARGS_LENGTH = int(os.getenv("CACHE_MAX_KEY_ARGS_LENGTH", "200"))
+
+_MISSING = object()
+
+
+def normalize_text(value: Any) -> Any:
+    """Нормализация строки для ключа: без регистра и пробелов по краям."""
+    if isinstance(value, str):
+        value = value.strip().lower()
+        return value or None
+    return value
+
+
+def clamp_limit(default: int, maximum: int) -> Callable[[Any], Any]:
+    """Нормализация лимита так же, как это делает обработчик: <= 0 - default, > maximum - maximum."""
+
+    def normalize(value: Any) -> Any:
+        if not isinstance(value, int) or value <= 0:
+            return default
+        return min(value, maximum)
+
+    return normalize
+
+
+def _is_injected(parameter: inspect.Parameter) -> bool:
+    """Параметр - зависимость FastAPI (Depends/Security) или внедряемый объект."""
+    if isinstance(parameter.default, params.Depends):
+        return True
+    annotation = parameter.annotation
+    candidates = (
+        typing.get_args(annotation)
+        if typing.get_origin(annotation) is typing.Union
+        else (annotation,)
+    )
+    return any(
+        inspect.isclass(candidate) and issubclass(candidate, INJECTED_TYPES)
+        for candidate in candidates
+    )
+
+
+class CacheKeyBuilder:
+    """
+    Построитель ключей кэша для одной функции.
+
+    Сигнатура разбирается один раз при декорировании: заранее известно,
+    какие параметры входят в ключ, их порядок, значения по умолчанию и
+    нормализаторы. На вызов остается сопоставить аргументы и один json.dumps.
+    Нормализаторы применяются только к ключу: функция получает аргументы
+    вызывающего как есть. Нормализовать стоит только параметры, которые
+    не попадают в ответ как есть (лимит, который обработчик ограничивает
+    так же, фильтры подсчета), иначе закэшированный ответ повторит
+    значение первого запроса.
+    """
+
+    def __init__(
+        self,
+        func: Callable,
+        normalize: Optional[Dict[str, Callable[[Any], Any]]] = None,
+        max_args_length: int = CACHE_MAX_KEY_ARGS_LENGTH,
+    ):
+        self.prefix = f"cache:{func.__module__}:{func.__name__}"
+        self.max_args_length = max_args_length
+        self.normalize = dict(normalize or {})
+
+        parameters = list(inspect.signature(func).parameters.values())
+        unsupported = [
+            p.name
+            for p in parameters
+            if p.kind not in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)
+        ]
+        if unsupported:
+            raise TypeError(
+                f"cache() does not support *args/**kwargs/positional-only parameters: "
+                f"{func.__name__}({', '.join(unsupported)})"
+            )
+        unknown = set(self.normalize) - {p.name for p in parameters}
+        if unknown:
+            raise TypeError(f"Unknown parameters to normalize in {func.__name__}: {unknown}")
+
+        # Имена для сопоставления позиционных аргументов
+        self.positional = [
+            p.name for p in parameters if p.kind is p.POSITIONAL_OR_KEYWORD
+        ]
+        self.names = frozenset(p.name for p in parameters)
+        # (имя, значение по умолчанию) параметров, входящих в ключ, в порядке сигнатуры
+        self.key_params = [
+            (
+                p.name,
+                _MISSING if p.default is inspect.Parameter.empty else p.default,
+            )
+            for p in parameters
+            if not _is_injected(p)
+        ]
+
+    def bind(
+        self, args: tuple, kwargs: Dict[str, Any]
+    ) -> Tuple[str, str, tuple, Dict[str, Any]]:
+        """
+        Возвращает ключ, аргументы ключа в JSON (до хэширования) и аргументы
+        для вызова функции (без изменений).
+        """
+        if len(args) > len(self.positional):
+            raise TypeError(f"Too many positional arguments for {self.prefix}")
+        values = dict(zip(self.positional, args))
+        for name, value in kwargs.items():
+            if name not in self.names:
+                raise TypeError(f"Unexpected argument '{name}' for {self.prefix}")
+            if name in values:
+                raise TypeError(f"Multiple values for argument '{name}' for {self.prefix}")
+            values[name] = value
+
+        key_values = {}
+        for name, default in self.key_params:
+            value = values.get(name, default)
+            if value is _MISSING:
+                raise TypeError(f"Missing argument '{name}' for {self.prefix}")
+            normalize = self.normalize.get(name)
+            if normalize is not None:
+                value = normalize(value)
+            key_values[name] = value
+
+        args_json = key_part = json.dumps(
+            key_values, ensure_ascii=False, separators=(",", ":"), default=str
+        )
+        if len(key_part) > self.max_args_length:
+            key_part = "#" + hashlib.blake2b(
+                key_part.encode("utf-8"), digest_size=16
+            ).hexdigest()
+
+        # Поколение каталога в ключе: после импорта фильмов все ключи меняются
+        # и старые ответы не отдаются
+        key = f"{self.prefix}:g{catalog_generation.current}:{key_part}"
+        return key, args_json, args, kwargs
+
+
+def generate_cache_key(func: Callable, *args: Any, **kwargs: Any) -> str:
+    """Генерирует ключ кэша на основе имени функции и её аргументов."""
+    builder = getattr(func, "cache_key_builder", None) or CacheKeyBuilder(func)
+    return builder.bind(args, kwargs)[0]
+
+
+def key_prefix_of(key: str) -> str:
+    """Префикс ключа кэша без поколения и аргументов: cache:{модуль}:{функция}."""
+    return ":".join(key.split(":", 3)[:3])
+
+
+def _compress(payload: bytes) -> bytes:
+    """Сжимает значение для Redis, если оно достаточно велико и сжатие выгодно."""
+    if len(payload) < CACHE_COMPRESS_MIN_BYTES:
+        return payload
+    if zstandard is not None:
+        compressed = COMPRESSION_ZSTD + _zstd_compressor.compress(payload)
+    else:
+        compressed = COMPRESSION_ZLIB + zlib.compress(payload, CACHE_COMPRESS_LEVEL)
+    return compressed if len(compressed) < len(payload) else payload
+
+
+def _decompress(stored: bytes) -> bytes:
+    """Разжимает значение из Redis по маркеру; несжатые значения возвращаются как есть."""
+    marker = stored[:1]
+    try:
+        if marker == COMPRESSION_ZLIB:
+            return zlib.decompress(stored[1:])
+        if marker == COMPRESSION_ZSTD:
+            if zstandard is None:
+                raise ValueError("zstandard is not installed")
+            return _zstd_decompressor.decompress(stored[1:])
+    except Exception as e:  # zlib.error, zstandard.ZstdError
+        raise ValueError(f"Failed to decompress cache entry: {e}")
+    return stored
+
+
+def content_hash(body: bytes) -> bytes:
+    """Хэш содержимого тела ответа; используется как ETag."""
+    return hashlib.blake2b(body, digest_size=ETAG_LENGTH // 2).hexdigest().encode("ascii")
+
+
+def _pack(kind: bytes, body: bytes, fresh_until: float) -> bytes:
+    return kind + FRESH_UNTIL_FORMAT.pack(fresh_until) + content_hash(body) + body
+
+
+def _unpack(payload: bytes) -> Tuple[bytes, bytes, bytes]:
+    """Разбирает значение кэша на (вид, хэш, тело)."""
+    kind = payload[:1]
+    if kind not in (KIND_RESPONSE, KIND_DATA) or len(payload) < HEADER_LENGTH:
+        raise ValueError("Unknown cache entry format")
+    return (
+        kind,
+        payload[1 + FRESH_UNTIL_FORMAT.size : HEADER_LENGTH],
+        payload[HEADER_LENGTH:],
+    )
+
+
+def _fresh_until(payload: bytes) -> float:
+    """Момент, после которого значение считается устаревшим."""
+    if len(payload) < HEADER_LENGTH:
+        raise ValueError("Unknown cache entry format")
+    return FRESH_UNTIL_FORMAT.unpack_from(payload, 1)[0]
+
+
+def _decode_cached(key: str, payload: bytes) -> Any:
+    """
+    Восстанавливает результат из значения кэша.
+
+    Готовое тело ответа отдается как Response без разбора JSON;
+    данные обычных функций десериализуются. При повреждении запись
+    удаляется из L1, а исключение ValueError пробрасывается.
+    """
+    try:
+        kind, etag, body = _unpack(payload)
+        if kind == KIND_RESPONSE:
+            return Response(
+                content=body,
+                media_type="application/json",
+                headers={"ETag": f'"{etag.decode("ascii")}"'},
+            )
+        return json.loads(body.decode("utf-8"))
+    except ValueError as decode_err:
+        logger.error(
+            f"Failed to decode cached entry for key {key}: {decode_err}. Data: {payload[:100]}..."
+        )
+        local_cache.delete(key)
+        raise
+
+
+def _serialize_result(key: str, result: Any, fresh_until: float) -> Optional[bytes]:
+    """
+    Упаковывает результат функции для кэша.
+
+    Для JSON ответа сохраняется его уже закодированное тело, а сам ответ
+    получает заголовок ETag. Возвращает None, если результат кэшировать
+    нельзя (None, ответ не 200, не-JSON Response или несериализуемые данные).
+    """
+    # None означает «нечего кэшировать» (например, объект не найден)
+    if result is None:
+        return None
+
+    if isinstance(result, Response):
+        media_type = result.media_type or ""
+        if "json" not in media_type:
+            logger.warning(f"Result for key {key} is a non-JSON Response, not caching.")
+            return None
+        if result.status_code != 200:
+            # Ошибки не кэшируем
+            return None
+        payload = _pack(KIND_RESPONSE, bytes(result.body), fresh_until)
+        _, etag, _ = _unpack(payload)
+        result.headers["ETag"] = f'"{etag.decode("ascii")}"'
+        return payload
+
+    # Сериализуем данные в JSON (байты)
+    try:
+        body = json.dumps(result, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+    except (TypeError, ValueError) as e:
+        logger.error(f"Failed to serialize result to JSON for key {key}: {e}. Data: {result}")
+        return None
+    return _pack(KIND_DATA, body, fresh_until)
+
+
+async def _redis_get(key: str) -> Optional[bytes]:
+    """Читает значение из Redis (L2); ошибки Redis считаются промахом."""
+    if redis_client_cache is None:
+        return None
+    metrics = cache_metrics.for_key(key)
+    started = time.perf_counter()
+    try:
+        stored = await redis_client_cache.get(key)
+        metrics.get_latency.observe(time.perf_counter() - started)
+        if stored is None:
+            return None
+        metrics.incr("bytes_read", len(stored))
+        return _decompress(stored)
+    except aioredis.RedisError as e:
+        logger.error(f"Redis GET error for key {key}: {e}")
+    except ValueError as e:
+        # Запись будет перезаписана после пересчета
+        logger.error(f"Corrupted cache entry for key {key}: {e}")
+    except Exception as e:  # Ловим другие возможные ошибки
+        logger.error(f"Unexpected error during cache GET for key {key}: {e}")
+    metrics.incr("errors")
+    return None
+
+
+async def _redis_set(key: str, ttl: int, payload: bytes) -> None:
+    if redis_client_cache is None:
+        return
+    metrics = cache_metrics.for_key(key)
+    try:
+        stored = _compress(payload)
+        started = time.perf_counter()
+        await redis_client_cache.setex(key, ttl, stored)
+        metrics.set_latency.observe(time.perf_counter() - started)
+        metrics.incr("writes")
+        metrics.incr("raw_bytes", len(payload))
+        metrics.incr("stored_bytes", len(stored))
+        if len(stored) != len(payload):
+            metrics.incr("compressed_writes")
+    except aioredis.RedisError as e:
+        metrics.incr("errors")
+        logger.error(f"Redis SETEX error for key {key}: {e}")
+        # Возвращаем результат даже если не удалось сохранить в кэш
+    except Exception as e:  # Ловим другие возможные ошибки
+        metrics.incr("errors")
+        logger.error(f"Unexpected error during cache SETEX for key {key}: {e}")
+
+
+async def _acquire_cluster_lock(lock_key: str, token: str, timeout: float) -> bool:
+    """Пытается взять межпроцессную блокировку; при ошибке Redis считаем, что взяли."""
+    try:
+        return bool(
+            await redis_client_cache.set(
+                lock_key, token, nx=True, px=int(timeout * 1000)
+            )
+        )
+    except aioredis.RedisError as e:
+        logger.error(f"Redis lock error for key {lock_key}: {e}")
+        return True
+
+
+async def _release_cluster_lock(lock_key: str, token: str) -> None:
+    try:
+        await redis_client_cache.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+    except aioredis.RedisError as e:
+        logger.error(f"Redis unlock error for key {lock_key}: {e}")
+
+
+async def _wait_for_peer(key: str, timeout: float) -> Optional[bytes]:
+    """Ждет, пока другой воркер, держащий блокировку, положит значение в Redis."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(CACHE_LOCK_POLL_INTERVAL)
+        payload = await _redis_get(key)
+        if payload is not None:
+            return payload
+    return None
+
+
+def cache(
+    ttl: int = DEFAULT_CACHE_TTL,
+    cluster_lock: Optional[bool] = None,
+    lock_timeout: float = CACHE_LOCK_TIMEOUT,
+    stale_ttl: int = 0,
+    refresh_ahead: float = 0.0,
+    normalize: Optional[Dict[str, Callable[[Any], Any]]] = None,
+) -> Callable:
+    """
+    Декоратор для кэширования результатов асинхронных функций.
+
+    Двухуровневый кэш: L1 в памяти процесса (local_cache) и L2 в Redis.
+    Промах по ключу пересчитывает только одна корутина воркера, остальные
+    ждут ее результат (single-flight). С cluster_lock пересчет дополнительно
+    защищен блокировкой в Redis, и во всем кластере его выполняет один воркер.
+
+    Если функция возвращает JSONResponse, кэшируется его закодированное тело
+    вместе с хэшем: попадание отдается готовым Response с заголовком ETag
+    без повторной сериализации. Условные запросы (If-None-Match) обрабатывает
+    APIMiddleware.
+
+    Значение старше ttl, но моложе ttl + stale_ttl отдается сразу, а функция
+    пересчитывается в фоне (stale-while-revalidate). С refresh_ahead запрошенное
+    значение обновляется в фоне заранее, когда до устаревания остается меньше
+    refresh_ahead * ttl секунд. Фоновый пересчет получает собственную сессию БД.
+
+    Args:
+        ttl: Время жизни кэша в секундах.
+        cluster_lock: Включить межпроцессную блокировку пересчета
+            (None - значение из CACHE_CLUSTER_LOCK).
+        lock_timeout: Время жизни блокировки и максимальное ожидание чужого
+            пересчета в секундах.
+        stale_ttl: Сколько секунд после ttl еще можно отдавать устаревшее значение.
+        refresh_ahead: Доля ttl перед устареванием, в которую запрос запускает
+            фоновое обновление (0 - выключено).
+        normalize: Нормализаторы аргументов по имени параметра (например,
+            normalize_text, clamp_limit); применяются только к ключу.
+    """
+    use_cluster_lock = CACHE_CLUSTER_LOCK if cluster_lock is None else cluster_lock
+    # Столько значение живет в Redis с учетом периода устаревания
+    total_ttl = ttl + stale_ttl
+    refresh_margin = ttl * refresh_ahead
+
+    def decorator(func: Callable) -> Callable:
+        key_builder = CacheKeyBuilder(func, normalize)
+        metrics = cache_metrics.of(key_builder.prefix)
+        signature = inspect.signature(func)
+        # Фоновому пересчету нужна своя сессия: сессия запроса к тому моменту закрыта
+        takes_db = "db" in signature.parameters
+
+        def remaining_fresh(payload: bytes) -> Optional[float]:
+            """Секунды до устаревания (< 0 - устарело) или None, если значение уже не годится."""
+            remaining = _fresh_until(payload) - time.time()
+            if remaining <= -stale_ttl:
+                return None
+            return remaining
+
+        def store_local(key: str, payload: bytes) -> None:
+            local_cache.put(key, payload, _fresh_until(payload) + stale_ttl - time.time())
+
+        async def compute(key: str, args: Any, kwargs: Any) -> Tuple[Any, Optional[bytes]]:
+            """Выполняет функцию и сохраняет результат в оба уровня кэша."""
+            lock_key = token = None
+            if use_cluster_lock and redis_client_cache is not None:
+                lock_key, token = f"lock:{key}", secrets.token_hex(16)
+                if not await _acquire_cluster_lock(lock_key, token, lock_timeout):
+                    payload = await _wait_for_peer(key, lock_timeout)
+                    if payload is not None:
+                        try:
+                            result = _decode_cached(key, payload)
+                            store_local(key, payload)
+                            return result, payload
+                        except ValueError:
+                            pass
+                    # Не дождались: считаем сами
+                    lock_key = None
+
+            try:
+                metrics.incr("misses")
+                started = time.perf_counter()
+                result = await func(*args, **kwargs)
+                metrics.compute_latency.observe(time.perf_counter() - started)
+                payload = _serialize_result(key, result, time.time() + ttl)
+                if payload is not None:
+                    await _redis_set(key, total_ttl, payload)
+                    local_cache.put(key, payload, total_ttl)
+                return result, payload
+            finally:
+                if lock_key is not None:
+                    await _release_cluster_lock(lock_key, token)
+
+        async def refresh(key: str, args: Any, kwargs: Any, future: asyncio.Future) -> None:
+            payload = None
+            try:
+                if takes_db:
+                    async with AsyncSessionFactory() as session:
+                        bound = signature.bind(*args, **kwargs)
+                        bound.arguments["db"] = session
+                        _, payload = await compute(key, bound.args, bound.kwargs)
+                else:
+                    _, payload = await compute(key, args, kwargs)
+                logger.debug(f"Refreshed cache in background for key: {key}")
+            except Exception as e:
+                metrics.incr("errors")
+                logger.error(f"Background cache refresh failed for key {key}: {e}")
+            finally:
+                _inflight.pop(key, None)
+                future.set_result(payload)
+
+        def schedule_refresh(key: str, args: Any, kwargs: Any) -> None:
+            if key in _inflight:
+                return
+            future = asyncio.get_running_loop().create_future()
+            _inflight[key] = future
+            metrics.incr("refreshes")
+            task = asyncio.create_task(refresh(key, args, kwargs, future))
+            _background_refreshes.add(task)
+            task.add_done_callback(_background_refreshes.discard)
+
+        def serve(key: str, payload: bytes, args: Any, kwargs: Any) -> Tuple[bool, Any]:
+            """
+            Отдает значение из кэша, при необходимости запуская фоновое обновление.
+
+            Возвращает (False, None), если значение уже не годится для ответа.
+            """
+            remaining = remaining_fresh(payload)
+            if remaining is None:
+                return False, None
+            result = _decode_cached(key, payload)
+            if remaining <= 0:
+                metrics.incr("stale_hits")
+            if remaining <= refresh_margin:
+                schedule_refresh(key, args, kwargs)
+            return True, result
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            key, args_json, args, kwargs = key_builder.bind(args, kwargs)
+            hot_keys.record(key_builder.prefix, args_json)
+
+            # L1: память процесса
+            payload = local_cache.get(key)
+            if payload is not None:
+                try:
+                    found, result = serve(key, payload, args, kwargs)
+                    if found:
+                        metrics.incr("l1_hits")
+                        return result
+                except ValueError:
+                    metrics.incr("errors")
+
+            # Ключ уже пересчитывается в этом процессе - ждем результат
+            inflight = _inflight.get(key)
+            if inflight is not None:
+                metrics.incr("coalesced")
+                payload = await asyncio.shield(inflight)
+                if payload is not None:
+                    try:
+                        return _decode_cached(key, payload)
+                    except ValueError:
+                        pass
+                return await func(*args, **kwargs)
+
+            future = asyncio.get_running_loop().create_future()
+            _inflight[key] = future
+            payload = None
+            needs_refresh = False
+            try:
+                # L2: Redis
+                payload = await _redis_get(key)
+                if payload is not None:
+                    try:
+                        remaining = remaining_fresh(payload)
+                        if remaining is not None:
+                            result = _decode_cached(key, payload)
+                            store_local(key, payload)
+                            metrics.incr("l2_hits")
+                            if remaining <= 0:
+                                metrics.incr("stale_hits")
+                            needs_refresh = remaining <= refresh_margin
+                            return result
+                    except ValueError:
+                        # Если данные в кэше повреждены, удаляем их и выполняем функцию
+                        metrics.incr("errors")
+                        await invalidate_key(key)
+                        logger.warning(f"Deleted corrupted cache entry for key: {key}")
+                    payload = None
+
+                result, payload = await compute(key, args, kwargs)
+                return result
+            finally:
+                _inflight.pop(key, None)
+                # При ошибке ожидающие получат None и выполнят функцию сами
+                future.set_result(payload)
+                if needs_refresh:
+                    schedule_refresh(key, args, kwargs)
+
+        wrapper.cache_key_builder = key_builder
+        cached_functions[key_builder.prefix] = wrapper
+        return wrapper
+
+    return decorator
+
+
+async def invalidate_key(key: str) -> None:
+    """Удаляет ключ из обоих уровней кэша (L1 только в текущем процессе)."""
+    local_cache.delete(key)
+    if redis_client_cache is None:
+        return
+    try:
+        await redis_client_cache.delete(key)
+        logger.debug(f"Invalidated cache key: {key}")
+    except aioredis.RedisError as e:
+        logger.error(f"Redis DELETE error for key {key}: {e}")
+
+
+class NegativeCache:
+    """
+    Кратковременная память о наборах параметров поиска с пустым результатом.
+
+    Запись живет ttl секунд в L1 и в Redis; в ключ входит поколение каталога,
+    поэтому после импорта фильмов прежние «пусто» не действуют.
+    Строковые параметры нормализуются (normalize_text).
+    """
+
+    PREFIX = "cache:negative"
+    MARKER = b"1"
+
+    def __init__(self, ttl: int = 60):
+        self.ttl = ttl
+
+    def _key(self, namespace: str, params: Dict[str, Any]) -> str:
+        key_part = json.dumps(
+            {name: normalize_text(value) for name, value in params.items()},
+            ensure_ascii=False,
+            separators=(",", ":"),
+            sort_keys=True,
+            default=str,
+        )
+        if len(key_part) > CACHE_MAX_KEY_ARGS_LENGTH:
+            key_part = "#" + hashlib.blake2b(
+                key_part.encode("utf-8"), digest_size=16
+            ).hexdigest()
+        return f"{self.PREFIX}:{namespace}:g{catalog_generation.current}:{key_part}"
+
+    async def contains(self, namespace: str, params: Dict[str, Any]) -> bool:
+        """Известно ли, что для этих параметров результат пуст."""
+        if self.ttl <= 0:
+            return False
+        key = self._key(namespace, params)
+        if local_cache.get(key) is not None:
+            return True
+        if await _redis_get(key) is None:
+            return False
+        local_cache.put(key, self.MARKER, self.ttl)
+        return True
+
+    async def add(self, namespace: str, params: Dict[str, Any]) -> None:
+        """Запоминает, что для этих параметров результат пуст."""
+        if self.ttl <= 0:
+            return
+        key = self._key(namespace, params)
+        local_cache.put(key, self.MARKER, self.ttl)
+        await _redis_set(key, self.ttl, self.MARKER)
+
+
+negative_cache = NegativeCache(ttl=int(os.getenv("NEGATIVE_CACHE_TTL", "60")))
+
+
+async def get_cache_memory_usage(scan_count: int = 1000) -> Dict[str, Dict[str, int]]:
+    """
+    Объем памяти Redis, занятый кэшем, по префиксам ключей.
+
+    Проходит все ключи cache:* через SCAN и запрашивает MEMORY USAGE
+    (или длину значения) пайплайном; предназначено для редких
+    административных запросов.
+    """
+    usage: Dict[str, Dict[str, int]] = defaultdict(lambda: {"keys": 0, "bytes": 0})
+    if redis_client_cache is None:
+        return {}
+    batch = []
+
+    async def measure(keys):
+        async with redis_client_cache.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.memory_usage(key)
+                # Запасной вариант, если MEMORY USAGE недоступна
+                pipe.strlen(key)
+            sizes = await pipe.execute(raise_on_error=False)
+        for index, key in enumerate(keys):
+            memory, length = sizes[2 * index], sizes[2 * index + 1]
+            size = memory if isinstance(memory, int) else length
+            if isinstance(size, int) and size:
+                counters = usage[key_prefix_of(key.decode("utf-8", "replace"))]
+                counters["keys"] += 1
+                counters["bytes"] += size
+
+    async for key in redis_client_cache.scan_iter(match="cache:*", count=scan_count):
+        batch.append(key)
+        if len(batch) >= scan_count:
+            await measure(batch)
+            batch = []
+    if batch:
+        await measure(batch)
+    return dict(usage)
+
+
+class CacheMemoryUsage:
+    """
+    Отчет get_cache_memory_usage с ограничением частоты.
+
+    Проход SCAN по всем ключам кэша дорог для Redis, поэтому результат
+    переиспользуется ttl секунд, а одновременные запросы ждут один проход.
+    """
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self._report: Optional[Tuple[float, Dict[str, Dict[str, int]]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(self) -> Dict[str, Dict[str, int]]:
+        if self._report is not None and self._report[0] > time.monotonic():
+            return self._report[1]
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(get_cache_memory_usage())
+        usage = await asyncio.shield(self._task)
+        self._report = (time.monotonic() + self.ttl, usage)
+        return usage
+
+
+cache_memory_usage = CacheMemoryUsage(
+    ttl=float(os.getenv("CACHE_MEMORY_USAGE_TTL", "60"))
+)
+
+
+async def close_cache_connection():
+    """Закрывает пул соединений Redis для кэша."""
+    if redis_pool_cache:
+        await redis_pool_cache.disconnect()
+        logger.info("Redis cache connection pool closed.")
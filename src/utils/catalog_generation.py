@@ -0,0 +1,205 @@
+"""
+Поколение каталога фильмов.
+
+Счетчик в Redis увеличивается (INCR) в конце каждого импорта каталога
+(load_movies.py, import_movies.py) и входит в каждый ключ кэша. После импорта
+ключи меняются, поэтому закэшированные до него ответы больше не отдаются,
+а старые записи просто истекают по TTL. Структуры каталога в памяти
+воркера (GenerationBoundIndex) перестраиваются при смене поколения.
+"""
+
+import abc
+import asyncio
+import logging
+import os
+from typing import Callable, List, Optional
+
+from redis import asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+GENERATION_KEY = "catalog:generation"
+GENERATION_CHANNEL = "catalog:generation"
+
+# INCR и оповещение воркеров новым значением одной атомарной операцией
+BUMP_SCRIPT = """
+local generation = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', ARGV[1], generation)
+return generation
+"""
+
+
+async def bump_catalog_generation(redis_url: Optional[str] = None) -> int:
+    """
+    Атомарно увеличивает поколение каталога и оповещает воркеры.
+
+    Вызывается после успешного commit импорта. Возвращает новое поколение.
+    """
+    redis = aioredis.from_url(redis_url or REDIS_URL, decode_responses=True)
+    try:
+        generation = int(
+            await redis.eval(BUMP_SCRIPT, 1, GENERATION_KEY, GENERATION_CHANNEL)
+        )
+        logger.info(f"Catalog generation bumped to {generation}")
+        return generation
+    finally:
+        await redis.close()
+
+
+class CatalogGeneration:
+    """
+    Текущее поколение каталога в памяти воркера.
+
+    Значение читается синхронно при построении ключа кэша, без обращения
+    к Redis. Фоновая задача обновляет его по сообщениям из канала
+    GENERATION_CHANNEL, а раз в poll_interval секунд перечитывает ключ
+    на случай пропущенных сообщений. Подписчики (add_listener) узнают
+    о смене поколения, чтобы перестроить свои индексы каталога.
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, poll_interval: float = 5.0):
+        self.redis = aioredis.from_url(redis_url, decode_responses=True)
+        self.poll_interval = poll_interval
+        self.current = 0
+        self._watch_task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[int], None]] = []
+
+    def add_listener(self, listener: Callable[[int], None]) -> None:
+        """Регистрирует синхронный обработчик смены поколения."""
+        self._listeners.append(listener)
+
+    def _set(self, generation: int) -> None:
+        if generation != self.current:
+            logger.info(f"Catalog generation changed: {self.current} -> {generation}")
+            self.current = generation
+            for listener in self._listeners:
+                try:
+                    listener(generation)
+                except Exception as e:
+                    logger.error(f"Catalog generation listener failed: {e}")
+
+    async def refresh(self) -> int:
+        """Перечитывает поколение из Redis."""
+        self._set(int(await self.redis.get(GENERATION_KEY) or 0))
+        return self.current
+
+    async def _watch(self) -> None:
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(GENERATION_CHANNEL)
+                # После (пере)подключения часть сообщений могла быть потеряна
+                await self.refresh()
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=self.poll_interval
+                    )
+                    if message is not None and message.get("data"):
+                        self._set(max(self.current, int(message["data"])))
+                    else:
+                        await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Catalog generation watcher error: {e}. Reconnecting...")
+                await asyncio.sleep(self.poll_interval)
+            finally:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+
+    async def start(self) -> None:
+        """Читает текущее поколение и запускает фоновое отслеживание."""
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Failed to read catalog generation: {e}")
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+        await self.redis.close()
+
+
+catalog_generation = CatalogGeneration(
+    poll_interval=float(os.getenv("CATALOG_GENERATION_POLL_INTERVAL", "5"))
+)
+
+
+class GenerationBoundIndex(abc.ABC):
+    """
+    Основа структур каталога в памяти воркера (битовая карта id, словарь
+    жанров, индексы названий, массивы id для /random).
+
+    Структура строится в фоне при старте и при каждой смене поколения
+    каталога, не больше одной загрузки одновременно: смена поколения во
+    время загрузки запускает еще одну после нее. Подкласс реализует только
+    _load(): строит данные и атомарно подменяет текущие. Поколение,
+    прочитанное до начала загрузки, сохраняется в generation; loaded
+    истинно, пока оно совпадает с текущим, а до того вызывающий код
+    обращается к БД.
+    """
+
+    # Название структуры для логов
+    name = "catalog index"
+
+    def __init__(self):
+        # Поколение каталога, на момент которого построены данные
+        self.generation: Optional[int] = None
+        self._load_task: Optional[asyncio.Task] = None
+        # Поколение сменилось во время загрузки - нужна еще одна
+        self._reload_pending = False
+
+    @property
+    def loaded(self) -> bool:
+        return self.generation is not None and self.generation == catalog_generation.current
+
+    @abc.abstractmethod
+    async def _load(self) -> None:
+        """Строит данные по каталогу и атомарно подменяет текущие."""
+
+    async def load(self) -> None:
+        """Строит данные по текущему поколению каталога."""
+        generation = catalog_generation.current
+        await self._load()
+        self.generation = generation
+
+    async def _load_loop(self) -> None:
+        while True:
+            self._reload_pending = False
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Failed to load {self.name}: {e}")
+            if not self._reload_pending:
+                return
+
+    def schedule_reload(self, generation: Optional[int] = None) -> None:
+        """Запускает перестроение в фоне (не чаще одной загрузки одновременно)."""
+        if self._load_task is not None and not self._load_task.done():
+            self._reload_pending = True
+            return
+        self._load_task = asyncio.create_task(self._load_loop())
+
+    async def start(self) -> None:
+        """Подписывается на смену поколения каталога и запускает первую загрузку."""
+        catalog_generation.add_listener(self.schedule_reload)
+        self.schedule_reload()
+
+    async def stop(self) -> None:
+        if self._load_task is not None:
+            self._load_task.cancel()
+            try:
+                await self._load_task
+            except asyncio.CancelledError:
+                pass
+            self._load_task = None
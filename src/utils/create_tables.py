@@ -35,6 +35,8 @@ async def create_tables():
                     logger.warning(f"Error dropping table {table}: {str(e)}")
 
             logger.info("Creating all tables...")
+            # Нужно для trigram-индексов поиска по названию
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
             await conn.run_sync(Base.metadata.create_all)
             logger.info("Tables created successfully!")
 
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from models import Base
 import logging
 
@@ -18,6 +18,9 @@ def create_tables():
         Base.metadata.drop_all(engine)
 
         logger.info("Creating all tables...")
+        # Нужно для trigram-индексов поиска по названию
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         Base.metadata.create_all(engine)
 
         logger.info("Tables created successfully!")
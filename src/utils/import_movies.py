@@ -1,15 +1,23 @@
+"""
+Импорт фильмов из movies.json с созданием таблиц.
+
+Запуск из корня проекта (внутри контейнера api):
+    python -m src.utils.import_movies
+"""
+
 import asyncio
 import json
 import sys
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import sessionmaker
-from models import Base, Movie, Genre, Country, Director, Actor
-from db import engine, AsyncSessionLocal
+from ..db.models import Base, Movie, Genre, Country, Director, Actor
+from ..db.db import engine, AsyncSessionFactory
+from .catalog_generation import bump_catalog_generation
 
 
 async def import_movies_data(json_data: list) -> None:
-    async with AsyncSessionLocal() as session:
+    async with AsyncSessionFactory() as session:
         try:
             for movie_data in json_data:
                 # Проверяем, существует ли фильм
@@ -62,6 +70,9 @@ async def import_movies_data(json_data: list) -> None:
             await session.rollback()
             raise
 
+    # Каталог изменился: новое поколение делает недействительным кэш API
+    await bump_catalog_generation()
+
 
 async def get_or_create(session: AsyncSession, model, **kwargs):
     """Получает существующий объект из БД или создает новый."""
@@ -1,9 +1,17 @@
+"""
+Загрузка фильмов из movies.json в существующие таблицы.
+
+Запуск из корня проекта (внутри контейнера api):
+    python -m src.utils.load_movies
+"""
+
 import asyncio
 import json
 import sys
 from sqlalchemy import select
-from db import AsyncSessionLocal
-from models import Movie, Genre, Country, Director, Actor
+from ..db.db import AsyncSessionFactory
+from ..db.models import Movie, Genre, Country, Director, Actor
+from .catalog_generation import bump_catalog_generation
 import logging
 from datetime import datetime
 
@@ -17,7 +25,7 @@ async def load_movies():
         with open("movies.json", "r", encoding="utf-8") as f:
             movies_data = json.load(f)
 
-        async with AsyncSessionLocal() as session:
+        async with AsyncSessionFactory() as session:
             for movie_data in movies_data:
                 # Создаем или получаем жанры
                 genres = []
@@ -94,6 +102,9 @@ async def load_movies():
             await session.commit()
             logger.info("Movies loaded successfully!")
 
+        # Каталог изменился: новое поколение делает недействительным кэш API
+        await bump_catalog_generation()
+
     except Exception as e:
         logger.error(f"Error loading movies: {str(e)}")
         raise
@@ -1,8 +1,16 @@
+"""
+Миграции схемы для существующей базы.
+
+Запуск из корня проекта (внутри контейнера api):
+    python -m src.utils.migrations
+"""
+
 from sqlalchemy import create_engine, text
-from db import DATABASE_URL
+from ..db.db import SQLALCHEMY_DATABASE_URL
+from ..db.models import MOVIE_SEARCH_VECTOR_SQL
 
-# Используем синхронный URL для PostgreSQL
-sync_url = DATABASE_URL.replace("+asyncpg", "")
+# Используем синхронный драйвер psycopg2 (из requirements.txt)
+sync_url = SQLALCHEMY_DATABASE_URL.replace("+asyncpg", "+psycopg2")
 engine = create_engine(sync_url)
 
 
@@ -48,5 +56,60 @@ def run_migration():
         conn.commit()
 
 
-if __name__ == "__main__":
+# Индексы, которые строятся без блокировки записи (CREATE INDEX CONCURRENTLY)
+CONCURRENT_INDEXES = {
+    # Фильтр по жанру (movie_genres.genre_id IN (...))
+    "ix_movie_genres_genre_id_movie_id": "movie_genres (genre_id, movie_id)",
+    # Поиск по названию (src/services/movie_search.py)
+    "ix_movies_search_vector": "movies USING gin (search_vector)",
+    "ix_movies_title_trgm": "movies USING gin (title gin_trgm_ops)",
+    "ix_movies_original_title_trgm": "movies USING gin (original_title gin_trgm_ops)",
+}
+
+
+def run_search_migration():
+    """
+    Колонка search_vector и индексы поиска и фильтров.
+
+    CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции, поэтому
+    соединение работает в режиме AUTOCOMMIT. Прерванная сборка оставляет
+    невалидный индекс: такой индекс удаляется и строится заново.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+        # Генерируемая колонка: добавление переписывает таблицу movies
+        conn.execute(
+            text(
+                f"""
+            ALTER TABLE movies
+            ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS ({MOVIE_SEARCH_VECTOR_SQL}) STORED
+        """
+            )
+        )
+
+        for name, definition in CONCURRENT_INDEXES.items():
+            invalid = conn.execute(
+                text(
+                    """
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = :name AND NOT i.indisvalid
+            """
+                ),
+                {"name": name},
+            ).scalar()
+            if invalid:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            conn.execute(
+                text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+            )
+
+
+def main():
     run_migration()
+    run_search_migration()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import asyncio
+import datetime
+import os
+import tempfile
+
+import pytest
+
+# Движок БД создается при импорте src.db.db: SQLite-файл нужно задать до импорта
+_DB_DIR = tempfile.mkdtemp(prefix="movies-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_DB_DIR, 'test.db')}"
+os.environ.setdefault("SEARCH_BACKEND", "ilike")
+
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+
+from src.db import models
+from src.db.db import AsyncSessionFactory, Base, engine
+from src.utils import caching
+
+
+@compiles(TSVECTOR, "sqlite")
+def _compile_tsvector(type_, compiler, **kw):
+    # В SQLite нет tsvector и выражения на PostgreSQL для вычисляемой колонки
+    return "TEXT"
+
+
+_search_vector = models.Movie.__table__.c.search_vector
+_search_vector.computed = None
+_search_vector.server_default = None
+
+GENRES = ["драма", "комедия", "фантастика", "боевик", "ужасы"]
+
+# API ключи пользователей из _seed
+ACTIVE_KEY = "active-key"
+BLOCKED_KEY = "blocked-key"
+
+
+async def _seed(movies: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionFactory() as session:
+        genres = [models.Genre(name=name) for name in GENRES]
+        for i in range(1, movies + 1):
+            movie = models.Movie(
+                title=f"Фильм {i}",
+                original_title=f"Movie {i}",
+                year=1990 + i % 30,
+                # У каждого двадцатого фильма нет рейтинга (NULLS LAST в сортировке)
+                rating=i % 10 if i % 20 else None,
+                description=f"Описание {i}",
+                created_at=datetime.datetime(2024, 1, 1),
+            )
+            movie.genres = [genres[i % len(GENRES)], genres[(i + 1) % len(GENRES)]]
+            session.add(movie)
+        for username, active in (("active", True), ("blocked", False)):
+            session.add(
+                models.User(
+                    username=username,
+                    email=f"{username}@example.com",
+                    password_hash="-",
+                    api_key=ACTIVE_KEY if active else BLOCKED_KEY,
+                    is_active=active,
+                )
+            )
+        await session.commit()
+    # Соединения пула привязаны к этому циклу событий
+    await engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def seeded_db():
+    asyncio.run(_seed(60))
+
+
+@pytest.fixture
+def client(seeded_db, monkeypatch):
+    from fastapi.testclient import TestClient
+    from src.main import app
+
+    # Без Redis кэш ответов отключен: каждый запрос доходит до БД
+    monkeypatch.setattr(caching, "redis_client_cache", None)
+    return TestClient(app)
+
+
+@pytest.fixture
+def statements():
+    """Список SQL-запросов, выполненных за время теста."""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    """Глобальный лимитер на fakeredis: Lua-скрипт выполняется через lupa."""
+    import fakeredis
+    from src.services.rate_limiter import SLIDING_WINDOW_SCRIPT, rate_limiter
+
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(rate_limiter, "redis", redis)
+    monkeypatch.setattr(rate_limiter, "_script", redis.register_script(SLIDING_WINDOW_SCRIPT))
+    return rate_limiter
@@ -0,0 +1,84 @@
+import random
+from array import array
+
+from src.services.autocomplete import RangeMinimum, TitleAutocomplete
+
+
+def _table(rows):
+    """Таблица из строк (id, title, original_title, year, rating)."""
+    data = TitleAutocomplete()
+    data.add_rows(rows)
+    data.finish()
+    return data
+
+
+def _ids(data, prefix, limit=10):
+    return [suggestion["id"] for suggestion in data.complete(prefix, limit)]
+
+
+def test_suggestions_are_ranked_by_rating_then_year():
+    data = _table(
+        [
+            (1, "Матрица", "The Matrix", 1999, 8),
+            (2, "Матрица: Перезагрузка", "The Matrix Reloaded", 2003, 7),
+            (3, "Матрица: Революция", "The Matrix Revolutions", 2003, 7),
+            (4, "Матрица: Воскрешение", "The Matrix Resurrections", 2021, None),
+            (5, "Мат", None, 2010, 9),
+        ]
+    )
+
+    # Без рейтинга - в конце, при равном рейтинге новее - выше, затем по id
+    assert _ids(data, "матрица") == [1, 2, 3, 4]
+    assert _ids(data, "мат") == [5, 1, 2, 3, 4]
+    assert _ids(data, "матрица", limit=2) == [1, 2]
+    # Фильм найден и по русскому, и по оригинальному названию - один раз
+    assert _ids(data, "the matrix re") == [2, 3, 4]
+
+
+def test_prefix_is_normalized_and_transliterated():
+    data = _table(
+        [
+            (1, "Ёлки", None, 2010, 6),
+            (2, "Matrix", None, 1999, 8),
+            (3, "Елка", None, 2020, 5),
+        ]
+    )
+
+    assert _ids(data, "  ЁЛ") == [1, 3]
+    assert _ids(data, "elk") == [1, 3]
+    assert _ids(data, "матр") == [2]
+    assert _ids(data, "MATRIX!") == [2]
+
+
+def test_prefix_edge_cases():
+    data = _table([(1, "Матрица", None, 1999, 8), (2, "Я", None, 2000, 5)])
+
+    # Пустой префикс и префикс без букв и цифр не совпадают со всем каталогом
+    assert data.complete("", 10) == []
+    assert data.complete(" - ", 10) == []
+    assert data.complete("матрица 2", 10) == []
+    assert data.complete("ма", 0) == []
+    # Последняя буква алфавита: верхняя граница отрезка не выходит за таблицу
+    assert _ids(data, "я") == [2]
+    assert _table([]).complete("ма", 10) == []
+
+
+def test_suggestion_fields():
+    data = _table([(7, "Фильм", "Film", None, None), (8, "Фильм 2", None, 2001, 0)])
+
+    assert data.complete("фильм", 10) == [
+        {"id": 8, "title": "Фильм 2", "year": 2001, "rating": 0},
+        {"id": 7, "title": "Фильм", "year": None, "rating": None, "original_title": "Film"},
+    ]
+
+
+def test_range_minimum_matches_sorted():
+    rng = random.Random(3)
+    values = array("I", (rng.randrange(200) for _ in range(1000)))
+    rmq = RangeMinimum(values, block=16)
+
+    for _ in range(300):
+        lo = rng.randrange(len(values))
+        hi = rng.randrange(lo + 1, len(values) + 1)
+        assert values[rmq.argmin(lo, hi)] == min(values[lo:hi])
+        assert rmq.smallest(lo, hi, 5) == sorted(set(values[lo:hi]))[:5]
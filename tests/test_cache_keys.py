@@ -0,0 +1,39 @@
+import asyncio
+
+from src.db.db import engine
+from src.services.genre_index import genre_dictionary
+from src.utils.caching import CacheKeyBuilder, clamp_limit
+
+
+async def top_movies(genre=None, limit=10):
+    return genre, limit
+
+
+def test_normalizers_change_only_the_key():
+    builder = CacheKeyBuilder(top_movies, {"limit": clamp_limit(default=10, maximum=50)})
+
+    key, _, args, kwargs = builder.bind(("Драма",), {"limit": 500})
+    assert (args, kwargs) == (("Драма",), {"limit": 500})
+    assert key == builder.bind((), {"genre": "Драма", "limit": 50})[0]
+
+
+def test_genre_is_echoed_as_passed(client, monkeypatch):
+    # Словарь жанров сравнивает без регистра (ILIKE в SQLite - только ASCII)
+    for name in ("generation", "_names", "_resolved"):
+        monkeypatch.setattr(genre_dictionary, name, getattr(genre_dictionary, name))
+
+    async def load():
+        try:
+            await genre_dictionary.load()
+        finally:
+            await engine.dispose()
+
+    asyncio.run(load())
+    for genre in ("ДРАМА", "драма"):
+        response = client.get(f"/genre/{genre}")
+        assert response.status_code == 200
+        assert response.json()["genre"] == genre
+
+        response = client.get("/stats/top", params={"genre": genre})
+        assert response.status_code == 200
+        assert response.json()["filters"]["genre"] == genre
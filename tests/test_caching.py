@@ -0,0 +1,148 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from src.utils import caching
+from src.utils.caching import LocalCache, cache
+
+START = 1_700_000_000.0
+
+
+class Clock:
+    """Часы для time.time()/monotonic()/perf_counter() модуля кэша."""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    monotonic = perf_counter = time
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(START)
+    monkeypatch.setattr(caching, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    """Кэш на fakeredis с пустым L1."""
+    redis = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(caching, "redis_client_cache", redis)
+    monkeypatch.setattr(caching, "local_cache", LocalCache())
+    return redis
+
+
+def counted(**cache_options):
+    """Закэшированная функция, считающая свои вызовы; версия ответа = номер вызова."""
+    calls = []
+
+    @cache(**cache_options)
+    async def compute(item: int):
+        calls.append(item)
+        await asyncio.sleep(0)
+        return {"item": item, "version": len(calls)}
+
+    return compute, calls
+
+
+async def background_refreshes():
+    await asyncio.gather(*list(caching._background_refreshes))
+
+
+def test_concurrent_misses_are_computed_once(redis, clock):
+    async def scenario():
+        compute, calls = counted(ttl=60)
+        metrics = caching.cache_metrics.of(compute.cache_key_builder.prefix)
+        coalesced = metrics.snapshot()["coalesced"]
+
+        results = await asyncio.gather(*[compute(1) for _ in range(10)])
+        assert calls == [1]
+        assert all(result == {"item": 1, "version": 1} for result in results)
+        assert metrics.snapshot()["coalesced"] - coalesced == 9
+
+    asyncio.run(scenario())
+
+
+def test_l1_and_l2_hits_skip_the_function(redis, clock):
+    async def scenario():
+        compute, calls = counted(ttl=60)
+        await compute(1)
+
+        # L1: Redis не нужен
+        await redis.flushall()
+        assert await compute(1) == {"item": 1, "version": 1}
+
+        # L2: другой воркер (пустой L1) читает значение из Redis
+        await compute(2)
+        caching.local_cache.clear()
+        assert await compute(2) == {"item": 2, "version": 2}
+        assert calls == [1, 2]
+
+    asyncio.run(scenario())
+
+
+def test_waiters_compute_themselves_if_leader_fails(redis, clock):
+    async def scenario():
+        calls = []
+
+        @cache(ttl=60)
+        async def flaky(item: int):
+            calls.append(item)
+            await asyncio.sleep(0)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+            return {"item": item}
+
+        results = await asyncio.gather(flaky(1), flaky(1), return_exceptions=True)
+        assert isinstance(results[0], RuntimeError)
+        assert results[1] == {"item": 1}
+
+    asyncio.run(scenario())
+
+
+def test_stale_value_is_served_while_revalidating(redis, clock):
+    async def scenario():
+        compute, calls = counted(ttl=10, stale_ttl=20)
+        await compute(1)
+
+        # Устарело, но в пределах stale_ttl: старый ответ сразу, пересчет в фоне
+        clock.now += 15
+        assert await compute(1) == {"item": 1, "version": 1}
+        await background_refreshes()
+        assert len(calls) == 2
+        assert await compute(1) == {"item": 1, "version": 2}
+
+        # Старше ttl + stale_ttl: пересчитывается до ответа
+        clock.now += 31
+        assert await compute(1) == {"item": 1, "version": 3}
+        await background_refreshes()
+        assert len(calls) == 3
+
+    asyncio.run(scenario())
+
+
+def test_refresh_ahead_updates_before_expiry(redis, clock):
+    async def scenario():
+        compute, calls = counted(ttl=10, refresh_ahead=0.3)
+        await compute(1)
+
+        # До устаревания больше 3 секунд: без обновления
+        clock.now += 5
+        await compute(1)
+        await background_refreshes()
+        assert len(calls) == 1
+
+        # Осталось 2 секунды: ответ из кэша, обновление в фоне, один раз
+        clock.now += 3
+        results = await asyncio.gather(compute(1), compute(1))
+        assert results == [{"item": 1, "version": 1}] * 2
+        await background_refreshes()
+        assert len(calls) == 2
+        assert await compute(1) == {"item": 1, "version": 2}
+
+    asyncio.run(scenario())
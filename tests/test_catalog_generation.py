@@ -0,0 +1,11 @@
+import pytest
+
+from src.utils.catalog_generation import GenerationBoundIndex
+
+
+def test_index_without_load_cannot_be_created():
+    class Incomplete(GenerationBoundIndex):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
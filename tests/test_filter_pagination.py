@@ -0,0 +1,62 @@
+import pytest
+
+from src.services.movie_service import MovieService
+
+MOVIES = 60
+
+
+def rating(movie_id):
+    """Рейтинг фильма из conftest._seed."""
+    return movie_id % 10 if movie_id % 20 else None
+
+
+def expected_order(sort_order):
+    """(рейтинг {asc|desc} NULLS LAST, id ASC) - порядок /filter."""
+    rated = [i for i in range(1, MOVIES + 1) if rating(i) is not None]
+    sign = 1 if sort_order == "asc" else -1
+    rated.sort(key=lambda i: (sign * rating(i), i))
+    return rated + [i for i in range(1, MOVIES + 1) if rating(i) is None]
+
+
+def walk(client, **params):
+    """Все страницы /filter по курсору."""
+    ids, cursor = [], None
+    while True:
+        page = {"page_size": 7, "total": "none"}
+        if cursor:
+            page["cursor"] = cursor
+        response = client.get("/filter", params={**params, **page})
+        assert response.status_code == 200
+        body = response.json()
+        ids += [movie["id"] for movie in body["movies"]]
+        cursor = body["pagination"]["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+@pytest.mark.parametrize("sort_order", ["desc", "asc"])
+def test_cursor_walk_matches_sort_order(client, sort_order):
+    """Равные рейтинги упорядочены по id, фильмы без рейтинга - в конце."""
+    ids = walk(client, sort_by="rating", sort_order=sort_order)
+    assert ids == expected_order(sort_order)
+
+
+def test_cursor_walk_by_title(client):
+    ids = walk(client, sort_by="title", sort_order="asc")
+    assert ids == sorted(range(1, MOVIES + 1), key=lambda i: f"Фильм {i}")
+
+
+def test_cursor_round_trip():
+    cursor = MovieService.encode_cursor("title", "asc", "Фильм «7»", 7)
+    assert MovieService.decode_cursor(cursor, "title", "asc") == ("Фильм «7»", 7)
+
+    with pytest.raises(ValueError):
+        MovieService.decode_cursor(cursor, "title", "desc")
+    with pytest.raises(ValueError):
+        MovieService.decode_cursor("not a cursor", "title", "asc")
+
+
+def test_foreign_cursor_is_rejected(client):
+    cursor = MovieService.encode_cursor("year", "desc", 2000, 1)
+    response = client.get("/filter", params={"sort_by": "rating", "cursor": cursor})
+    assert response.status_code == 400
@@ -0,0 +1,17 @@
+from src.utils.caching import content_hash
+
+
+def test_search_etag_is_content_hash(client):
+    """/search отвечает то из индекса, то из SQL: ETag должен зависеть от тела."""
+    response = client.get("/search", params={"query": "Movie 1", "limit": 3})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag == '"' + content_hash(response.content).decode("ascii") + '"'
+
+    not_modified = client.get(
+        "/search",
+        params={"query": "Movie 1", "limit": 3},
+        headers={"If-None-Match": etag},
+    )
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
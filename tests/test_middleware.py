@@ -0,0 +1,42 @@
+import dataclasses
+
+from src.api.http_caching import NOT_MODIFIED_QUOTA_FREE, http_cache_policies
+from src.services.rate_limiter import FractionalQuota, fractional_quotas
+from src.services.user_cache import user_cache
+
+from conftest import ACTIVE_KEY, BLOCKED_KEY
+
+
+def test_free_not_modified_still_rejects_blocked_user(client, monkeypatch):
+    """Бесплатный 304 не списывает квоту, но ключ и пользователь проверяются."""
+    monkeypatch.setattr(http_cache_policies, "not_modified_quota", NOT_MODIFIED_QUOTA_FREE)
+    monkeypatch.setattr(user_cache, "_entries", type(user_cache._entries)())
+    etag = client.get("/genres").headers["etag"]
+
+    response = client.get(
+        "/genres", headers={"If-None-Match": etag, "X-API-Key": BLOCKED_KEY}
+    )
+    assert response.status_code == 403
+    assert "etag" not in response.headers
+
+
+
+def test_fractional_quota_checks_user_on_every_request(
+    client, limiter, monkeypatch
+):
+    """Запрос без списания квоты все равно проверяет пользователя и отдает заголовки лимита."""
+    monkeypatch.setitem(fractional_quotas, "/autocomplete", FractionalQuota(0.1))
+    monkeypatch.setattr(user_cache, "_entries", type(user_cache._entries)())
+    headers = {"X-API-Key": ACTIVE_KEY}
+
+    charged = client.get("/autocomplete", params={"prefix": "фи"}, headers=headers)
+    free = client.get("/autocomplete", params={"prefix": "фи"}, headers=headers)
+    for response in (charged, free):
+        assert response.headers["x-ratelimit-remaining"] == "999"
+        assert response.headers["x-ratelimit-limit"] == "1000"
+
+    # Пользователя заблокировали: следующий запрос (без списания) получает отказ
+    cached = user_cache.get(ACTIVE_KEY)
+    user_cache.put(ACTIVE_KEY, dataclasses.replace(cached, is_active=False))
+    blocked = client.get("/autocomplete", params={"prefix": "фи"}, headers=headers)
+    assert blocked.status_code == 403
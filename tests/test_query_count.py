@@ -0,0 +1,27 @@
+def test_top_movies_query_count_does_not_depend_on_limit(client, statements):
+    """Жанры страницы загружаются одним запросом, а не запросом на фильм (N+1)."""
+    counts = {}
+    for limit in (1, 50):
+        statements.clear()
+        response = client.get("/stats/top", params={"limit": limit})
+        assert response.status_code == 200
+        assert response.json()["count"] == limit
+        counts[limit] = len(statements)
+
+    assert counts[1] > 0
+    assert counts[1] == counts[50]
+
+
+def test_random_fallback_is_one_query(client, statements):
+    """Без массивов id воркера /random выбирает фильмы одним запросом, а не OFFSET на фильм."""
+    counts = {}
+    for count in (1, 20):
+        statements.clear()
+        response = client.get("/random", params={"count": count, "genre": "драма"})
+        assert response.status_code == 200
+        movies = response.json()["movies"]
+        assert len(movies) == count
+        assert len({movie["id"] for movie in movies}) == count
+        counts[count] = len(statements)
+
+    assert counts[1] == counts[20]
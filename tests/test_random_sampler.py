@@ -0,0 +1,101 @@
+import asyncio
+from array import array
+from collections import Counter
+
+import pytest
+
+from src.api import routes
+from src.db.db import engine
+from src.services.random_sampler import MovieSampler
+from src.utils.catalog_generation import catalog_generation
+
+
+def _sampler(ids, by_genre=None):
+    sampler = MovieSampler()
+    sampler._all = array("I", ids)
+    sampler._by_genre = {
+        genre_id: array("I", genre_ids) for genre_id, genre_ids in (by_genre or {}).items()
+    }
+    sampler.generation = catalog_generation.current
+    return sampler
+
+
+def test_single_movie_is_uniform():
+    sampler = _sampler(range(1, 11))
+    counts = Counter(sampler.sample(1, seed=seed)[0] for seed in range(10000))
+
+    assert set(counts) == set(range(1, 11))
+    # Ожидается 1000 на фильм, стандартное отклонение ~30
+    assert all(abs(count - 1000) < 150 for count in counts.values())
+
+
+def test_sample_is_distinct_and_reproducible():
+    sampler = _sampler(range(1, 101))
+
+    movie_ids = sampler.sample(25, seed=7)
+    assert len(set(movie_ids)) == 25
+    assert sampler.sample(25, seed=7) == movie_ids
+    assert sampler.sample(25, seed=8) != movie_ids
+    # count больше каталога - весь каталог без повторов
+    assert sorted(_sampler([3, 1, 2]).sample(10)) == [1, 2, 3]
+
+
+def test_genre_unions():
+    sampler = _sampler(range(1, 6), {1: [1, 2, 3], 2: [3, 4]})
+
+    assert sorted(sampler.sample(10, frozenset({1}))) == [1, 2, 3]
+    assert sorted(sampler.sample(10, frozenset({1, 2}))) == [1, 2, 3, 4]
+    assert sampler.sample(10, frozenset({9})) == []
+    assert frozenset({1, 2}) in sampler._unions
+
+
+def test_sampler_is_not_ready_until_generation_matches():
+    sampler = MovieSampler()
+    assert sampler.sample(1) is None
+
+    sampler = _sampler([1, 2, 3])
+    sampler.generation = catalog_generation.current - 1
+    assert sampler.sample(1) is None
+
+
+@pytest.fixture
+def loaded_sampler(seeded_db, monkeypatch):
+    """Выборщик /random, загруженный из тестовой БД."""
+    sampler = MovieSampler()
+
+    async def load():
+        try:
+            await sampler.load()
+        finally:
+            await engine.dispose()
+
+    asyncio.run(load())
+    monkeypatch.setattr(routes, "movie_sampler", sampler)
+    return sampler
+
+
+def test_random_uses_loaded_sampler(client, loaded_sampler):
+    assert len(loaded_sampler._all) == 60
+
+    params = {"count": 5, "seed": 42}
+    first = client.get("/random", params=params)
+    second = client.get("/random", params=params)
+    assert first.status_code == 200
+    movie_ids = [movie["id"] for movie in first.json()["movies"]]
+    assert movie_ids == [movie["id"] for movie in second.json()["movies"]]
+    assert movie_ids == loaded_sampler.sample(5, seed=42)
+
+
+def test_random_on_empty_catalog(client, statements, monkeypatch):
+    # Загруженный пустой каталог: 404 без запросов к БД
+    monkeypatch.setattr(routes, "movie_sampler", _sampler([]))
+    response = client.get("/random")
+    assert response.status_code == 404
+    assert response.json() == {"message": "Фильмы не найдены"}
+    assert statements == []
+
+    # Выборщик не готов: фильм выбирается в БД
+    monkeypatch.setattr(routes, "movie_sampler", MovieSampler())
+    response = client.get("/random")
+    assert response.status_code == 200
+    assert statements
@@ -0,0 +1,217 @@
+import asyncio
+
+import fakeredis
+import pytest
+from fakeredis.commands_mixins import server_mixin
+
+from src.services import rate_limiter as rate_limiter_module
+from src.services.rate_limiter import FractionalQuota, LeasingRateLimiter, RateLimiter
+
+PERIOD = 100
+# Начало окна: время Redis кратно периоду
+START = 1_700_000_000
+
+
+class Clock:
+    """Часы для Redis TIME (fakeredis) и time.time()/time.monotonic() лимитера."""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(START)
+    monkeypatch.setattr(server_mixin, "time", clock)
+    monkeypatch.setattr(rate_limiter_module, "time", clock)
+    return clock
+
+
+def make_limiter(cls=RateLimiter, **kwargs):
+    limiter = cls(fakeredis.FakeAsyncRedis(decode_responses=True), **kwargs)
+    limiter.default_period = PERIOD
+    return limiter
+
+
+async def spend(limiter, count, limit=None, identifier="key"):
+    return [
+        await limiter.check_and_update_limit(identifier, limit_override=limit)
+        for _ in range(count)
+    ]
+
+
+def test_limit_within_window(clock):
+    async def scenario():
+        limiter = make_limiter()
+        results = await spend(limiter, 4, limit=3)
+        assert [allowed for allowed, _, _, _ in results] == [True, True, True, False]
+        assert [remaining for _, remaining, _, _ in results] == [2, 1, 0, 0]
+        assert {reset for _, _, _, reset in results} == {START + PERIOD}
+
+        # Отказ не расходует квоту
+        count, _, _ = await limiter.get_usage_info("key")
+        assert count == 3
+
+    asyncio.run(scenario())
+
+
+def test_previous_window_is_weighted_at_boundary(clock):
+    async def scenario():
+        limiter = make_limiter()
+        await spend(limiter, 10, limit=10)
+
+        # Сразу после границы предыдущее окно учитывается целиком
+        clock.now = START + PERIOD
+        allowed, remaining, _, reset = await limiter.check_and_update_limit("key", 10)
+        assert (allowed, remaining, reset) == (False, 0, START + 2 * PERIOD)
+
+        # На середине окна - наполовину: ceil(10 * 0.5) = 5 занято
+        clock.now = START + PERIOD + PERIOD // 2
+        results = await spend(limiter, 6, limit=10)
+        assert [allowed for allowed, _, _, _ in results] == [True] * 5 + [False]
+
+        # Через окно без запросов предыдущее окно пусто
+        clock.now = START + 3 * PERIOD
+        results = await spend(limiter, 10, limit=10)
+        assert all(allowed for allowed, _, _, _ in results)
+
+    asyncio.run(scenario())
+
+
+def test_configured_limit_and_default(clock):
+    async def scenario():
+        limiter = make_limiter()
+        limiter.default_limit = 2
+        assert [r[0] for r in await spend(limiter, 3)] == [True, True, False]
+
+        await limiter.set_user_limit("configured", 1, PERIOD)
+        assert [r[0] for r in await spend(limiter, 2, identifier="configured")] == [
+            True,
+            False,
+        ]
+
+        # Лимит 0 запрещает все запросы
+        assert [r[0] for r in await spend(limiter, 1, limit=0, identifier="zero")] == [
+            False
+        ]
+
+    asyncio.run(scenario())
+
+
+def make_leasing_limiter(**kwargs):
+    options = dict(lease_size=10, lease_ttl=5, max_lease_fraction=0.5, lease_min_requests=2)
+    options.update(kwargs)
+    return make_limiter(LeasingRateLimiter, **options)
+
+
+async def redis_count(limiter, identifier="key"):
+    """Израсходовано по данным Redis (без учета единиц в аренде)."""
+    count, _, _ = await RateLimiter.get_usage_info(limiter, identifier)
+    return count
+
+
+def test_lease_is_acquired_for_hot_key_and_spent_locally(clock):
+    async def scenario():
+        limiter = make_leasing_limiter()
+        results = await spend(limiter, 11, limit=100)
+
+        assert all(allowed for allowed, _, _, _ in results)
+        # Остаток в ответах тот же, что без аренды
+        assert [remaining for _, remaining, _, _ in results] == list(range(99, 88, -1))
+        metrics = limiter.get_lease_metrics()
+        assert metrics["direct_checks"] == 1
+        assert metrics["leases_acquired"] == 1
+        assert metrics["lease_hits"] == 9
+        # Первый запрос и вся аренда из 10 единиц
+        assert await redis_count(limiter) == 11
+        assert metrics["units_held"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_unused_lease_units_are_refunded_on_stop(clock):
+    async def scenario():
+        limiter = make_leasing_limiter()
+        await spend(limiter, 5, limit=100)
+        assert await redis_count(limiter) == 11
+        # Единицы в аренде этого воркера еще не израсходованы
+        count, _, _ = await limiter.get_usage_info("key")
+        assert count == 5
+
+        await limiter.stop()
+        assert await redis_count(limiter) == 5
+        assert limiter.get_lease_metrics()["units_returned"] == 6
+
+    asyncio.run(scenario())
+
+
+def test_expired_lease_is_refunded_and_renewed(clock):
+    async def scenario():
+        limiter = make_leasing_limiter()
+        await spend(limiter, 3, limit=100)
+
+        clock.now += 6
+        allowed, remaining, _, _ = await limiter.check_and_update_limit("key", 100)
+        assert (allowed, remaining) == (True, 96)
+        metrics = limiter.get_lease_metrics()
+        assert metrics["lease_misses"] == 1
+        assert metrics["units_returned"] == 8
+        assert metrics["leases_acquired"] == 2
+        # 4 запроса и 9 единиц новой аренды
+        assert await redis_count(limiter) == 13
+
+    asyncio.run(scenario())
+
+
+def test_leases_never_exceed_limit(clock):
+    async def scenario():
+        limiter = make_leasing_limiter(max_lease_fraction=1.0)
+        results = await spend(limiter, 8, limit=5)
+        assert [allowed for allowed, _, _, _ in results] == [True] * 5 + [False] * 3
+        assert await redis_count(limiter) == 5
+
+    asyncio.run(scenario())
+
+
+def test_fractional_quota_charges_whole_units():
+    quota = FractionalQuota(0.1)
+    due = [quota.due("key") for _ in range(31)]
+
+    # Первый запрос проверяется всегда, дальше - каждый десятый
+    assert [i for i, charged in enumerate(due) if charged] == [0, 10, 20, 30]
+    # Ключи считаются независимо
+    assert quota.due("other") is True
+
+
+def test_fractional_quota_rechecks_after_reject():
+    quota = FractionalQuota(0.25)
+    quota.due("key")
+    quota.remember("key", 0, 10, START)
+    assert quota.due("key") is False
+
+    quota.reject("key")
+    assert quota.due("key") is True
+    assert quota.due("key") is False
+    assert quota.last_limits("key") == (0, 10, START)
+
+
+def test_fractional_quota_bounds():
+    free = FractionalQuota(0)
+    assert not any(free.due("key") for _ in range(5))
+    # Стоимость больше единицы ограничена единицей
+    assert all(FractionalQuota(3).due("key") for _ in range(5))
+
+    quota = FractionalQuota(0.5, max_keys=2)
+    for identifier in ("a", "b"):
+        quota.due(identifier)
+        quota.remember(identifier, 1, 2, START)
+    # Новый ключ сверх max_keys сбрасывает накопленное
+    assert quota.due("c") is True
+    assert quota.last_limits("a") is None
+    assert quota.due("a") is True
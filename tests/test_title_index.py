@@ -0,0 +1,31 @@
+import asyncio
+
+from src.services.title_index import TitleIndex, TitleTrigrams
+from src.utils.catalog_generation import catalog_generation
+
+
+def _index(titles):
+    data = TitleTrigrams()
+    data.add_rows(
+        [(movie_id, title, None, 2000, 7.0) for movie_id, title in enumerate(titles, 1)]
+    )
+    data.finish()
+    index = TitleIndex()
+    index._data = data
+    index.generation = catalog_generation.current
+    return index
+
+
+def test_index_answers_only_full_results():
+    index = _index(["Матрица", "Матрица: Перезагрузка", "Матрица: Революция"])
+
+    assert asyncio.run(index.search("матрица", 3)) is not None
+    # Найдено меньше limit: ответ отдается поиску в БД
+    assert asyncio.run(index.search("матрица", 10)) is None
+
+
+def test_short_queries_go_to_database():
+    index = _index(["A", "Ab", "Abc"])
+
+    assert asyncio.run(index.search("a", 1)) is None
+    assert asyncio.run(index.search("ab", 1)) is None
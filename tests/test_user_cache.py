@@ -0,0 +1,25 @@
+import asyncio
+
+from src.api.middleware import resolve_user
+from src.db.db import engine
+from src.services.user_cache import user_cache
+
+
+def test_unknown_api_key_is_cached(seeded_db, statements, monkeypatch):
+    """Повторный запрос с неверным ключом не открывает сессию БД."""
+    monkeypatch.setattr(user_cache, "_entries", type(user_cache._entries)())
+
+    async def resolve_twice():
+        try:
+            first = await resolve_user("no-such-key")
+            queries = len(statements)
+            second = await resolve_user("no-such-key")
+            return first, second, queries
+        finally:
+            await engine.dispose()
+
+    first, second, queries = asyncio.run(resolve_twice())
+    assert first is None and second is None
+    assert queries > 0
+    assert len(statements) == queries
+    assert user_cache.lookup("no-such-key") == (True, None)